@@ -1,14 +1,20 @@
 import logging
 import asyncio
+import sys
 
 from src.run.Dataset import Dataset
 from src.run.RealtimeRunner import RealtimeRunner
+from src.run.ShardedRealtimeRunner import ShardedRealtimeRunner
 
 from src.melvin.StreamTranscriber import StreamTranscriber
+from src.melvin.BatchScheduler import BatchScheduler
+from src.melvin.OverloadController import OverloadController
+from src.melvin.RetranscriptionScheduler import RetranscriptionScheduler
 
 from src.helper.write_result import outdir_from_setup
 from src.helper.logger import init_logger, set_global_loglevel
 from src.helper.config import CONFIG
+from src.helper.virtual_clock import run_virtual
 
 from dotenv import load_dotenv
 
@@ -34,9 +40,35 @@ method = experiment.get("method", "melvin")
 if method not in ["melvin", "assemblyai"]:
     raise ValueError(f"Method {method} is not supported. Choose 'melvin' or 'assemblyai'.")
 
+transcriber_options = {"encoder_buckets": experiment.get("encoder_buckets", None)}
+pipeline = experiment.get("pipeline", None)
+if pipeline is not None:
+    transcriber_options.update(mode="pipelined", **pipeline)
+
+sharding = experiment.get("sharding", None)
+if method == "melvin" and sharding is not None:
+    # The worker processes load their own models, the samples are not replayed in this process
+    for option in ["batching", "scheduling", "overload"]:
+        if experiment.get(option, None) is not None:
+            logger.warning(f"{option} is not used by the sharded runner, each worker replays one sample at a time")
+    outdir = outdir_from_setup(dataset, None, model_name=experiment["model"])
+    logger.info(outdir)
+    ShardedRealtimeRunner(
+        dataset,
+        out_dir=outdir,
+        model_name=experiment["model"],
+        transcriber_options=transcriber_options,
+        final_model=experiment.get("final_model", None),
+        stream_options=dict(experiment.get("stream", {})),
+        long_session=experiment.get("long_session", None),
+        virtual_clock=experiment.get("virtual_clock", None),
+        **sharding,
+    ).run()
+    sys.exit(0)
+
 w = None
 if method == "melvin":
-    w = StreamTranscriber.for_gpu(experiment["model"], [0])
+    w = StreamTranscriber.for_gpu(experiment["model"], [0], **transcriber_options)
 
 outdir = outdir_from_setup(
     dataset,
@@ -45,9 +77,72 @@ outdir = outdir_from_setup(
 
 logger.info(outdir)
 
+stream_transcriber = w
+batching = experiment.get("batching", None)
+if w is not None and batching is not None:
+    logger.info(f"Batching windows of concurrent streams with {batching}")
+    stream_transcriber = BatchScheduler(w, **batching)
+
+stream_options = dict(experiment.get("stream", {})) if method == "melvin" else {}
+
+final_w = None
+final_model = experiment.get("final_model", None)
+if w is not None and final_model is not None:
+    logger.info(f"Transcribing finals again with {final_model}")
+    final_w = StreamTranscriber.for_gpu(final_model, [0])
+    stream_options["final_transcriber"] = final_w
+
+scheduler = None
+scheduling = experiment.get("scheduling", None)
+if w is not None and scheduling is not None:
+    scheduling = dict(scheduling)
+    if "max_concurrent" not in scheduling:
+        # Let the batch scheduler fill its batches, otherwise run one window per inference thread
+        scheduling["max_concurrent"] = w._num_workers * (batching or {}).get("max_batch_size", 1)
+    logger.info(f"Scheduling retranscriptions globally with {scheduling}")
+    scheduler = RetranscriptionScheduler(**scheduling)
+    stream_options["scheduler"] = scheduler
+
+overload_controller = None
+overload = experiment.get("overload", None)
+if w is not None and overload is not None:
+    overload = dict(overload)
+    degraded_model = overload.pop("degraded_model", None)
+    if degraded_model is not None:
+        overload["degraded_transcriber"] = StreamTranscriber.for_gpu(degraded_model, [0])
+    if hasattr(stream_transcriber, "queue_depth"):
+        overload["queue_depth"] = stream_transcriber.queue_depth
+    logger.info(f"Degrading streams under overload with {overload}")
+    overload_controller = OverloadController(**overload)
+    stream_options["overload_controller"] = overload_controller
+
 async def run():
-    runner = RealtimeRunner(dataset, method=method, stream_transcriber=w, out_dir=outdir)
+    runner = RealtimeRunner(
+        dataset,
+        method=method,
+        stream_transcriber=stream_transcriber,
+        out_dir=outdir,
+        stream_options=stream_options,
+        long_session=experiment.get("long_session", None),
+    )
     await runner.run()
-
-
-asyncio.run(run())
+    if scheduler is not None:
+        logger.info(f"Scheduler stats: {scheduler.stats()}")
+    if overload_controller is not None:
+        logger.info(f"Overload stats: {overload_controller.stats()}")
+    if w is not None:
+        logger.info(f"Token stats: {w.token_stats()}")
+        logger.info(f"Encoder calls per input length: {w.encoder_stats()}")
+        if w.pipeline_stats() is not None:
+            logger.info(f"Pipeline stages: {w.pipeline_stats()}")
+    if final_w is not None:
+        logger.info(f"Final model token stats: {final_w.token_stats()}")
+
+
+virtual_clock = experiment.get("virtual_clock", None)
+if virtual_clock is not None:
+    compute_scale = virtual_clock.get("compute_scale", 1.0)
+    logger.info(f"Replaying on a virtual clock, compute time scaled by {compute_scale}")
+    run_virtual(run(), compute_time=lambda seconds: seconds * compute_scale)
+else:
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+import logging
+import asyncio
+
+from src.melvin.StreamTranscriber import StreamTranscriber
+from src.melvin.BatchScheduler import BatchScheduler
+from src.melvin.OverloadController import OverloadController
+from src.melvin.RetranscriptionScheduler import RetranscriptionScheduler
+from src.melvin.WebsocketServer import WebsocketServer
+
+from src.helper.logger import init_logger, set_global_loglevel
+from src.helper.config import CONFIG
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+init_logger()
+
+log_level = CONFIG.get("log_level", None)
+
+if log_level is not None:
+    set_global_loglevel(log_level)
+
+logger = logging.getLogger("src.Serve")
+
+experiment = CONFIG["experiment"]
+server = dict(CONFIG.get("server", {}))
+
+# The device keys configure the transcribers, the remaining keys the server
+device = server.pop("device", "cuda")
+cpu_threads = server.pop("cpu_threads", 4)
+num_workers = server.pop("num_workers", 1)
+device_index = server.pop("device_index", [0])
+
+
+def load_transcriber(model_name: str, **kwargs) -> StreamTranscriber:
+    if device == "cpu":
+        return StreamTranscriber.for_cpu(model_name, cpu_threads, num_workers, **kwargs)
+    return StreamTranscriber.for_gpu(model_name, device_index, **kwargs)
+
+
+w = load_transcriber(experiment["model"], encoder_buckets=experiment.get("encoder_buckets", None))
+
+# All sessions share the model through the bounded queue of the batch scheduler
+batching = dict(experiment.get("batching", None) or {"max_batch_size": 1, "max_wait_ms": 0})
+batching.setdefault("max_queue_size", server.pop("max_queue_size", 64))
+logger.info(f"Sharing {experiment['model']} between sessions with {batching}")
+stream_transcriber = BatchScheduler(w, **batching)
+
+stream_options = dict(experiment.get("stream", {}))
+
+scheduling = experiment.get("scheduling", None)
+if scheduling is not None:
+    scheduling = dict(scheduling)
+    if "max_concurrent" not in scheduling:
+        scheduling["max_concurrent"] = w._num_workers * batching.get("max_batch_size", 1)
+    logger.info(f"Scheduling retranscriptions globally with {scheduling}")
+    stream_options["scheduler"] = RetranscriptionScheduler(**scheduling)
+
+final_model = experiment.get("final_model", None)
+if final_model is not None:
+    logger.info(f"Transcribing finals again with {final_model}")
+    stream_options["final_transcriber"] = load_transcriber(final_model)
+
+overload_controller = None
+overload = experiment.get("overload", None)
+if overload is not None:
+    overload = dict(overload)
+    degraded_model = overload.pop("degraded_model", None)
+    if degraded_model is not None:
+        overload["degraded_transcriber"] = load_transcriber(degraded_model)
+    logger.info(f"Degrading sessions under overload with {overload}")
+    overload_controller = OverloadController(queue_depth=stream_transcriber.queue_depth, **overload)
+
+asyncio.run(
+    WebsocketServer(
+        stream_transcriber, stream_options=stream_options, overload_controller=overload_controller, **server
+    ).serve_forever()
+)
@@ -26,6 +26,7 @@ class FinalMessage:
     result: list[WordResult]
     reason: str
     observation_time: float
+    early_commits: int = 0
 
 
 @dataclass
@@ -82,6 +83,7 @@ class SampleResult:
                     result=parse_word_result_list(msg["result"]),
                     reason=msg["reason"],
                     observation_time=msg["observation_time"],
+                    early_commits=msg.get("early_commits", 0),
                 )
                 for msg in data
             ]
@@ -66,6 +66,10 @@ def read_config(config_yml_path: str) -> dict:
         ),
         # Transcription default Configuration
         "transcription_default": get_config("transcription_default"),
+        # Named transcription profiles, e.g. for partials and finals
+        "transcription_profiles": get_config("transcription_profiles", default={}),
+        # Websocket server Configuration, see serve.py
+        "server": get_config("server", default={}),
         "supported_language_codes": list(_LANGUAGE_CODES),
     }
 
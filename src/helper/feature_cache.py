@@ -0,0 +1,160 @@
+"""Incremental log-Mel feature cache for the sliding window of a stream"""
+
+import logging
+import threading
+
+import numpy as np
+from faster_whisper.feature_extractor import FeatureExtractor
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FeatureCache:
+    def __init__(self, feature_extractor: FeatureExtractor, capacity_samples: int):
+        """
+        Caches the log-Mel frames of a stream, so a retranscription only computes the STFT of audio that was appended
+        since the previous one.
+
+        Frames are stored on an absolute grid of `hop_length` samples. A frame is cached once all samples of its
+        FFT window have been received. The few frames at the end of a window, which faster-whisper computes from
+        padding, and the normalization over the window are computed per call. The result matches
+        `FeatureExtractor.__call__` on the window, except that the first two frames see the real audio before the
+        window start instead of reflection padding.
+
+        Windows have to start at a multiple of `hop_length` samples, other windows fall back to the full computation.
+
+        Args:
+            feature_extractor: Feature extractor of the model, provides the Mel filters and STFT parameters.
+            capacity_samples: Maximum window length in samples, frames older than this are discarded.
+        """
+        self.feature_extractor = feature_extractor
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.mel_filters = feature_extractor.mel_filters
+        self.fft_window = np.hanning(self.n_fft + 1)[:-1].astype(np.float32)
+
+        self.capacity = capacity_samples // self.hop_length + 1
+        self._frames = np.zeros((self.mel_filters.shape[0], 2 * self.capacity), dtype=np.float32)
+        self._head = 0
+        self._tail = 0
+        # Absolute index of the frame in column `_head`
+        self._first_frame = 0
+        # Samples that are not fully consumed by cached frames, starting at sample `_next_frame * hop - n_fft // 2`
+        self._pending = np.zeros(0, dtype=np.float32)
+        # Absolute sample index up to which audio was fed into the cache, None if the cache was never started
+        self._fed_until = None
+
+        self._lock = threading.Lock()
+        self.computed_frames = 0
+
+    @property
+    def _next_frame(self) -> int:
+        return self._first_frame + self._tail - self._head
+
+    def window_features(self, audio: np.ndarray, start_sample: int) -> np.ndarray:
+        """
+        Returns the normalized log-Mel features of a window, like `FeatureExtractor.__call__(audio)`.
+
+        Args:
+            audio: float32 audio of the window.
+            start_sample: Absolute index of the first sample of the window in the stream.
+        Returns:
+            np.ndarray: Features of shape (n_mels, n_frames).
+        """
+        end_sample = start_sample + len(audio)
+        if start_sample % self.hop_length != 0 or len(audio) < self.n_fft:
+            LOGGER.debug(f"Window at sample {start_sample} cannot use the feature cache")
+            return self.feature_extractor(audio)
+
+        with self._lock:
+            start_frame = start_sample // self.hop_length
+            if self._fed_until is None or start_frame < self._first_frame or self._fed_until < start_sample:
+                self._reset(start_sample)
+            if self._fed_until < end_sample:
+                self._feed(audio[self._fed_until - start_sample:])
+            self._drop_before_frame(start_frame)
+
+            # Frames whose FFT window reaches past the end of the window are computed from padding
+            first_unstable = min((end_sample - self.n_fft // 2) // self.hop_length + 1, self._next_frame)
+            stable = self._frames[:, self._head + start_frame - self._first_frame:self._head + first_unstable - self._first_frame]
+            tail_start = first_unstable * self.hop_length - self.n_fft // 2 - start_sample
+            tail = np.pad(audio[tail_start:], (0, self.hop_length))
+            tail = np.pad(tail, (0, self.n_fft // 2), mode="reflect")
+            log_spec = np.concatenate([stable, self._log_mel(tail)[:, :-1]], axis=1)
+
+        log_spec = np.maximum(log_spec, log_spec.max() - 8.0)
+        return (log_spec + 4.0) / 4.0
+
+    def drop_before(self, sample: int) -> None:
+        """Discards all cached frames that start before `sample`, called when the window start advances"""
+        with self._lock:
+            self._drop_before_frame(sample // self.hop_length)
+
+    def preload(self, audio: np.ndarray) -> None:
+        """
+        Computes the frames of a whole recording at once, used when replaying audio whose content is known upfront.
+        Later windows of the recording only slice the cached frames.
+        """
+        with self._lock:
+            frames = len(audio) // self.hop_length + 1
+            if frames > self.capacity:
+                self.capacity = frames
+                self._frames = np.zeros((self.mel_filters.shape[0], 2 * self.capacity), dtype=np.float32)
+            self._reset(0)
+            self._feed(audio)
+
+    def _reset(self, start_sample: int) -> None:
+        self._head = 0
+        self._tail = 0
+        self._first_frame = start_sample // self.hop_length
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._fed_until = start_sample
+
+    def _feed(self, samples: np.ndarray) -> None:
+        fed = len(samples)
+        if self._tail == self._head and len(self._pending) == 0:
+            # The first frames see reflection padding, as there is no audio before the start
+            if len(samples) <= self.n_fft // 2:
+                return
+            samples = np.pad(samples, (self.n_fft // 2, 0), mode="reflect")
+        pending = np.concatenate([self._pending, samples]) if len(self._pending) > 0 else samples
+        self._fed_until += fed
+        if len(pending) < self.n_fft:
+            self._pending = np.array(pending, dtype=np.float32)
+            return
+
+        log_mel = self._log_mel(pending)
+        self._append_frames(log_mel)
+        self._pending = np.array(pending[log_mel.shape[1] * self.hop_length:], dtype=np.float32)
+
+    def _log_mel(self, samples: np.ndarray) -> np.ndarray:
+        """log10 Mel power of all complete FFT windows in `samples`, without centering or normalization"""
+        n_frames = 1 + (len(samples) - self.n_fft) // self.hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.n_fft)[::self.hop_length][:n_frames]
+        magnitudes = np.abs(np.fft.rfft(frames * self.fft_window, n=self.n_fft, axis=-1).astype(np.complex64)) ** 2
+        mel_spec = self.mel_filters @ magnitudes.T
+        self.computed_frames += n_frames
+        return np.log10(np.clip(mel_spec, a_min=1e-10, a_max=None))
+
+    def _append_frames(self, log_mel: np.ndarray) -> None:
+        count = log_mel.shape[1]
+        if count > self.capacity:
+            self._drop_before_frame(self._next_frame)
+            self._first_frame += count - self.capacity
+            log_mel = log_mel[:, -self.capacity:]
+            count = self.capacity
+        overflow = self._tail - self._head + count - self.capacity
+        if overflow > 0:
+            self._drop_before_frame(self._first_frame + overflow)
+        if self._tail + count > self._frames.shape[1]:
+            length = self._tail - self._head
+            self._frames[:, :length] = self._frames[:, self._head:self._tail]
+            self._head = 0
+            self._tail = length
+        self._frames[:, self._tail:self._tail + count] = log_mel
+        self._tail += count
+
+    def _drop_before_frame(self, frame: int) -> None:
+        count = min(max(frame - self._first_frame, 0), self._tail - self._head)
+        self._head += count
+        self._first_frame += count
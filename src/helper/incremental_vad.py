@@ -0,0 +1,300 @@
+"""Incremental Silero VAD for the sliding window of a stream"""
+
+import logging
+import threading
+from typing import List, Sequence
+
+import numpy as np
+from faster_whisper.vad import VadOptions, get_vad_model
+
+LOGGER = logging.getLogger(__name__)
+
+# Silero VAD scores chunks of 512 samples at 16 kHz, each with the last 64 samples of the previous chunk as context
+VAD_CHUNK_SAMPLES = 512
+VAD_CONTEXT_SAMPLES = 64
+VAD_STATE_SIZE = 128
+
+
+class IncrementalVad:
+    def __init__(self, capacity_samples: int):
+        """
+        Keeps the speech probabilities of a stream on an absolute grid of 512 sample chunks, so a retranscription
+        only runs Silero VAD over audio that was appended since the previous one.
+
+        The recurrent state and the context samples of the model are carried over between calls, so the
+        probabilities are the same as when scoring the whole stream at once. Speech segments of a window are
+        derived from the stored probabilities with the same rules as `faster_whisper.vad.get_speech_timestamps`.
+        Audio at the end of a window that does not fill a whole chunk is not scored, it extends the last segment.
+
+        Args:
+            capacity_samples: Maximum window length in samples, probabilities older than this are discarded.
+        """
+        self.capacity = capacity_samples // VAD_CHUNK_SAMPLES + 1
+        self._probs = np.zeros(2 * self.capacity, dtype=np.float32)
+        self._head = 0
+        self._tail = 0
+        # Absolute index of the chunk in position `_head`
+        self._first_chunk = 0
+        self._state = np.zeros((2, 1, VAD_STATE_SIZE), dtype=np.float32)
+        self._context = np.zeros(VAD_CONTEXT_SAMPLES, dtype=np.float32)
+        # Absolute sample index up to which audio was scored, None if the timeline was never started
+        self._scored_until = None
+
+        self._lock = threading.Lock()
+        self.scored_chunks = 0
+
+    @property
+    def _next_chunk(self) -> int:
+        return self._first_chunk + self._tail - self._head
+
+    def speech_timestamps(self, audio: np.ndarray, start_sample: int, vad_options: VadOptions) -> List[dict]:
+        """
+        Returns the speech segments of a window, like `get_speech_timestamps(audio, vad_options)`.
+
+        Args:
+            audio: float32 audio of the window.
+            start_sample: Absolute index of the first sample of the window in the stream.
+            vad_options: Options for the segmentation.
+        Returns:
+            List[dict]: Start and end sample of each speech segment, relative to the window.
+        """
+        IncrementalVad.score_batch([self], [audio], [start_sample])
+        with self._lock:
+            first_chunk = max(start_sample // VAD_CHUNK_SAMPLES, self._first_chunk)
+            probs = self._probs[self._head + first_chunk - self._first_chunk : self._tail]
+            positions = np.arange(first_chunk, first_chunk + len(probs)) * VAD_CHUNK_SAMPLES - start_sample
+            return segments_from_probs(probs.copy(), np.maximum(positions, 0), len(audio), vad_options)
+
+    @property
+    def scored_until(self) -> int:
+        """Absolute sample index up to which the audio has been scored"""
+        return self._scored_until or 0
+
+    def probabilities_since(self, sample: int) -> np.ndarray:
+        """Returns the speech probabilities of the scored chunks that start at or after `sample`"""
+        with self._lock:
+            first_chunk = max(-(-sample // VAD_CHUNK_SAMPLES), self._first_chunk)
+            return self._probs[self._head + first_chunk - self._first_chunk : self._tail].copy()
+
+    def drop_before(self, sample: int) -> None:
+        """Discards the probabilities of chunks that end before `sample`, called when the window start advances"""
+        with self._lock:
+            self._drop_before_chunk(sample // VAD_CHUNK_SAMPLES)
+
+    @staticmethod
+    def score_batch(vads: Sequence["IncrementalVad"], audios: Sequence[np.ndarray], start_samples: Sequence[int]) -> None:
+        """
+        Scores the new audio of several streams with one encoder call and one batched decoder call per chunk step.
+
+        Args:
+            vads: The incremental VAD of each stream.
+            audios: float32 audio of the current window of each stream.
+            start_samples: Absolute index of the first sample of each window.
+        """
+        # Locks are taken in a fixed order, so concurrent batches of overlapping streams cannot deadlock
+        locks = sorted({id(vad): vad._lock for vad in vads}.items())
+        locks = [lock for _, lock in locks]
+        for lock in locks:
+            lock.acquire()
+        try:
+            new_chunks = {}
+            for vad, audio, start_sample in zip(vads, audios, start_samples):
+                if vad in new_chunks:
+                    continue
+                chunks = vad._take_new_chunks(audio, start_sample)
+                if len(chunks) > 0:
+                    new_chunks[vad] = chunks
+            if len(new_chunks) == 0:
+                return
+
+            model = get_vad_model()
+            inputs = np.concatenate([vad._with_context(chunks) for vad, chunks in new_chunks.items()])
+            encoded = model.encoder_session.run(None, {"input": inputs})[0].reshape(len(inputs), VAD_STATE_SIZE)
+
+            # Pad the encoder outputs of all streams to the same number of steps, the state of streams without
+            # a chunk in a step is kept
+            steps = max(len(chunks) for chunks in new_chunks.values())
+            batch = np.zeros((len(new_chunks), steps, VAD_STATE_SIZE), dtype=np.float32)
+            valid = np.zeros((len(new_chunks), steps), dtype=bool)
+            offset = 0
+            for i, chunks in enumerate(new_chunks.values()):
+                batch[i, : len(chunks)] = encoded[offset : offset + len(chunks)]
+                valid[i, : len(chunks)] = True
+                offset += len(chunks)
+
+            state = np.concatenate([vad._state for vad in new_chunks], axis=1)
+            probs = np.zeros((len(new_chunks), steps), dtype=np.float32)
+            for step in range(steps):
+                out, next_state = model.decoder_session.run(None, {"input": batch[:, step], "state": state})
+                probs[:, step] = out.reshape(-1)
+                state = np.where(valid[None, :, step, None], next_state, state)
+
+            for i, (vad, chunks) in enumerate(new_chunks.items()):
+                vad._state = state[:, i : i + 1]
+                vad._append_probs(probs[i, : len(chunks)])
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def _take_new_chunks(self, audio: np.ndarray, start_sample: int) -> np.ndarray:
+        """Returns the complete chunks of `audio` that have not been scored yet, shape (n, 512)"""
+        end_sample = start_sample + len(audio)
+        if self._scored_until is None or self._scored_until < start_sample or start_sample < self._first_chunk * VAD_CHUNK_SAMPLES:
+            self._reset(start_sample)
+        first = self._scored_until - start_sample
+        count = (end_sample - self._scored_until) // VAD_CHUNK_SAMPLES
+        if count <= 0:
+            return np.zeros((0, VAD_CHUNK_SAMPLES), dtype=np.float32)
+        self._scored_until += count * VAD_CHUNK_SAMPLES
+        return np.asarray(audio[first : first + count * VAD_CHUNK_SAMPLES], dtype=np.float32).reshape(count, VAD_CHUNK_SAMPLES)
+
+    def _with_context(self, chunks: np.ndarray) -> np.ndarray:
+        """Prepends the last samples of the previous chunk to each chunk, as Silero VAD expects"""
+        context = np.empty((len(chunks), VAD_CONTEXT_SAMPLES), dtype=np.float32)
+        context[0] = self._context
+        context[1:] = chunks[:-1, -VAD_CONTEXT_SAMPLES:]
+        self._context = chunks[-1, -VAD_CONTEXT_SAMPLES:].copy()
+        return np.concatenate([context, chunks], axis=1)
+
+    def _reset(self, start_sample: int) -> None:
+        # The chunk grid is anchored at the first sample the timeline sees
+        aligned = start_sample - start_sample % VAD_CHUNK_SAMPLES
+        LOGGER.debug(f"Starting VAD timeline at sample {start_sample}")
+        self._head = 0
+        self._tail = 0
+        self._first_chunk = aligned // VAD_CHUNK_SAMPLES
+        self._state = np.zeros((2, 1, VAD_STATE_SIZE), dtype=np.float32)
+        self._context = np.zeros(VAD_CONTEXT_SAMPLES, dtype=np.float32)
+        self._scored_until = start_sample if start_sample == aligned else aligned + VAD_CHUNK_SAMPLES
+        if start_sample != aligned:
+            # The partial chunk before the grid is treated as silence
+            self._append_probs(np.zeros(1, dtype=np.float32))
+
+    def _append_probs(self, probs: np.ndarray) -> None:
+        count = len(probs)
+        if count > self.capacity:
+            self._drop_before_chunk(self._next_chunk)
+            self._first_chunk += count - self.capacity
+            probs = probs[-self.capacity :]
+            count = self.capacity
+        overflow = self._tail - self._head + count - self.capacity
+        if overflow > 0:
+            self._drop_before_chunk(self._first_chunk + overflow)
+        if self._tail + count > len(self._probs):
+            length = self._tail - self._head
+            self._probs[:length] = self._probs[self._head : self._tail]
+            self._head = 0
+            self._tail = length
+        self._probs[self._tail : self._tail + count] = probs
+        self._tail += count
+        self.scored_chunks += count
+
+    def _drop_before_chunk(self, chunk: int) -> None:
+        count = min(max(chunk - self._first_chunk, 0), self._tail - self._head)
+        self._head += count
+        self._first_chunk += count
+
+
+def segments_from_probs(
+    speech_probs: np.ndarray,
+    positions: np.ndarray,
+    audio_length_samples: int,
+    vad_options: VadOptions,
+    sampling_rate: int = 16000,
+) -> List[dict]:
+    """
+    Turns speech probabilities into padded speech segments, following `faster_whisper.vad.get_speech_timestamps`.
+
+    Args:
+        speech_probs: Speech probability of each VAD chunk.
+        positions: Start sample of each chunk, relative to the audio.
+        audio_length_samples: Length of the audio.
+        vad_options: Thresholds and durations of the segmentation.
+    Returns:
+        List[dict]: Start and end sample of each speech segment.
+    """
+    threshold = vad_options.threshold
+    neg_threshold = vad_options.neg_threshold
+    if neg_threshold is None:
+        neg_threshold = max(threshold - 0.15, 0.01)
+    min_speech_samples = sampling_rate * vad_options.min_speech_duration_ms / 1000
+    speech_pad_samples = sampling_rate * vad_options.speech_pad_ms / 1000
+    max_speech_samples = (
+        sampling_rate * vad_options.max_speech_duration_s - VAD_CHUNK_SAMPLES - 2 * speech_pad_samples
+    )
+    min_silence_samples = sampling_rate * vad_options.min_silence_duration_ms / 1000
+    min_silence_samples_at_max_speech = sampling_rate * 98 / 1000
+
+    triggered = False
+    speeches = []
+    current_speech = {}
+    # to save potential segment end (and tolerate some silence)
+    temp_end = 0
+    # to save potential segment limits in case of maximum segment size reached
+    prev_end = next_start = 0
+
+    for speech_prob, position in zip(speech_probs, positions):
+        position = int(position)
+        if (speech_prob >= threshold) and temp_end:
+            temp_end = 0
+            if next_start < prev_end:
+                next_start = position
+
+        if (speech_prob >= threshold) and not triggered:
+            triggered = True
+            current_speech["start"] = position
+            continue
+
+        if triggered and position - current_speech["start"] > max_speech_samples:
+            if prev_end:
+                current_speech["end"] = prev_end
+                speeches.append(current_speech)
+                current_speech = {}
+                # previously reached silence (< neg_thres) and is still not speech (< thres)
+                if next_start < prev_end:
+                    triggered = False
+                else:
+                    current_speech["start"] = next_start
+                prev_end = next_start = temp_end = 0
+            else:
+                current_speech["end"] = position
+                speeches.append(current_speech)
+                current_speech = {}
+                prev_end = next_start = temp_end = 0
+                triggered = False
+                continue
+
+        if (speech_prob < neg_threshold) and triggered:
+            if not temp_end:
+                temp_end = position
+            # condition to avoid cutting in very short silence
+            if position - temp_end > min_silence_samples_at_max_speech:
+                prev_end = temp_end
+            if position - temp_end < min_silence_samples:
+                continue
+            current_speech["end"] = temp_end
+            if (current_speech["end"] - current_speech["start"]) > min_speech_samples:
+                speeches.append(current_speech)
+            current_speech = {}
+            prev_end = next_start = temp_end = 0
+            triggered = False
+
+    if current_speech and (audio_length_samples - current_speech["start"]) > min_speech_samples:
+        current_speech["end"] = audio_length_samples
+        speeches.append(current_speech)
+
+    for i, speech in enumerate(speeches):
+        if i == 0:
+            speech["start"] = int(max(0, speech["start"] - speech_pad_samples))
+        if i != len(speeches) - 1:
+            silence_duration = speeches[i + 1]["start"] - speech["end"]
+            if silence_duration < 2 * speech_pad_samples:
+                speech["end"] += int(silence_duration // 2)
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - silence_duration // 2))
+            else:
+                speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+                speeches[i + 1]["start"] = int(max(0, speeches[i + 1]["start"] - speech_pad_samples))
+        else:
+            speech["end"] = int(min(audio_length_samples, speech["end"] + speech_pad_samples))
+
+    return speeches
@@ -1,77 +1,228 @@
 import logging
-from typing import Final, List
+import re
+from collections import deque
+from typing import Deque, Final, List, Tuple
+
 from faster_whisper.transcribe import Word
-from pydub.utils import re
+
+from src.helper.word_keys import TokenWord
 
 SENTENCE_TERMINATION_CHARACTERS: Final = ['.', '?', '!']
 
+# Words without token keys are compared by their lower case letters only
+_NON_LETTERS: Final = re.compile(r"[^a-z]")
+
+
+def normalize_word(word: str) -> str:
+    return _NON_LETTERS.sub("", word.lower())
+
+
+def word_key(word: Word) -> int | str:
+    """Key to compare words by: the key of the tokens for a `TokenWord`, the normalized text otherwise"""
+    if isinstance(word, TokenWord) and word.key is not None:
+        return word.key
+    return normalize_word(word.word)
+
+
+def _is_sentence_end(word: str) -> bool:
+    return any(symbol in word for symbol in SENTENCE_TERMINATION_CHARACTERS)
+
+
+def known_prefix_length(keys: List[str], known_keys: List[str], slack: int = 2) -> int | None:
+    """
+    Returns the number of leading `keys` that repeat the `known_keys`, by their text only. If the hypothesis does not
+    repeat them exactly, it is cut after the last known word if that lies within `slack` words of the expected
+    position. Returns None if the known words cannot be found.
+    """
+    if len(known_keys) == 0:
+        return 0
+    if keys[: len(known_keys)] == known_keys:
+        return len(known_keys)
+    last = known_keys[-1]
+    for end in sorted(range(len(known_keys) - slack, len(known_keys) + slack + 1), key=lambda e: abs(e - len(known_keys))):
+        if 0 < end <= len(keys) and keys[end - 1] == last:
+            return end
+    return None
+
+
 class LocalAgreement:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        n: int = 2,
+        early_commit_probability: float = None,
+        early_commit_margin: float = 2.0,
+        match_confirmed_by_text: bool = False,
+    ) -> None:
+        """
+        Confirms the words that `n` consecutive hypotheses agree on (LocalAgreement-n).
+
+        Words are compared by their keys (see `word_key`), which are computed once when they arrive. The confirmed
+        words are kept in a deque and the positions of confirmed sentence ends are tracked while confirming, so
+        merging and flushing do not depend on the number of words the stream produced so far.
+
+        Optionally, words are committed early from a single hypothesis: the words following the agreed ones are
+        confirmed as long as their probability is at least `early_commit_probability` and they end at least
+        `early_commit_margin` seconds before the end of the window. To measure the corrections this causes, the
+        next hypothesis is compared with the early committed words.
+
+        The confirmed words are removed from the start of each hypothesis by their timestamps. Hypotheses with only
+        approximate timestamps (see `approximate_words`) repeat them by their text instead.
+
+        Args:
+            n: Number of consecutive hypotheses that need to agree on a word before it is confirmed.
+            early_commit_probability: Minimum word probability for an early commit, None to disable early commits.
+            early_commit_margin: Minimum distance in seconds between an early committed word and the window end.
+            match_confirmed_by_text: Find the confirmed words at the start of a hypothesis by their text, falling
+                back to the timestamps if they cannot be found.
+        """
+        if n < 2:
+            raise ValueError("LocalAgreement needs at least two hypotheses to agree")
         self.logger = logging.getLogger(__name__)
+        self.n = n
         self.unconfirmed: List[Word] = []
-        self.confirmed: List[Word] = []
-        self.confirmed_contains_sentence_end = False
+        self.confirmed: Deque[Word] = deque()
+        # Word keys of the last n - 1 hypotheses after the confirmed words
+        self._hypotheses: Deque[List[str]] = deque(maxlen=n - 1)
+        # Absolute positions (over all words ever confirmed) of the confirmed words ending a sentence
+        self._sentence_ends: Deque[int] = deque()
+        self._flushed_count = 0
+
+        self.early_commit_probability = early_commit_probability
+        self.early_commit_margin = early_commit_margin
+        self.match_confirmed_by_text = match_confirmed_by_text
+        # Absolute positions of the confirmed words that were committed early
+        self._early_commits: Deque[int] = deque()
+        # Early committed words of the last merge with their keys, checked against the next hypothesis
+        self._unchecked_early_commits: List[Tuple[Word, str]] = []
+        self.early_commit_count = 0
+        self.early_commit_corrections = 0
+        self.flushed_early_commits = 0
+
+    @property
+    def confirmed_contains_sentence_end(self) -> bool:
+        return len(self._sentence_ends) > 0
 
     def clear(self) -> None:
         self.unconfirmed = []
-        self.confirmed = []
-        self.confirmed_contains_sentence_end = False
+        self.confirmed.clear()
+        self._hypotheses.clear()
+        self._sentence_ends.clear()
+        self._early_commits.clear()
+        self._unchecked_early_commits = []
+
+    def forget_hypotheses(self) -> None:
+        """Forgets the previous hypotheses, so the next one is not compared with them. The confirmed words are kept."""
+        self._hypotheses.clear()
 
     def flush_confirmed(self, word_count=None) -> List[Word]:
         self.logger.debug("flush_confirmed called with word_count=%s", word_count)
         if word_count is None:
             self.logger.debug("No word_count provided, flushing all %i confirmed words", len(self.confirmed))
             word_count = len(self.confirmed)
-        flushed = self.confirmed[:word_count]
-        self.confirmed = self.confirmed[word_count:]
-        self.confirmed_contains_sentence_end = any([symbol in self.confirmed for symbol in SENTENCE_TERMINATION_CHARACTERS])
+        word_count = min(word_count, len(self.confirmed))
+        flushed = [self.confirmed.popleft() for _ in range(word_count)]
+        self._flushed_count += word_count
+        while self._sentence_ends and self._sentence_ends[0] < self._flushed_count:
+            self._sentence_ends.popleft()
+        # Number of early committed words in this flush
+        self.flushed_early_commits = 0
+        while self._early_commits and self._early_commits[0] < self._flushed_count:
+            self._early_commits.popleft()
+            self.flushed_early_commits += 1
         self.logger.debug("Flushed %i words, remaining confirmed words: %i", len(flushed), len(self.confirmed))
-        return  flushed
+        return flushed
 
     def flush_at_sentence_end(self) -> List[Word]:
         self.logger.debug("flush_at_sentence_end called")
-        # Get highest index of allowed termination symbol
-        i = len(self.confirmed) - 1
-        ind = None
-        # TODO: Can this be optimized?
-        while i >= 0:
-            if any([
-                symbol in self.confirmed[i].word for symbol in SENTENCE_TERMINATION_CHARACTERS
-            ]):
-                ind = i
-                break
-            i -= 1
-        if ind is None:
+        if not self._sentence_ends:
             return []
-        return self.flush_confirmed(ind + 1)
-    
+        return self.flush_confirmed(self._sentence_ends[-1] - self._flushed_count + 1)
+
     def flush_all(self) -> List[Word]:
-        flushed = self.confirmed + self.unconfirmed
-        self.confirmed = []
+        flushed = list(self.confirmed) + self.unconfirmed
+        self._flushed_count += len(self.confirmed)
+        self.flushed_early_commits = len(self._early_commits)
+        self.confirmed.clear()
         self.unconfirmed = []
-        self.confirmed_contains_sentence_end = False
+        self._hypotheses.clear()
+        self._sentence_ends.clear()
+        self._early_commits.clear()
+        self._unchecked_early_commits = []
         return flushed
 
-    def merge(self, incoming: List[Word]) -> List[Word]:
+    def merge(self, incoming: List[Word], window_end: float = None) -> Deque[Word]:
+        """
+        Merges the words of a new hypothesis.
+        Args:
+            incoming: Words of the new hypothesis.
+            window_end: End time of the transcribed window, needed for early commits.
+        """
+        if self._unchecked_early_commits:
+            self._check_early_commits(incoming)
+        keys = [word_key(w) for w in incoming]
         if len(self.confirmed) > 0:
-            incoming = [w for w in incoming if w.start > self.confirmed[-1].end - 0.1]
-        common_prefix, ind = self.get_common_prefix(incoming)
-
-        if len(common_prefix) > 0 and not self.confirmed_contains_sentence_end:
-            common_prefix_text = " ".join([w.word for w in common_prefix])
-            self.confirmed_contains_sentence_end = any([symbol in common_prefix_text for symbol in SENTENCE_TERMINATION_CHARACTERS])
-
-        self.confirmed += common_prefix
-        # Were all parts validated?
-        if len(common_prefix) < len(incoming):
-            self.unconfirmed = incoming[ind:]
-        else:
-            self.unconfirmed = []
+            known = None
+            if self.match_confirmed_by_text:
+                known = known_prefix_length(keys, [word_key(w) for w in self.confirmed])
+            if known is not None:
+                incoming, keys = incoming[known:], keys[known:]
+            else:
+                confirmed_end = self.confirmed[-1].end - 0.1
+                kept = [i for i, w in enumerate(incoming) if w.start > confirmed_end]
+                incoming, keys = [incoming[i] for i in kept], [keys[i] for i in kept]
+
+        # All n - 1 previous hypotheses have to agree with the incoming one
+        agreed = 0
+        if len(self._hypotheses) == self._hypotheses.maxlen:
+            agreed = len(keys)
+            for hypothesis in self._hypotheses:
+                agreed = min(agreed, len(hypothesis))
+                i = 0
+                while i < agreed and keys[i] == hypothesis[i]:
+                    i += 1
+                agreed = i
+                if agreed == 0:
+                    break
+
+        committed = agreed
+        if self.early_commit_probability is not None and window_end is not None:
+            latest_end = window_end - self.early_commit_margin
+            while (
+                committed < len(incoming)
+                and incoming[committed].probability >= self.early_commit_probability
+                and incoming[committed].end <= latest_end
+            ):
+                committed += 1
+
+        position = self._flushed_count + len(self.confirmed)
+        for i in range(committed):
+            if _is_sentence_end(incoming[i].word):
+                self._sentence_ends.append(position + i)
+            if i >= agreed:
+                self._early_commits.append(position + i)
+            self.confirmed.append(incoming[i])
+        self.early_commit_count += committed - agreed
+        self._unchecked_early_commits = [(incoming[i], keys[i]) for i in range(agreed, committed)]
+
+        # The remaining hypotheses agreed on the confirmed words, they now start after them
+        if committed > 0:
+            for i, hypothesis in enumerate(self._hypotheses):
+                self._hypotheses[i] = hypothesis[committed:]
+        self._hypotheses.append(keys[committed:])
+        self.unconfirmed = incoming[committed:]
         return self.confirmed
 
+    def _check_early_commits(self, incoming: List[Word]) -> None:
+        """Counts the early committed words that the next hypothesis transcribed differently"""
+        for word, key in self._unchecked_early_commits:
+            overlapping = [w for w in incoming if w.start < word.end and w.end > word.start]
+            if overlapping and all(word_key(w) != key for w in overlapping):
+                self.early_commit_corrections += 1
+        self._unchecked_early_commits = []
+
     def get_confirmed_text(self, cutoff_timestamp = 0.0) -> str:
         return " ".join([
-            x.word 
+            x.word
             for x in self.confirmed
             if x.end > cutoff_timestamp + 0.01
         ])
@@ -82,20 +233,13 @@ class LocalAgreement:
     def contains_has_sentence_end(self) -> bool:
         return self.confirmed_contains_sentence_end
 
-    def __norm_word(self, word) -> str:
-        text = word.lower()
-        # Remove non-alphabetic characters using regular expression
-        text = re.sub(r"[^a-z]", "", text)
-        return text.lower().strip().strip(".,?!")
-
     def get_common_prefix(self, new: List[Word]) -> tuple[List[Word], int]:
         """Find common prefix between new words and unconfirmed"""
         i = 0
         while (
             i < len(new)
             and i < len(self.unconfirmed)
-            and self.__norm_word(new[i].word)
-            == self.__norm_word(self.unconfirmed[i].word)
+            and word_key(new[i]) == word_key(self.unconfirmed[i])
         ):
             i += 1
         return new[:i], i
@@ -0,0 +1,29 @@
+"""Helpers to convert 16 bit PCM audio into the float32 waveform faster-whisper expects"""
+
+import numpy as np
+
+# 16 bit PCM
+BYTES_PER_SAMPLE = 2
+
+# Scale used to convert int16 PCM to float32 in [-1, 1] (same as faster-whisper's audio decoding)
+INT16_SCALE = 32768.0
+
+
+def pcm_to_float32(audio) -> np.ndarray:
+    """
+    Converts 16 bit mono PCM audio to a float32 waveform in [-1, 1].
+
+    Args:
+        audio: Raw PCM bytes, an int16 array or an already converted float32 array. float32 arrays are returned as they are, without copying.
+    Returns:
+        np.ndarray: float32 waveform
+    """
+    if isinstance(audio, np.ndarray):
+        if audio.dtype == np.float32:
+            return audio
+        if audio.dtype != np.int16:
+            raise ValueError(f"Unsupported audio dtype {audio.dtype}, expected int16 or float32")
+        samples = audio
+    else:
+        samples = np.frombuffer(audio, dtype=np.int16, count=len(audio) // BYTES_PER_SAMPLE)
+    return np.divide(samples, INT16_SCALE, dtype=np.float32)
@@ -0,0 +1,95 @@
+"""Preallocated audio buffer for the sliding window of a stream"""
+
+import numpy as np
+
+from src.helper.pcm import BYTES_PER_SAMPLE, INT16_SCALE
+
+
+class AudioRingBuffer:
+    def __init__(self, capacity_bytes: int):
+        """
+        Fixed-capacity buffer that keeps the most recent 16 bit mono PCM audio of a stream, both as int16 and as
+        float32 samples. All memory is allocated once on creation.
+
+        The samples are stored in two arrays of twice the capacity. New audio is written behind the current window,
+        so the window is always contiguous and can be handed out as a view without copying. When the write position
+        reaches the end of the active array, the window is moved to the front of the other array. Cutting audio off
+        the front only moves the start index.
+
+        Views returned by `int16()` and `float32()` are never written to by `append` or `cut_off`, they stay valid
+        until at least `capacity_bytes` of further audio have been appended.
+
+        Args:
+            capacity_bytes: Maximum number of bytes kept in the window. When exceeded, the oldest audio is discarded.
+        """
+        self.capacity = capacity_bytes // BYTES_PER_SAMPLE
+        self._storage_size = 2 * self.capacity
+        self._int16 = [np.zeros(self._storage_size, dtype=np.int16) for _ in range(2)]
+        self._float32 = [np.zeros(self._storage_size, dtype=np.float32) for _ in range(2)]
+        self._active = 0
+        self._start = 0
+        self._end = 0
+        self._discarded_samples = 0
+
+    def __len__(self) -> int:
+        """Number of bytes currently held in the window"""
+        return (self._end - self._start) * BYTES_PER_SAMPLE
+
+    @property
+    def capacity_bytes(self) -> int:
+        return self.capacity * BYTES_PER_SAMPLE
+
+    @property
+    def discarded_bytes(self) -> int:
+        """Total number of bytes that have been removed from the front of the window"""
+        return self._discarded_samples * BYTES_PER_SAMPLE
+
+    def append(self, chunk: bytes) -> None:
+        """Appends a chunk of 16 bit PCM audio to the end of the window"""
+        samples = np.frombuffer(chunk, dtype=np.int16, count=len(chunk) // BYTES_PER_SAMPLE)
+        if len(samples) > self.capacity:
+            self._discard(self._end - self._start)
+            self._discarded_samples += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        overflow = (self._end - self._start) + len(samples) - self.capacity
+        if overflow > 0:
+            self._discard(overflow)
+        if self._end + len(samples) > self._storage_size:
+            self._compact()
+
+        end = self._end + len(samples)
+        self._int16[self._active][self._end:end] = samples
+        np.divide(samples, INT16_SCALE, out=self._float32[self._active][self._end:end], dtype=np.float32)
+        self._end = end
+
+    def cut_off(self, num_bytes: int) -> None:
+        """Removes `num_bytes` from the front of the window"""
+        self._discard(min(num_bytes // BYTES_PER_SAMPLE, self._end - self._start))
+
+    def int16(self) -> np.ndarray:
+        """Returns a read-only int16 view of the current window"""
+        return self._view(self._int16[self._active])
+
+    def float32(self) -> np.ndarray:
+        """Returns a read-only float32 view of the current window, scaled to [-1, 1]"""
+        return self._view(self._float32[self._active])
+
+    def _view(self, storage: np.ndarray) -> np.ndarray:
+        view = storage[self._start:self._end]
+        view.flags.writeable = False
+        return view
+
+    def _discard(self, num_samples: int) -> None:
+        num_samples = min(num_samples, self._end - self._start)
+        self._start += num_samples
+        self._discarded_samples += num_samples
+
+    def _compact(self) -> None:
+        """Moves the window to the front of the inactive storage, leaving existing views untouched"""
+        length = self._end - self._start
+        target = 1 - self._active
+        self._int16[target][:length] = self._int16[self._active][self._start:self._end]
+        self._float32[target][:length] = self._float32[self._active][self._start:self._end]
+        self._active = target
+        self._start = 0
+        self._end = length
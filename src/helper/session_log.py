@@ -0,0 +1,47 @@
+"""Append-only on-disk log of the messages of a long streaming session"""
+
+import json
+import os
+from typing import Iterator, Tuple
+
+
+class SessionLog:
+    def __init__(self, path: str):
+        """
+        Writes every message of a session as one JSON line, so only a bounded tail has to stay in memory. The file is
+        only appended to, earlier lines are never rewritten. Reading opens the file separately, so the log can be read
+        while the session is still writing.
+
+        Args:
+            path: File of the log. An existing file is replaced.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+        self.message_count = 0
+
+    def append(self, kind: str, message) -> None:
+        """Appends a message, e.g. of kind "partial" or "final" """
+        self._file.write(json.dumps([kind, message]))
+        self._file.write("\n")
+        self.message_count += 1
+
+    def read(self, kind: str = None) -> Iterator:
+        """Yields the messages in the order they were appended, only the ones of `kind` if given"""
+        for message_kind, message in self.read_all():
+            if kind is None or message_kind == kind:
+                yield message
+
+    def read_all(self) -> Iterator[Tuple[str, object]]:
+        """Yields pairs of (kind, message) in the order they were appended"""
+        if not self._file.closed:
+            self._file.flush()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                kind, message = json.loads(line)
+                yield kind, message
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,105 @@
+"""Pipeline of blocking stages on their own threads, connected by bounded queues"""
+
+import asyncio
+from concurrent.futures import Executor
+from dataclasses import dataclass
+import logging
+from typing import Callable, Dict, List
+
+from src.helper import virtual_clock
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    name: str
+    # Blocking function that turns the output of the previous stage into the input of the next one
+    func: Callable
+    executor: Executor
+    # Items of this stage that run at the same time, usually the number of threads of the executor
+    workers: int = 1
+
+
+class StagePipeline:
+    def __init__(self, stages: List[Stage], max_queue_size: int = 2):
+        """
+        Runs items through a sequence of stages, so different stages work on different items at the same time, e.g.
+        the preprocessing of the next window while the model decodes the current one. Each stage has a queue in front
+        of it. When the queue of a stage is full, the workers of the stage before it wait, so a fast stage runs at most
+        `max_queue_size` items ahead of a slow one and `submit` waits when the first queue is full.
+
+        The queues and workers are created on the first `submit`, on the running event loop.
+
+        Args:
+            stages: The stages in the order an item passes them.
+            max_queue_size: Capacity of the queue in front of each stage.
+        """
+        self.stages = stages
+        self.max_queue_size = max(1, max_queue_size)
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+
+        self.items = {stage.name: 0 for stage in stages}
+        self.busy_seconds = {stage.name: 0.0 for stage in stages}
+        self.wait_seconds = {stage.name: 0.0 for stage in stages}
+
+    async def submit(self, item):
+        """Passes an item through all stages and returns the output of the last one"""
+        self._ensure_workers()
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[0].put((item, future, virtual_clock.now()))
+        return await future
+
+    def queue_depth(self) -> int:
+        """Number of items waiting in front of any stage"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> Dict:
+        """Items, busy time and mean queue wait per stage. Overlap shows as a busy time sum above the wall time."""
+        return {
+            stage.name: {
+                "items": self.items[stage.name],
+                "busy_seconds": round(self.busy_seconds[stage.name], 2),
+                "mean_wait_ms": round(1000 * self.wait_seconds[stage.name] / max(1, self.items[stage.name]), 1),
+            }
+            for stage in self.stages
+        }
+
+    def _ensure_workers(self) -> None:
+        if len(self._workers) > 0 and not any(worker.done() for worker in self._workers):
+            return
+        for worker in self._workers:
+            worker.cancel()
+        self._queues = [asyncio.Queue(maxsize=self.max_queue_size) for _ in self.stages]
+        self._workers = [
+            asyncio.create_task(self._work(index), name=f"stage_{stage.name}_{worker}")
+            for index, stage in enumerate(self.stages)
+            for worker in range(max(1, stage.workers))
+        ]
+
+    async def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        loop = asyncio.get_running_loop()
+        while True:
+            item, future, enqueued_at = await self._queues[index].get()
+            if future.done():
+                # The caller was cancelled, the item is not worked on further
+                continue
+            start_time = virtual_clock.now()
+            self.wait_seconds[stage.name] += start_time - enqueued_at
+            try:
+                result = await loop.run_in_executor(stage.executor, stage.func, item)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                self.busy_seconds[stage.name] += virtual_clock.now() - start_time
+                self.items[stage.name] += 1
+
+            if index + 1 < len(self.stages):
+                # Waits while the next stage is behind
+                await self._queues[index + 1].put((result, future, virtual_clock.now()))
+            elif not future.done():
+                future.set_result(result)
@@ -44,6 +44,25 @@
 #     https://github.com/snakers4/silero-vad.
 #   - vad_parameters: Dictionary of Silero VAD parameters or VadOptions class (see available
 #     parameters and default values in the class VadOptions).
+#   - max_new_tokens: Maximum number of new tokens to generate per chunk. If not set, the maximum will be set by
+#     the default max_length.
+
+# Named profiles overwrite the settings above for some calls, e.g. a cheap profile for partial retranscriptions and
+# an accurate one for windows that are about to be published as final. Profiles from "transcription_profiles" in
+# the config are added to (or replace) these built-in ones.
+DEFAULT_PROFILES = {
+    "partial": {
+        "beam_size": 1,
+        "best_of": 1,
+        "temperature": [0.0, 0.4],
+        "max_new_tokens": 128,
+    },
+    "final": {
+        "beam_size": 5,
+        "best_of": 5,
+        "temperature": [0, 0.2, 0.4, 0.6, 0.8, 1],
+    },
+}
 
 from src.helper.config import CONFIG
 
@@ -79,13 +98,27 @@ class TranscriptionSettings:
             "vad_filter": True,
             "vad_parameters": None,
             "log_progress": False,
+            "max_new_tokens": None,
         }
+        self.profiles = {name: profile.copy() for name, profile in DEFAULT_PROFILES.items()}
         self.apply_config_defaults()
 
-    def get_and_update_settings(self, settings: dict = None) -> dict:
-        """Returns the updated configuration."""
+    def get_and_update_settings(self, settings: dict = None, profile: str = None) -> dict:
+        """
+        Returns the updated configuration.
+
+        Args:
+            settings: Settings that overwrite the defaults.
+            profile: Optional name of a profile that is applied before `settings`.
+        """
 
         updated_config = self.default_settings.copy()
+        if profile is not None:
+            if profile not in self.profiles:
+                raise ValueError(f"Unknown transcription profile: {profile}")
+            for key, value in self.profiles[profile].items():
+                if key in updated_config:
+                    updated_config[key] = value
         if settings:
             for key, value in settings.items():
                 if key in updated_config:
@@ -99,3 +132,5 @@ class TranscriptionSettings:
         for key, _ in self.default_settings.items():
             if key in config:
                 self.default_settings[key] = config[key]
+        for name, profile in (CONFIG.get("transcription_profiles") or {}).items():
+            self.profiles[name] = dict(profile)
@@ -0,0 +1,96 @@
+"""Event loop on a simulated clock, to replay streams faster than real time"""
+
+import asyncio
+import selectors
+import time
+from typing import Callable, Coroutine, Dict, List
+
+
+def now() -> float:
+    """
+    Seconds on the clock of the running event loop if it is a `VirtualTimeLoop`, otherwise `time.perf_counter()`.
+    Code that measures intervals during a stream uses it, so it follows the simulated clock.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return time.perf_counter()
+    if isinstance(loop, VirtualTimeLoop):
+        return loop.time()
+    return time.perf_counter()
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, loop: "VirtualTimeLoop"):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        # The loop waits for its next timer, jump to it instead of waiting
+        if timeout is not None and timeout > 0:
+            self._loop.virtual_time += timeout
+            timeout = 0
+        return super().select(timeout)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, compute_time: Callable[[float], float] = None):
+        """
+        Event loop whose clock only advances when nothing is left to do until the next timer, and then jumps to it.
+        `asyncio.sleep`, timeouts and `now()` follow this clock, so a stream that is replayed in real time, like by
+        `TimedStreamingTranscriber`, runs as fast as the CPU allows with the same timing.
+
+        Blocking work passed to `run_in_executor` (inference, also `asyncio.to_thread`) runs right away on the loop
+        thread while the clock stands still. Its result is delivered when its compute time has passed on the clock,
+        after the work queued before it on the same executor, as if the executor's workers ran it. Work on the loop
+        itself takes no simulated time.
+
+        Args:
+            compute_time: Maps the measured seconds of a blocking call to its simulated seconds, e.g.
+                `lambda seconds: seconds / 2` for hardware that is twice as fast. The measured time if not given.
+        """
+        self.virtual_time = 0.0
+        self.compute_time = compute_time
+        # Simulated time at which each worker of an executor is free again
+        self._workers: Dict[int, List[float]] = {}
+        self.compute_calls = 0
+        self.compute_seconds = 0.0
+        super().__init__(selector=_VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def run_in_executor(self, executor, func, *args) -> asyncio.Future:
+        future = self.create_future()
+        start_time = time.perf_counter()
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        seconds = time.perf_counter() - start_time
+        if self.compute_time is not None:
+            seconds = self.compute_time(seconds)
+
+        # The default executor (None) counts as a single worker
+        workers = self._workers.setdefault(id(executor), [0.0] * max(1, getattr(executor, "_max_workers", 1)))
+        worker = min(range(len(workers)), key=workers.__getitem__)
+        workers[worker] = max(self.virtual_time, workers[worker]) + seconds
+        self.compute_calls += 1
+        self.compute_seconds += seconds
+        self.call_at(workers[worker], _resolve, future, result, error)
+        return future
+
+
+def _resolve(future: asyncio.Future, result, error: Exception) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def run_virtual(main: Coroutine, compute_time: Callable[[float], float] = None):
+    """Runs a coroutine like `asyncio.run`, but on a `VirtualTimeLoop`"""
+    with asyncio.Runner(loop_factory=lambda: VirtualTimeLoop(compute_time)) as runner:
+        return runner.run(main)
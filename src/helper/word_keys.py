@@ -0,0 +1,118 @@
+"""Integer keys of transcribed words, derived from their token ids, to compare hypotheses without string handling"""
+
+from dataclasses import dataclass
+import string
+import threading
+from typing import Dict, List, Tuple
+import unicodedata
+
+import numpy as np
+from faster_whisper.transcribe import Word
+
+# Keys by the lower case text of the words, shared by all vocabularies so the keys of different models match
+_shared_keys: Dict[str, int] = {}
+_shared_keys_lock = threading.Lock()
+
+
+@dataclass
+class TokenWord(Word):
+    # Key of the word's tokens, see `WordKeys`. Words with the same key are the same word.
+    key: int = None
+
+
+class WordKeys:
+    def __init__(self, hf_tokenizer, eot: int, prepend_punctuations: str, append_punctuations: str):
+        """
+        Maps the tokens of decoded text to one integer key per word, the way faster-whisper splits the tokens into
+        words (at spaces and punctuation, with prepended and appended punctuation merged into the neighbouring words).
+
+        Punctuation tokens are not part of a key and every token is replaced by its lower case variant if the
+        vocabulary has one, so "Dog," and "dog." get the same key. The properties of each token are looked up in
+        tables that are built once from the vocabulary, so splitting a hypothesis into keys is integer work.
+
+        The keys are shared by all instances: a word gets the key of its lower case text without punctuation the first
+        time its tokens are seen, so the words of different models (e.g. a final or a degraded model) have the same
+        keys, even if their vocabularies split them into different tokens.
+
+        Args:
+            hf_tokenizer: The `tokenizers.Tokenizer` of the model.
+            eot: Id of the end of text token, all ids from it on are special tokens.
+            prepend_punctuations: Punctuation merged into the following word, see `TranscriptionSettings`.
+            append_punctuations: Punctuation merged into the previous word.
+        """
+        self.eot = eot
+        texts = [hf_tokenizer.decode([token]) for token in range(eot)]
+        first_ids: Dict[str, int] = {}
+        for token, text in enumerate(texts):
+            first_ids.setdefault(text, token)
+
+        self.canonical = np.array([first_ids.get(text.lower(), token) for token, text in enumerate(texts)], dtype=np.int64)
+        # Tokens that start a new word in faster-whisper's split
+        self.starts_word = np.array(
+            [text.startswith(" ") or text.strip() in string.punctuation for text in texts], dtype=bool
+        )
+        # Tokens that only contain punctuation, they do not distinguish words
+        self.punctuation = np.array([_is_punctuation(text) for text in texts], dtype=bool)
+        # Punctuation tokens that are merged into a neighbouring word instead of being a word of their own
+        self.merged = np.array(
+            [
+                self.punctuation[token]
+                and (text.strip() in prepend_punctuations if text.startswith(" ") else text in append_punctuations)
+                for token, text in enumerate(texts)
+            ],
+            dtype=bool,
+        )
+        self._hf_tokenizer = hf_tokenizer
+        # Cache of the shared keys by canonical tokens
+        self._keys: Dict[Tuple[int, ...], int] = {}
+
+    def keys_for_tokens(self, tokens: List[int]) -> List[int]:
+        """Returns the key of each word of the decoded tokens, special tokens are skipped"""
+        keys = []
+        # Canonical non-punctuation tokens and number of all tokens of the current word
+        word: List[int] = []
+        word_size = 0
+        word_is_merged = False
+        for token in tokens:
+            if token >= self.eot:
+                continue
+            if self.starts_word[token] and word_size > 0:
+                if not word_is_merged:
+                    keys.append(self._key(word))
+                word, word_size = [], 0
+            # Only a word of a single merged punctuation token is merged into its neighbour
+            word_is_merged = word_size == 0 and bool(self.merged[token])
+            word_size += 1
+            if not self.punctuation[token]:
+                word.append(int(self.canonical[token]))
+        if word_size > 0 and not word_is_merged:
+            keys.append(self._key(word))
+        return keys
+
+    def key_for_text(self, text: str) -> int:
+        """Returns the key of a single word from its text, for words whose tokens are not known"""
+        tokens = self._hf_tokenizer.encode(" " + text.strip(), add_special_tokens=False).ids
+        return self._key([int(self.canonical[token]) for token in tokens if token < self.eot and not self.punctuation[token]])
+
+    def keyed_words(self, words: List[Word], tokens: List[int]) -> List[TokenWord]:
+        """Adds the keys to the words of a segment, given the tokens the words were decoded from"""
+        keys = self.keys_for_tokens(tokens)
+        if len(keys) != len(words):
+            # The split differs from the one of the decoder, e.g. for words made of punctuation only
+            keys = [self.key_for_text(word.word) for word in words]
+        return [TokenWord(word.start, word.end, word.word, word.probability, key) for word, key in zip(words, keys)]
+
+    def _key(self, canonical_tokens: List[int]) -> int:
+        word = tuple(canonical_tokens)
+        key = self._keys.get(word)
+        if key is None:
+            text = self._hf_tokenizer.decode(list(word)).strip().lower()
+            with _shared_keys_lock:
+                key = _shared_keys.setdefault(text, len(_shared_keys))
+            self._keys[word] = key
+        return key
+
+
+def _is_punctuation(text: str) -> bool:
+    text = text.strip()
+    return len(text) > 0 and all(unicodedata.category(character).startswith("P") for character in text)
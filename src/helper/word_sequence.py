@@ -1,5 +1,33 @@
+import math
+from typing import List
+
+from faster_whisper.transcribe import Segment, Word
+
+
 def word_sequence_to_string(word_sequence) -> str:
     return " ".join([w.word for w in word_sequence])
 
 def word_dict_sequence_to_string(word_sequence) -> str:
-    return " ".join([w['word'] for w in word_sequence])
\ No newline at end of file
+    return " ".join([w['word'] for w in word_sequence])
+
+def approximate_words(segment: Segment, start: float = None) -> List[Word]:
+    """
+    Splits the text of a segment decoded without word timestamps into words. The segment time is distributed over the
+    words by their number of characters and every word gets the mean token probability of the segment.
+
+    Args:
+        segment: The segment, its words are ignored.
+        start: Optional start of the first word if it is later than the segment start, e.g. after a decoder prefix.
+    """
+    texts = [" " + text for text in segment.text.split()]
+    if len(texts) == 0:
+        return []
+    probability = math.exp(segment.avg_logprob)
+    start = segment.start if start is None else min(max(start, segment.start), segment.end)
+    seconds_per_character = (segment.end - start) / sum(len(text) for text in texts)
+    words = []
+    for text in texts:
+        end = start + len(text) * seconds_per_character
+        words.append(Word(start=round(start, 2), end=round(end, 2), word=text, probability=probability))
+        start = end
+    return words
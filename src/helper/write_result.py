@@ -24,11 +24,14 @@ def filename_from_setup(
 def outdir_from_setup(
     dataset: Dataset,
     whisper_transcriber: StreamTranscriber,
+    model_name: str = None,
 ):
+    if model_name is None:
+        model_name = whisper_transcriber._model_name if whisper_transcriber else "assemblyai"
     return "out/{}_{}_{}".format(
         time.strftime("%Y-%m-%d_%H-%M-%S"),
         dataset.dataset_name,
-        whisper_transcriber._model_name if whisper_transcriber else "assemblyai",
+        model_name,
     )
 
 def write_result(
@@ -0,0 +1,207 @@
+"""Module to batch the windows of concurrent streams into shared model calls"""
+
+import asyncio
+from dataclasses import dataclass, field
+import functools
+import logging
+from typing import Dict, List, Tuple
+
+from faster_whisper.transcribe import Segment, Word
+
+from src.helper import virtual_clock
+from src.helper.feature_cache import FeatureCache
+from src.helper.incremental_vad import IncrementalVad
+from src.melvin.StreamTranscriber import StreamTranscriber
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingWindow:
+    audio: object
+    prompt: str
+    future: asyncio.Future
+    feature_cache: FeatureCache = None
+    window_start_sample: int = 0
+    vad: IncrementalVad = None
+    prefix: str = None
+    profile: str = None
+    language: str = None
+    word_timestamps: bool = None
+    enqueued_at: float = field(default_factory=virtual_clock.now)
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        transcriber: StreamTranscriber,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        max_queue_size: int = 0,
+    ):
+        """
+        Sits in front of a shared `StreamTranscriber` and collects the windows that concurrent streams want to
+        transcribe. Windows that arrive within `max_wait_ms` of each other are decoded in one batched model call
+        and the segments are routed back to the waiting streams.
+
+        It can be passed to a melvin `Stream` instead of the transcriber, as it offers the same `transcribe_async`.
+
+        Args:
+            transcriber: The transcriber that runs the model.
+            max_batch_size: Maximum number of windows per model call.
+            max_wait_ms: Maximum time the first window of a batch waits for further windows.
+            max_queue_size: Maximum number of waiting windows, 0 for no limit. Streams wait when the queue is full.
+        """
+        self.transcriber = transcriber
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self._queue: asyncio.Queue = None
+        self._collector: asyncio.Task = None
+        self._batch_tasks = set()
+        # Each inference thread can run one batch at a time
+        self._slots: asyncio.Semaphore = None
+
+        self.batch_count = 0
+        self.window_count = 0
+
+    @property
+    def feature_extractor(self):
+        return self.transcriber.feature_extractor
+
+    def queue_depth(self) -> int:
+        """Number of windows waiting for a batch"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def mean_batch_size(self) -> float:
+        return self.window_count / self.batch_count if self.batch_count > 0 else 0.0
+
+    async def transcribe_async(
+        self,
+        audio_chunk,
+        prompt: str = "",
+        feature_cache: FeatureCache = None,
+        window_start_sample: int = 0,
+        vad: IncrementalVad = None,
+        prefix: str = None,
+        profile: str = None,
+        language: str = None,
+        word_timestamps: bool = None,
+    ) -> List[Segment]:
+        """Queues a window for the next batch and waits for its segments, see `StreamTranscriber.transcribe`"""
+        self._ensure_collector()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            PendingWindow(
+                audio_chunk,
+                prompt,
+                future,
+                feature_cache,
+                window_start_sample,
+                vad,
+                prefix,
+                profile,
+                language,
+                word_timestamps,
+            )
+        )
+        return await future
+
+    async def detect_language_async(self, audio_chunk) -> Tuple[str, float]:
+        """Detects the language of a window right away, it is only needed once per stream and not batched"""
+        return await self.transcriber.detect_language_async(audio_chunk)
+
+    async def align_words_async(self, audio_chunk, words: List[str], language: str = None) -> List[Word]:
+        """Aligns the words of a final right away, see `StreamTranscriber.align_words`"""
+        return await self.transcriber.align_words_async(audio_chunk, words, language)
+
+    def _ensure_collector(self) -> None:
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._slots = asyncio.Semaphore(max(1, self.transcriber._num_workers))
+            self._collector = asyncio.create_task(self._collect_batches(), name="batch_scheduler")
+
+    async def _collect_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[PendingWindow]) -> None:
+        try:
+            # Windows with a decoder prefix have their own prompt, they are decoded one by one
+            for window in [w for w in batch if w.prefix]:
+                try:
+                    segments = await self.transcriber.run_in_executor(
+                        functools.partial(
+                            self.transcriber._transcribe_to_list,
+                            window.audio,
+                            window.prompt,
+                            feature_cache=window.feature_cache,
+                            window_start_sample=window.window_start_sample,
+                            vad=window.vad,
+                            prefix=window.prefix,
+                            profile=window.profile,
+                            language=window.language,
+                            word_timestamps=window.word_timestamps,
+                        )
+                    )
+                except Exception as e:
+                    if not window.future.done():
+                        window.future.set_exception(e)
+                    continue
+                if not window.future.done():
+                    window.future.set_result(segments)
+
+            # Windows only share a model call if they share the decoder prompt and settings
+            groups: Dict[tuple, List[PendingWindow]] = {}
+            for window in batch:
+                if not window.prefix:
+                    key = (window.prompt, window.profile, window.language, window.word_timestamps)
+                    groups.setdefault(key, []).append(window)
+
+            for (prompt, profile, language, word_timestamps), windows in groups.items():
+                start_time = virtual_clock.now()
+                try:
+                    results = await self.transcriber.run_in_executor(
+                        self.transcriber.transcribe_batch,
+                        [w.audio for w in windows],
+                        prompt,
+                        self.max_batch_size,
+                        [w.feature_cache for w in windows],
+                        [w.window_start_sample for w in windows],
+                        [w.vad for w in windows],
+                        profile,
+                        language,
+                        word_timestamps,
+                    )
+                except Exception as e:
+                    for window in windows:
+                        if not window.future.done():
+                            window.future.set_exception(e)
+                    continue
+
+                self.batch_count += 1
+                self.window_count += len(windows)
+                LOGGER.debug(
+                    f"Transcribed batch of {len(windows)} windows in {virtual_clock.now() - start_time:.2f} s "
+                    f"(waited up to {start_time - min(w.enqueued_at for w in windows):.3f} s)"
+                )
+                for window, segments in zip(windows, results):
+                    if not window.future.done():
+                        window.future.set_result(segments)
+        finally:
+            self._slots.release()
@@ -0,0 +1,163 @@
+"""Module to shed load in a defined order when the streams fall behind real time"""
+
+from collections import deque
+import logging
+from typing import Callable, Deque, Dict
+
+from src.helper import virtual_clock
+
+LOGGER = logging.getLogger(__name__)
+
+# Degradation levels, each level includes the measures of the levels before it
+NORMAL = 0
+SKIP_PARTIALS = 1
+SHRINK_WINDOW = 2
+CHEAP_DECODING = 3
+REJECT_SESSIONS = 4
+
+LEVEL_NAMES = ["normal", "skip_partials", "shrink_window", "cheap_decoding", "reject_sessions"]
+
+# Number of recent level changes kept for the stats
+EVENT_HISTORY = 1000
+
+
+class OverloadController:
+    def __init__(
+        self,
+        max_lag_ms: float = 3000.0,
+        max_queue_depth: int = None,
+        queue_depth: Callable[[], int] = None,
+        recover_ratio: float = 0.5,
+        min_level_seconds: float = 5.0,
+        max_level: int = REJECT_SESSIONS,
+        partial_skip_factor: int = 2,
+        degraded_window_ms: float = 8000.0,
+        degraded_profile: str = None,
+        degraded_transcriber=None,
+    ):
+        """
+        Process wide controller that watches the lag of the streams and the queue in front of the model, and
+        degrades the transcription of all streams step by step while they cannot keep up:
+
+        1. skip_partials: Only every `partial_skip_factor`-th triggered retranscription runs.
+        2. shrink_window: The sliding window is kept below `degraded_window_ms` instead of its usual maximum.
+        3. cheap_decoding: Partials are decoded with `degraded_profile` and/or on `degraded_transcriber`.
+        4. reject_sessions: New sessions are rejected by the server.
+
+        The lag of a stream is the audio that arrived while its last merged transcription was waiting and running.
+        The pressure is the largest lag relative to `max_lag_ms`, or the queue depth relative to `max_queue_depth`
+        if that is higher. The level goes up by one while the pressure is at least 1 and down by one while it is
+        below `recover_ratio`, at most once every `min_level_seconds`. The pressure is checked whenever a stream
+        reports or ends and whenever a session asks to start, so the level also recovers once no stream is left.
+        Every change is sent to the output handler of each stream as a "degradation" event, and partials and finals
+        carry the degradation they were produced under, so its latency and WER cost can be evaluated.
+
+        Args:
+            max_lag_ms: Stream lag at which the next level is entered.
+            max_queue_depth: Windows waiting for the model at which the next level is entered, None to ignore it.
+            queue_depth: Returns the number of waiting windows, e.g. `BatchScheduler.queue_depth`.
+            recover_ratio: Pressure below which the previous level is restored.
+            min_level_seconds: Minimum time between two level changes.
+            max_level: Highest level that is used.
+            partial_skip_factor: Retranscriptions per executed one on level skip_partials and above.
+            degraded_window_ms: Maximum window length on level shrink_window and above.
+            degraded_profile: Transcription profile of the partials on level cheap_decoding.
+            degraded_transcriber: Transcriber (usually a smaller model) of the partials on level cheap_decoding.
+        """
+        self.max_lag = max_lag_ms / 1000
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth = queue_depth
+        self.recover_ratio = recover_ratio
+        self.min_level_seconds = min_level_seconds
+        self.max_level = min(max_level, REJECT_SESSIONS)
+        self.partial_skip_factor = max(1, partial_skip_factor)
+        self.degraded_window_ms = degraded_window_ms
+        self.degraded_profile = degraded_profile
+        self.degraded_transcriber = degraded_transcriber
+
+        self.level = NORMAL
+        # Taken on first use, so it follows the clock of the event loop the streams run on (see `virtual_clock`)
+        # even if the controller was created before it started
+        self._level_changed_at: float = None
+        # Last reported lag per stream
+        self._streams: Dict[int, object] = {}
+        self._lags: Dict[int, float] = {}
+        self.events: Deque[Dict] = deque(maxlen=EVENT_HISTORY)
+        self.level_changes = 0
+        self._seconds_per_level = [0.0] * len(LEVEL_NAMES)
+        self.rejected_sessions = 0
+
+    @property
+    def level_name(self) -> str:
+        return LEVEL_NAMES[self.level]
+
+    def register(self, stream) -> None:
+        """Adds a stream, it needs a `set_degradation_level(level, reason)` method"""
+        self._now()
+        self._streams[id(stream)] = stream
+        if self.level > NORMAL:
+            stream.set_degradation_level(self.level, "stream started while degraded")
+
+    def unregister(self, stream) -> None:
+        self._streams.pop(id(stream), None)
+        self._lags.pop(id(stream), None)
+        self._update()
+
+    def accepting_sessions(self) -> bool:
+        # Without streams nothing reports anymore, the level would stay at reject_sessions
+        self._update()
+        accepting = self.level < REJECT_SESSIONS
+        if not accepting:
+            self.rejected_sessions += 1
+        return accepting
+
+    def pressure(self) -> float:
+        pressure = max(self._lags.values(), default=0.0) / self.max_lag
+        if self.max_queue_depth and self.queue_depth is not None:
+            pressure = max(pressure, self.queue_depth() / self.max_queue_depth)
+        return pressure
+
+    def report(self, stream, lag_seconds: float) -> None:
+        """Called by a stream after each merged transcription with its current lag"""
+        if id(stream) not in self._streams:
+            return
+        self._lags[id(stream)] = lag_seconds
+        self._update()
+
+    def _update(self) -> None:
+        """Enters the next or restores the previous level depending on the current pressure"""
+        now = self._now()
+        if now - self._level_changed_at < self.min_level_seconds:
+            return
+        pressure = self.pressure()
+        if pressure >= 1.0 and self.level < self.max_level:
+            self._set_level(self.level + 1, f"pressure {pressure:.2f}", now)
+        elif pressure < self.recover_ratio and self.level > NORMAL:
+            self._set_level(self.level - 1, f"pressure {pressure:.2f}", now)
+
+    def _now(self) -> float:
+        now = virtual_clock.now()
+        if self._level_changed_at is None:
+            self._level_changed_at = now
+        return now
+
+    def _set_level(self, level: int, reason: str, now: float) -> None:
+        self._seconds_per_level[self.level] += now - self._level_changed_at
+        LOGGER.warning(f"Overload level {LEVEL_NAMES[self.level]} -> {LEVEL_NAMES[level]} ({reason})")
+        self.level = level
+        self._level_changed_at = now
+        self.events.append({"time": now, "level": LEVEL_NAMES[level], "reason": reason})
+        self.level_changes += 1
+        for stream in list(self._streams.values()):
+            stream.set_degradation_level(level, reason)
+
+    def stats(self) -> Dict:
+        seconds_per_level = list(self._seconds_per_level)
+        seconds_per_level[self.level] += self._now() - self._level_changed_at
+        return {
+            "level": self.level_name,
+            "level_changes": self.level_changes,
+            "seconds_per_level": dict(zip(LEVEL_NAMES, [round(seconds, 1) for seconds in seconds_per_level])),
+            "rejected_sessions": self.rejected_sessions,
+            "pressure": round(self.pressure(), 2),
+        }
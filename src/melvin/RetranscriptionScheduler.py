@@ -0,0 +1,250 @@
+"""Module to decide which stream is retranscribed next when many streams share a model"""
+
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+from typing import Deque, Dict, Set
+
+from src.helper import virtual_clock
+
+LOGGER = logging.getLogger(__name__)
+
+# Assumed inference time until the cost model has seen two different window lengths
+DEFAULT_COST_SECONDS = 0.5
+
+# Number of recent partial latencies kept per stream for the stats
+LATENCY_HISTORY = 1000
+
+# Number of finished streams whose stats are kept
+FINISHED_STREAM_HISTORY = 1000
+
+
+class OnlineCostModel:
+    def __init__(self, forgetting_factor: float = 0.98):
+        """
+        Linear model of the inference time over the window length, fitted online with exponentially weighted
+        least squares, so it follows changes of the load.
+
+        Args:
+            forgetting_factor: Weight of the previous observations for each new one.
+        """
+        self.forgetting_factor = forgetting_factor
+        self._weight = 0.0
+        self._sum_x = 0.0
+        self._sum_y = 0.0
+        self._sum_xx = 0.0
+        self._sum_xy = 0.0
+        self.observations = 0
+
+    def update(self, window_seconds: float, inference_seconds: float) -> None:
+        decay = self.forgetting_factor
+        self._weight = self._weight * decay + 1
+        self._sum_x = self._sum_x * decay + window_seconds
+        self._sum_y = self._sum_y * decay + inference_seconds
+        self._sum_xx = self._sum_xx * decay + window_seconds * window_seconds
+        self._sum_xy = self._sum_xy * decay + window_seconds * inference_seconds
+        self.observations += 1
+
+    @property
+    def coefficients(self) -> tuple:
+        """Intercept and slope (seconds of inference per second of window)"""
+        if self._weight == 0:
+            return DEFAULT_COST_SECONDS, 0.0
+        mean_x = self._sum_x / self._weight
+        mean_y = self._sum_y / self._weight
+        variance = self._sum_xx / self._weight - mean_x * mean_x
+        if variance < 1e-6:
+            return mean_y, 0.0
+        slope = max((self._sum_xy / self._weight - mean_x * mean_y) / variance, 0.0)
+        return mean_y - slope * mean_x, slope
+
+    def predict(self, window_seconds: float) -> float:
+        intercept, slope = self.coefficients
+        return max(intercept + slope * window_seconds, 0.0)
+
+
+@dataclass
+class ScheduledStream:
+    stream: object
+    priority: float = 1.0
+    # Name of the stream in the stats, unique also after the stream ended
+    name: str = ""
+    # Arrival time of the oldest audio that is not covered by a partial yet, None if there is no pending audio
+    pending_since: float = None
+    pending_bytes: int = 0
+    running_since: float = None
+    last_partial_time: float = None
+    partial_count: int = 0
+    slo_misses: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_HISTORY))
+    window_seconds_total: float = 0.0
+    inference_seconds_total: float = 0.0
+
+
+class RetranscriptionScheduler:
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        target_latency_ms: float = 1500.0,
+        min_new_audio_ms: float = 500.0,
+        bytes_per_second: int = 32000,
+    ):
+        """
+        Process wide scheduler for the retranscriptions of melvin streams. Instead of each stream retriggering after
+        its own interval, streams report received audio and the scheduler starts a retranscription whenever the model
+        has capacity, choosing the stream that is closest to missing the partial latency target.
+
+        The deadline of a stream is the arrival time of its oldest audio without a partial plus `target_latency_ms`.
+        The expected inference time comes from a cost model over the window length that is fitted online. Streams
+        are ordered by their slack (deadline minus expected finish time), weighted by their priority, so a stream
+        with priority 2 gets twice the share of a stream with priority 1 when both are behind.
+
+        Args:
+            max_concurrent: Number of retranscriptions running at the same time, e.g. the number of inference
+                threads, or more if a batch scheduler combines the windows.
+            target_latency_ms: Target time from receiving audio until a partial containing it is published.
+            min_new_audio_ms: Minimum audio a stream needs to receive before it is retranscribed again.
+            bytes_per_second: Bytes per second of the stream audio.
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.target_latency = target_latency_ms / 1000
+        self.min_new_audio_bytes = int(min_new_audio_ms / 1000 * bytes_per_second)
+        self.bytes_per_second = bytes_per_second
+        self.cost_model = OnlineCostModel()
+        self._streams: Dict[int, ScheduledStream] = {}
+        self._running = 0
+        self._busy_seconds = 0.0
+        self._partials = 0
+        self._slo_misses = 0
+        # Start of the utilization period, taken when the first stream registers, so it follows the clock of the
+        # event loop the streams run on (see `virtual_clock`) even if the scheduler was created before it started
+        self._started_at: float = None
+        self._registered = 0
+        # Stats of the streams that ended, by their name
+        self._finished: Dict[str, Dict] = {}
+
+    def register(self, stream, priority: float = 1.0) -> None:
+        """Adds a stream, it needs a `start_transcription()` method that returns the transcription task"""
+        if self._started_at is None:
+            self._started_at = virtual_clock.now()
+        name = f"{self._registered}:{getattr(stream, 'id', f'{id(stream):x}')}"
+        self._registered += 1
+        self._streams[id(stream)] = ScheduledStream(stream, priority=max(priority, 1e-3), name=name)
+
+    def unregister(self, stream) -> None:
+        """Removes a stream, its stats are kept for `stats`"""
+        state = self._streams.pop(id(stream), None)
+        if state is None:
+            return
+        self._finished[state.name] = self._stats_of(state)
+        if len(self._finished) > FINISHED_STREAM_HISTORY:
+            del self._finished[next(iter(self._finished))]
+
+    def notify_audio(self, stream, num_bytes: int) -> None:
+        """Called by a stream for every received chunk of audio"""
+        state = self._streams.get(id(stream))
+        if state is None:
+            return
+        if state.pending_since is None:
+            state.pending_since = virtual_clock.now()
+        state.pending_bytes += num_bytes
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # Streams that could not start now, e.g. because they are closing, the others are still dispatched
+        skipped: Set[int] = set()
+        while self._running < self.max_concurrent:
+            state = self._next_stream(skipped)
+            if state is None:
+                return
+            if not self._start(state):
+                skipped.add(id(state.stream))
+
+    def _next_stream(self, skipped: Set[int] = frozenset()) -> ScheduledStream | None:
+        now = virtual_clock.now()
+        best, best_key = None, None
+        for state in self._streams.values():
+            if state.running_since is not None or state.pending_since is None or id(state.stream) in skipped:
+                continue
+            # A stream whose oldest audio is already late is retranscribed even with little new audio
+            late = now - state.pending_since >= self.target_latency
+            if state.pending_bytes < self.min_new_audio_bytes and not late:
+                continue
+            window_seconds = len(state.stream.sliding_window) / self.bytes_per_second
+            slack = state.pending_since + self.target_latency - now - self.cost_model.predict(window_seconds)
+            key = slack / state.priority if slack > 0 else slack * state.priority
+            if best_key is None or key < best_key:
+                best, best_key = state, key
+        return best
+
+    def _start(self, state: ScheduledStream) -> bool:
+        task = state.stream.start_transcription()
+        if task is None:
+            return False
+        pending_since = state.pending_since
+        window_seconds = len(state.stream.sliding_window) / self.bytes_per_second
+        state.pending_since = None
+        state.pending_bytes = 0
+        state.running_since = virtual_clock.now()
+        self._running += 1
+        task.add_done_callback(lambda _: self._on_done(state, pending_since, window_seconds))
+        return True
+
+    def _on_done(self, state: ScheduledStream, pending_since: float, window_seconds: float) -> None:
+        now = virtual_clock.now()
+        inference_seconds = now - state.running_since
+        self._running -= 1
+        self._busy_seconds += inference_seconds
+        state.running_since = None
+        self.cost_model.update(window_seconds, inference_seconds)
+
+        latency = now - pending_since
+        state.partial_count += 1
+        state.last_partial_time = now
+        state.latencies.append(latency)
+        state.window_seconds_total += window_seconds
+        state.inference_seconds_total += inference_seconds
+        self._partials += 1
+        if latency > self.target_latency:
+            state.slo_misses += 1
+            self._slo_misses += 1
+        self._dispatch()
+
+    def stream_stats(self, stream) -> Dict:
+        state = self._streams.get(id(stream))
+        return self._stats_of(state) if state is not None else {}
+
+    @staticmethod
+    def _stats_of(state: ScheduledStream) -> Dict:
+        latencies = sorted(state.latencies)
+        count = max(state.partial_count, 1)
+        return {
+            "priority": state.priority,
+            "partials": state.partial_count,
+            "slo_misses": state.slo_misses,
+            "mean_latency": sum(latencies) / max(len(latencies), 1),
+            "p95_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+            "mean_window_seconds": state.window_seconds_total / count,
+            "mean_inference_seconds": state.inference_seconds_total / count,
+            "pending_bytes": state.pending_bytes,
+        }
+
+    def stats(self) -> Dict:
+        """Global stats of the scheduler and the stats of the registered and the recently finished streams"""
+        now = virtual_clock.now()
+        elapsed = max(now - (self._started_at if self._started_at is not None else now), 1e-9)
+        intercept, slope = self.cost_model.coefficients
+        streams = dict(self._finished)
+        streams.update({state.name: self._stats_of(state) for state in self._streams.values()})
+        return {
+            "streams": len(self._streams),
+            "finished_streams": self._registered - len(self._streams),
+            "running": self._running,
+            "waiting": sum(1 for s in self._streams.values() if s.pending_since is not None and s.running_since is None),
+            "utilization": self._busy_seconds / (elapsed * self.max_concurrent),
+            "cost_intercept_seconds": intercept,
+            "cost_seconds_per_window_second": slope,
+            "partials": self._partials,
+            "slo_miss_ratio": self._slo_misses / self._partials if self._partials > 0 else 0.0,
+            "per_stream": streams,
+        }
@@ -1,18 +1,56 @@
 """Module to handle the transcription process"""
 
-import io
-from typing import Iterable
-import wave
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+from dataclasses import dataclass
+import functools
+import math
+import threading
+from typing import Callable, Iterable, List, Tuple
 
+import numpy as np
 from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
 from faster_whisper.utils import logging
-from faster_whisper.transcribe import Segment
+from faster_whisper.transcribe import (
+    Segment,
+    TranscriptionOptions,
+    Word,
+    get_suppressed_tokens,
+    merge_punctuations,
+    restore_speech_timestamps,
+)
+from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps, merge_segments
 
+from src.helper.feature_cache import FeatureCache
+from src.helper.incremental_vad import IncrementalVad
 from src.helper.model_handler import ModelHandler
+from src.helper.pcm import pcm_to_float32
+from src.helper.stage_pipeline import Stage, StagePipeline
 from src.helper.transcription_settings import TranscriptionSettings
+from src.helper.word_keys import TokenWord, WordKeys
 
 LOGGER = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class PreparedWindow:
+    """A window after the preprocessing of the pipelined mode, ready for the model"""
+
+    audio: np.ndarray
+    settings: dict
+    # None if the VAD found no speech, the window is not decoded then
+    features: np.ndarray = None
+    # First and last sample of speech if the VAD ran
+    speech_span: Tuple[int, int] = None
+    prefix: str = None
+    # Decoded as a single window with a reduced encoder input, see `encoder_buckets`
+    single_window: bool = False
+
 
 class StreamTranscriber:
     def __init__(
@@ -24,6 +62,9 @@ class StreamTranscriber:
         cpu_threads: int,
         num_workers: int,
         mode: str = "default",
+        encoder_buckets: List[float] = None,
+        pipeline_queue_size: int = 2,
+        preprocess_workers: int = 1,
     ):
         """
         This class converts audio to text. You should use it by initializing a Transcriber once and then pass it to all streams that you want to transcribe at.
@@ -34,8 +75,17 @@ class StreamTranscriber:
             device_index: Which device IDs to use. E.g. for 3 GPUs = [0,1,2]
             compute_type: Quantization of the Whisper model
             cpu_threads: Number of threads to use when running on CPU (4 by default)
-            num_workers: Having multiple workers enables true parallelism when running the model
-            should_use_batched: Should use batched inference pipeline
+            num_workers: Having multiple workers enables true parallelism when running the model. This is also the number of inference threads.
+            mode: "default", "batched" to use faster-whisper's batched inference pipeline, or "pipelined" to split each
+                `transcribe_async` call into a preprocessing stage (PCM conversion, VAD, log-Mel features) on its own
+                threads and a decoding stage on the inference threads, so the next window is preprocessed while the
+                model decodes the current one. On CPU, the preprocessing threads come on top of `cpu_threads`.
+            encoder_buckets: Optional encoder input lengths in whole seconds below 30, e.g. [5, 10, 15]. Windows are
+                padded to the smallest bucket they fit in instead of 30 s and decoded as a single window. Buckets the
+                model does not accept are dropped when the model is loaded.
+            pipeline_queue_size: In the pipelined mode, windows that may wait in front of each stage. The
+                preprocessing runs at most this many windows ahead of the model.
+            preprocess_workers: In the pipelined mode, number of preprocessing threads.
         """
 
         self._log = LOGGER
@@ -51,9 +101,37 @@ class StreamTranscriber:
         if self.should_use_batched:
             self._log.info("Stream transcriber using batched inference pipeline")
             self._batched_model = BatchedInferencePipeline(model=self._model)
+        # Inference is blocking, it runs on these threads so the event loop of the streams stays responsive
+        self._executor = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="whisper_inference")
+        self._pipeline: StagePipeline = None
+        if mode == "pipelined":
+            self._log.info("Stream transcriber preprocessing windows while the model decodes")
+            preprocess_executor = ThreadPoolExecutor(
+                max_workers=max(1, preprocess_workers), thread_name_prefix="whisper_preprocess"
+            )
+            self._pipeline = StagePipeline(
+                [
+                    Stage("preprocess", self._prepare_request, preprocess_executor, preprocess_workers),
+                    Stage("decode", self._decode_prepared, self._executor, num_workers),
+                ],
+                max_queue_size=pipeline_queue_size,
+            )
+
+        # Token counts to compare prefix decoding against full decoding
+        self._stats_lock = threading.Lock()
+        self.generated_tokens = 0
+        self.prefix_tokens = 0
+
+        # Encoder input lengths in frames, ascending and ending with the full 30 s
+        self._encoder_frames = self._supported_encoder_frames(encoder_buckets or [])
+        self.encoder_calls = {frames: 0 for frames in self._encoder_frames}
+
+        # Built from the vocabulary on first use, see `word_keys`
+        self._word_keys: WordKeys = None
+        self._word_keys_lock = threading.Lock()
 
     @classmethod
-    def for_gpu(cls, model_name: str, device_index: list):
+    def for_gpu(cls, model_name: str, device_index: list, **kwargs):
         return cls(
             model_name=model_name,
             device="cuda",
@@ -61,10 +139,11 @@ class StreamTranscriber:
             device_index=device_index,
             cpu_threads=4,
             num_workers=1,
+            **kwargs,
         )
 
     @classmethod
-    def for_cpu(cls, model_name: str, cpu_threads, num_workers):
+    def for_cpu(cls, model_name: str, cpu_threads, num_workers, **kwargs):
         return cls(
             model_name=model_name,
             device="cpu",
@@ -72,8 +151,96 @@ class StreamTranscriber:
             compute_type="int8",
             cpu_threads=cpu_threads,
             num_workers=num_workers,
+            **kwargs,
         )
 
+    def pipeline_stats(self) -> dict | None:
+        """Items, busy time and queue wait per stage of the pipelined mode, None in the other modes"""
+        return self._pipeline.stats() if self._pipeline is not None else None
+
+    def token_stats(self) -> dict:
+        """Generated and forced prefix tokens of all transcriptions, and the share of tokens the prefix saved"""
+        total = self.generated_tokens + self.prefix_tokens
+        return {
+            "generated_tokens": self.generated_tokens,
+            "prefix_tokens": self.prefix_tokens,
+            "saved_ratio": self.prefix_tokens / total if total > 0 else 0.0,
+        }
+
+    def _count_tokens(self, generated: int, prefix: int = 0) -> None:
+        with self._stats_lock:
+            self.generated_tokens += generated
+            self.prefix_tokens += prefix
+
+    def encoder_stats(self) -> dict:
+        """Number of encoder calls per input length in seconds"""
+        time_per_frame = self._model.feature_extractor.time_per_frame
+        return {round(frames * time_per_frame, 2): calls for frames, calls in self.encoder_calls.items()}
+
+    def _supported_encoder_frames(self, buckets: List[float]) -> List[int]:
+        """
+        Returns the encoder input lengths in frames that the model accepts. Some converted models only accept the
+        full 30 s input, every shorter bucket is tried once with silence.
+        """
+        feature_extractor = self._model.feature_extractor
+        full_frames = feature_extractor.nb_max_frames
+        supported = []
+        for seconds in sorted(set(buckets)):
+            # Whole seconds, as the batched pipeline aligns words over the window duration rounded up to seconds
+            frames = math.ceil(seconds) * SAMPLE_RATE // feature_extractor.hop_length
+            if frames <= 0 or frames >= full_frames or frames in supported:
+                continue
+            try:
+                self._model.encode(np.zeros((feature_extractor.mel_filters.shape[0], frames), dtype=np.float32))
+            except (RuntimeError, ValueError) as e:
+                self._log.warning(f"Model does not accept {seconds} s encoder input, using 30 s windows ({e})")
+                break
+            supported.append(frames)
+        if supported:
+            self._log.info(f"Encoder input lengths: {[f * feature_extractor.time_per_frame for f in supported]} s and 30 s")
+        return supported + [full_frames]
+
+    def _encoder_input_frames(self, num_frames: int) -> int:
+        """Smallest supported encoder input length for a window of `num_frames` feature frames"""
+        for frames in self._encoder_frames:
+            if num_frames <= frames:
+                return frames
+        return self._encoder_frames[-1]
+
+    def _encode(self, features: np.ndarray, input_frames: int):
+        with self._stats_lock:
+            self.encoder_calls[input_frames] += 1
+        return self._model.encode(pad_or_trim(features, input_frames))
+
+    @property
+    def word_keys(self) -> WordKeys:
+        """Maps decoded tokens to word keys, so streams compare hypotheses by integers instead of word strings"""
+        if self._word_keys is None:
+            with self._word_keys_lock:
+                if self._word_keys is None:
+                    settings = TranscriptionSettings().default_settings
+                    self._word_keys = WordKeys(
+                        self._model.hf_tokenizer,
+                        Tokenizer(self._model.hf_tokenizer, self._model.model.is_multilingual).eot,
+                        settings["prepend_punctuations"],
+                        settings["append_punctuations"],
+                    )
+        return self._word_keys
+
+    def _keyed_segments(self, segments: List[Segment]) -> List[Segment]:
+        """Replaces the words of the segments by `TokenWord`s with the keys of their tokens"""
+        return [
+            dataclasses.replace(segment, words=self.word_keys.keyed_words(segment.words, segment.tokens))
+            if segment.words and not isinstance(segment.words[0], TokenWord)
+            else segment
+            for segment in segments
+        ]
+
+    @property
+    def feature_extractor(self):
+        """Feature extractor of the loaded model, used to create feature caches for streams"""
+        return self._model.feature_extractor
+
     def _load_model(self) -> None:
         """loads the model if not loaded"""
         ModelHandler().setup_model(self._model_name)
@@ -89,24 +256,546 @@ class StreamTranscriber:
 
     def transcribe(
         self,
-        audio_chunk: bytes,
+        audio_chunk,
         prompt: str = "",
+        feature_cache: FeatureCache = None,
+        window_start_sample: int = 0,
+        vad: IncrementalVad = None,
+        prefix: str = None,
+        profile: str = None,
+        language: str = None,
+        word_timestamps: bool = None,
     ) -> Iterable[Segment]:
-        """Function to run the transcription process"""
-        sample_rate = 16000
-        num_channels = 1
-        sampwidth = 2
-
-        with io.BytesIO() as wav_io:
-            with wave.open(wav_io, "wb") as wav_file:
-                wav_file.setnchannels(num_channels)
-                wav_file.setsampwidth(sampwidth)
-                wav_file.setframerate(sample_rate)
-                wav_file.writeframes(audio_chunk)
-            wav_io.seek(0)
-            settings = TranscriptionSettings().get_and_update_settings(
-                {"initial_prompt": prompt}
+        """
+        Function to run the transcription process
+
+        Args:
+            audio_chunk: 16 kHz mono audio as raw 16 bit PCM bytes, int16 array or float32 array. Arrays are passed to the model without an intermediate WAV file.
+            prompt: Initial prompt for the decoder
+            feature_cache: Optional feature cache of the stream. If given, the log-Mel features are taken from the cache and only computed for new audio.
+            window_start_sample: Absolute index of the first sample of `audio_chunk` in the stream, needed for the feature cache and the VAD.
+            vad: Optional incremental VAD of the stream. If given and `vad_filter` is set, the speech segments are taken from it instead of running VAD over the whole window.
+            prefix: Optional text that is already known at the start of the window. It is forced into the decoder, which only generates the tokens after it. The returned segment only contains the words after the prefix.
+            profile: Optional name of the transcription profile, e.g. "partial" or "final", see `TranscriptionSettings`.
+            language: Optional language code of the window. If given, the language is not detected again, which saves an encoder pass and a detection step per window.
+            word_timestamps: Optional override of the `word_timestamps` setting. Without word timestamps, no alignment pass runs and the segments have no words, see `align_words`.
+        """
+        audio = pcm_to_float32(audio_chunk)
+        settings = TranscriptionSettings().get_and_update_settings(
+            self._settings_overrides(prompt, language, word_timestamps), profile=profile
+        )
+        # Short windows are decoded as a single window with a reduced encoder input, if the model supports it
+        short_window = (
+            self._encoder_input_frames(len(audio) // self._model.feature_extractor.hop_length) < self._encoder_frames[-1]
+        )
+        if prefix or short_window:
+            features = (
+                feature_cache.window_features(audio, window_start_sample)
+                if feature_cache is not None
+                else self._model.feature_extractor(audio)
             )
-            if self.should_use_batched:
-                return self._batched_model.transcribe(wav_io, batch_size=16, **settings)[0]
-            return self._model.transcribe(wav_io, **settings)[0]
\ No newline at end of file
+            return self._transcribe_single_window(audio, features, settings, prefix, vad, window_start_sample)
+        if feature_cache is not None:
+            features = feature_cache.window_features(audio, window_start_sample)
+            return self._transcribe_features(audio, features, settings, vad, window_start_sample)
+        if vad is not None and settings["vad_filter"]:
+            return self._transcribe_speech_chunks(audio, settings, vad, window_start_sample)
+        if self.should_use_batched:
+            return self._batched_model.transcribe(audio, batch_size=16, **settings)[0]
+        return self._model.transcribe(audio, **settings)[0]
+
+    def _transcribe_speech_chunks(
+        self, audio: np.ndarray, settings: dict, vad: IncrementalVad, window_start_sample: int
+    ) -> Iterable[Segment]:
+        """Transcribes a window with the speech segments of the incremental VAD, like faster-whisper's `vad_filter`"""
+        settings = {**settings, "vad_filter": False}
+        if self.should_use_batched:
+            # Same VAD defaults as the batched pipeline uses for its own vad_filter
+            pipeline_defaults = {} if settings["vad_parameters"] else {"min_silence_duration_ms": 160}
+            vad_options = self._vad_options(
+                settings, max_speech_duration_s=self._model.feature_extractor.chunk_length, **pipeline_defaults
+            )
+            speech_chunks = vad.speech_timestamps(audio, window_start_sample, vad_options)
+            if len(speech_chunks) == 0:
+                return []
+            clip_timestamps = merge_segments(speech_chunks, vad_options)
+            return self._batched_model.transcribe(audio, batch_size=16, clip_timestamps=clip_timestamps, **settings)[0]
+
+        speech_chunks = vad.speech_timestamps(audio, window_start_sample, self._vad_options(settings))
+        if len(speech_chunks) == 0:
+            return []
+        audio = np.concatenate(collect_chunks(audio, speech_chunks)[0])
+        segments = self._model.transcribe(audio, **settings)[0]
+        return restore_speech_timestamps(segments, speech_chunks, SAMPLE_RATE)
+
+    def _transcribe_features(
+        self,
+        audio,
+        features: np.ndarray,
+        settings: dict,
+        vad: IncrementalVad = None,
+        window_start_sample: int = 0,
+        speech_span: Tuple[int, int] = None,
+    ) -> Iterable[Segment]:
+        """
+        Decodes precomputed features, mirroring `WhisperModel.transcribe` after its feature extraction. A known
+        `speech_span` restricts decoding like the VAD does.
+        """
+        clip_timestamps = "0"
+        if settings["vad_filter"]:
+            # The features cover the whole window, so VAD restricts decoding to the span containing speech
+            speech_span = self._speech_span(audio, settings, vad, window_start_sample)
+            if speech_span is None:
+                return []
+        if speech_span is not None:
+            clip_timestamps = [speech_span[0] / SAMPLE_RATE, speech_span[1] / SAMPLE_RATE]
+
+        language = settings["language"]
+        if language is None:
+            if self._model.model.is_multilingual:
+                seek = int(float(clip_timestamps[0]) * self._model.frames_per_second) if clip_timestamps != "0" else 0
+                language, _, _ = self._model.detect_language(features=features[..., seek:])
+            else:
+                language = "en"
+
+        tokenizer, options = self._decoding_setup(settings, language, clip_timestamps=clip_timestamps)
+        return self._model.generate_segments(features, tokenizer, options, False)
+
+    def _transcribe_single_window(
+        self,
+        audio: np.ndarray,
+        features: np.ndarray,
+        settings: dict,
+        prefix: str = None,
+        vad: IncrementalVad = None,
+        window_start_sample: int = 0,
+    ) -> List[Segment]:
+        """
+        Decodes a window of at most 30 seconds as one segment, padded to the smallest supported encoder input length.
+        With a `prefix`, it is forced into the decoder. The word timestamps are aligned over prefix and generated
+        tokens together, so the generated words get the same timing as in a full decode.
+        """
+        if settings["vad_filter"] and self._speech_span(audio, settings, vad, window_start_sample) is None:
+            return []
+
+        num_frames = min(features.shape[-1] - 1, self._model.feature_extractor.nb_max_frames)
+        encoder_output = self._encode(features[:, :num_frames], self._encoder_input_frames(num_frames))
+
+        language = settings["language"]
+        if language is None and self._model.model.is_multilingual:
+            language_token, _ = self._model.model.detect_language(encoder_output)[0][0]
+            language = language_token[2:-2]
+        tokenizer, options = self._decoding_setup(
+            {**settings, "without_timestamps": True, "prefix": prefix}, language or "en"
+        )
+
+        prefix_tokens = tokenizer.encode(" " + prefix.strip()) if prefix else []
+        if len(prefix_tokens) >= self._model.max_length // 2:
+            # faster-whisper would truncate the prefix, decode the window without it
+            self._log.debug(f"Prefix of {len(prefix_tokens)} tokens is too long, decoding without prefix")
+            segments = list(self._transcribe_features(audio, features, settings, vad, window_start_sample))
+            self._count_tokens(sum(len(segment.tokens) for segment in segments))
+            return segments
+        prompt_tokens = tokenizer.encode(" " + options.initial_prompt.strip()) if options.initial_prompt else []
+        prompt = self._model.get_prompt(tokenizer, prompt_tokens, without_timestamps=True, prefix=prefix)
+        if options.max_new_tokens is not None:
+            # Prompt and prefix count towards the maximum length of the decoder
+            options = dataclasses.replace(
+                options, max_new_tokens=min(options.max_new_tokens, self._model.max_length - len(prompt))
+            )
+
+        result, avg_logprob, temperature, compression_ratio = self._model.generate_with_fallback(
+            encoder_output, prompt, tokenizer, options
+        )
+        if (
+            options.no_speech_threshold is not None
+            and result.no_speech_prob > options.no_speech_threshold
+            and (options.log_prob_threshold is None or avg_logprob <= options.log_prob_threshold)
+        ):
+            return []
+
+        tokens = [token for token in result.sequences_ids[0] if token < tokenizer.eot]
+        if prefix:
+            # Without a prefix, the tokens are counted by the caller like for every other decode
+            self._count_tokens(len(tokens), len(prefix_tokens))
+        words = []
+        if options.word_timestamps and len(tokens) > 0:
+            alignment = self._model.find_alignment(tokenizer, [prefix_tokens + tokens], encoder_output, num_frames)[0]
+            merge_punctuations(alignment, options.prepend_punctuations, options.append_punctuations)
+            consumed = 0
+            for timing in alignment:
+                consumed += len(timing["tokens"])
+                # Keep the words that contain generated tokens
+                if timing["word"] and consumed > len(prefix_tokens):
+                    words.append(
+                        Word(
+                            start=round(float(timing["start"]), 2),
+                            end=round(float(timing["end"]), 2),
+                            word=timing["word"],
+                            probability=float(timing["probability"]),
+                        )
+                    )
+        return [
+            Segment(
+                id=0,
+                seek=0,
+                start=words[0].start if words else 0.0,
+                end=words[-1].end if words else num_frames * self._model.feature_extractor.time_per_frame,
+                text=tokenizer.decode(tokens),
+                tokens=tokens,
+                avg_logprob=avg_logprob,
+                compression_ratio=compression_ratio,
+                no_speech_prob=result.no_speech_prob,
+                words=words if options.word_timestamps else None,
+                temperature=temperature,
+            )
+        ]
+
+    def _speech_span(
+        self, audio: np.ndarray, settings: dict, vad: IncrementalVad = None, window_start_sample: int = 0
+    ) -> Tuple[int, int] | None:
+        """Returns the first and last sample of speech in `audio`, None if it contains no speech"""
+        speech_chunks = self._speech_chunks(audio, settings, vad, window_start_sample)
+        if len(speech_chunks) == 0:
+            return None
+        return speech_chunks[0]["start"], speech_chunks[-1]["end"]
+
+    @staticmethod
+    def _settings_overrides(prompt: str, language: str = None, word_timestamps: bool = None) -> dict:
+        """Settings of a call, the optional ones are only set if given, so the configured defaults still apply"""
+        overrides = {"initial_prompt": prompt}
+        if language is not None:
+            overrides["language"] = language
+        if word_timestamps is not None:
+            overrides["word_timestamps"] = word_timestamps
+        return overrides
+
+    def align_words(self, audio_chunk, words: List[str], language: str = None) -> List[Word]:
+        """
+        Computes the timestamps of already transcribed words with the cross-attention alignment of the model, like
+        `word_timestamps` does during decoding, but without decoding the audio again.
+
+        Args:
+            audio_chunk: Audio of at most 30 seconds that contains the words, as accepted by `transcribe`.
+            words: The words in the order they are spoken.
+            language: Optional language code of the words, English if not given.
+        Returns:
+            List[Word]: The aligned words with timestamps relative to the start of `audio_chunk`. Punctuation is
+                merged into the words like in a decode, so they usually match `words` one to one.
+        """
+        text = " ".join(word.strip() for word in words if word.strip())
+        if len(text) == 0:
+            return []
+        audio = pcm_to_float32(audio_chunk)
+        features = self._model.feature_extractor(audio)
+        num_frames = min(features.shape[-1] - 1, self._model.feature_extractor.nb_max_frames)
+        encoder_output = self._encode(features[:, :num_frames], self._encoder_input_frames(num_frames))
+
+        settings = TranscriptionSettings().get_and_update_settings()
+        tokenizer, options = self._decoding_setup(settings, language or "en")
+        text_tokens = tokenizer.encode(" " + text)
+        alignment = self._model.find_alignment(tokenizer, [text_tokens], encoder_output, num_frames)[0]
+        merge_punctuations(alignment, options.prepend_punctuations, options.append_punctuations)
+        return [
+            Word(
+                start=round(float(timing["start"]), 2),
+                end=round(float(timing["end"]), 2),
+                word=timing["word"],
+                probability=float(timing["probability"]),
+            )
+            for timing in alignment
+            if timing["word"]
+        ]
+
+    async def align_words_async(self, audio_chunk, words: List[str], language: str = None) -> List[Word]:
+        """Runs `align_words` on the inference threads without blocking the event loop"""
+        return await self.run_in_executor(self.align_words, audio_chunk, words, language)
+
+    def detect_language(self, audio_chunk) -> Tuple[str, float]:
+        """
+        Detects the language of the first 30 seconds of the audio.
+
+        Args:
+            audio_chunk: Audio as accepted by `transcribe`.
+        Returns:
+            Tuple[str, float]: The language code and its probability. English-only models always return "en".
+        """
+        if not self._model.model.is_multilingual:
+            return "en", 1.0
+        language, probability, _ = self._model.detect_language(pcm_to_float32(audio_chunk))
+        return language, probability
+
+    async def detect_language_async(self, audio_chunk) -> Tuple[str, float]:
+        """Runs `detect_language` on the inference threads without blocking the event loop"""
+        return await self.run_in_executor(self.detect_language, audio_chunk)
+
+    async def run_in_executor(self, func: Callable, *args):
+        """Runs a blocking function on the inference threads and returns an awaitable result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def transcribe_async(
+        self,
+        audio_chunk,
+        prompt: str = "",
+        **kwargs,
+    ) -> List[Segment]:
+        """
+        Runs `transcribe` on the inference threads without blocking the event loop. The words of the segments are
+        `TokenWord`s that carry the key of their tokens. In the pipelined mode, the window passes the preprocessing
+        and decoding stages instead, see `prepare_window`.
+        """
+        if self._pipeline is not None:
+            return await self._pipeline.submit({"audio_chunk": audio_chunk, "prompt": prompt, **kwargs})
+        return await self.run_in_executor(functools.partial(self._transcribe_to_list, audio_chunk, prompt, **kwargs))
+
+    def _transcribe_to_list(self, audio_chunk, prompt: str, **kwargs) -> List[Segment]:
+        # The segments are generated lazily, consume them on the inference thread
+        segments = list(self.transcribe(audio_chunk, prompt, **kwargs))
+        if not kwargs.get("prefix"):
+            self._count_tokens(sum(len(segment.tokens) for segment in segments))
+        return self._keyed_segments(segments)
+
+    def prepare_window(
+        self,
+        audio_chunk,
+        prompt: str = "",
+        feature_cache: FeatureCache = None,
+        window_start_sample: int = 0,
+        vad: IncrementalVad = None,
+        prefix: str = None,
+        profile: str = None,
+        language: str = None,
+        word_timestamps: bool = None,
+    ) -> PreparedWindow:
+        """
+        Preprocessing stage of the pipelined mode: converts the audio, runs the VAD and computes the log-Mel features,
+        everything of `transcribe` that does not need the model. The arguments are the ones of `transcribe`.
+
+        Unlike `transcribe` without feature cache, a window with speech is always decoded from its features restricted
+        to the span between the first and last speech, instead of from the concatenated speech chunks.
+        """
+        audio = pcm_to_float32(audio_chunk)
+        settings = TranscriptionSettings().get_and_update_settings(
+            self._settings_overrides(prompt, language, word_timestamps), profile=profile
+        )
+        speech_span = None
+        if settings["vad_filter"]:
+            speech_span = self._speech_span(audio, settings, vad, window_start_sample)
+            if speech_span is None:
+                return PreparedWindow(audio, settings, prefix=prefix)
+        features = (
+            feature_cache.window_features(audio, window_start_sample)
+            if feature_cache is not None
+            else self._model.feature_extractor(audio)
+        )
+        single_window = self._encoder_input_frames(features.shape[-1] - 1) < self._encoder_frames[-1]
+        return PreparedWindow(audio, settings, features, speech_span, prefix, single_window)
+
+    def _prepare_request(self, request: dict) -> PreparedWindow:
+        return self.prepare_window(**request)
+
+    def _decode_prepared(self, window: PreparedWindow) -> List[Segment]:
+        """Decoding stage of the pipelined mode, returns the segments like `transcribe_async`"""
+        if window.features is None:
+            return []
+        # The VAD already ran in the preprocessing stage
+        settings = {**window.settings, "vad_filter": False}
+        if window.prefix or window.single_window:
+            segments = self._transcribe_single_window(window.audio, window.features, settings, window.prefix)
+        else:
+            segments = list(self._transcribe_features(window.audio, window.features, settings, speech_span=window.speech_span))
+        if not window.prefix:
+            self._count_tokens(sum(len(segment.tokens) for segment in segments))
+        return self._keyed_segments(segments)
+
+    def transcribe_batch(
+        self,
+        audio_chunks: List,
+        prompt: str = "",
+        batch_size: int = 16,
+        feature_caches: List[FeatureCache] = None,
+        window_start_samples: List[int] = None,
+        vads: List[IncrementalVad] = None,
+        profile: str = None,
+        language: str = None,
+        word_timestamps: bool = None,
+    ) -> List[List[Segment]]:
+        """
+        Transcribes the windows of several streams with batched encoder and decoder calls.
+
+        Every window is treated as a single chunk of at most 30 seconds, padded to the encoder input length of the
+        longest window in its model call (see `encoder_buckets`).
+        Windows are sorted by their length, so each call of `batch_size` windows contains windows of similar length.
+        Only the first temperature is used, like in faster-whisper's batched pipeline.
+
+        Args:
+            audio_chunks: Audio of each window, as accepted by `transcribe`.
+            prompt: Initial prompt shared by all windows.
+            batch_size: Maximum number of windows per model call.
+            feature_caches: Optional feature cache per window (entries may be None), see `transcribe`.
+            window_start_samples: Absolute start sample per window, needed for the feature caches and VADs.
+            vads: Optional incremental VAD per window (entries may be None), see `transcribe`. The new audio of all
+                windows is scored in one batched VAD call.
+            profile: Optional name of the transcription profile shared by all windows.
+            language: Optional language code shared by all windows, see `transcribe`.
+            word_timestamps: Optional override of the `word_timestamps` setting shared by all windows.
+        Returns:
+            List[List[Segment]]: The segments of each window, in the order of `audio_chunks`. Their words are
+                `TokenWord`s, see `transcribe_async`.
+        """
+        settings = TranscriptionSettings().get_and_update_settings(
+            self._settings_overrides(prompt or None, language, word_timestamps), profile=profile
+        )
+        audios = [pcm_to_float32(audio_chunk) for audio_chunk in audio_chunks]
+        feature_caches = feature_caches or [None] * len(audios)
+        window_start_samples = window_start_samples or [0] * len(audios)
+        vads = vads or [None] * len(audios)
+        if settings["vad_filter"]:
+            with_vad = [i for i, vad in enumerate(vads) if vad is not None]
+            IncrementalVad.score_batch(
+                [vads[i] for i in with_vad], [audios[i] for i in with_vad], [window_start_samples[i] for i in with_vad]
+            )
+        features = [None] * len(audios)
+        # Offset of the decoded audio within each window, in seconds
+        offsets = [0.0] * len(audios)
+        speech_chunks = [None] * len(audios)
+
+        for i, audio in enumerate(audios):
+            if feature_caches[i] is not None:
+                features[i] = feature_caches[i].window_features(audio, window_start_samples[i])[..., :-1]
+                if settings["vad_filter"]:
+                    speech_span = self._speech_span(audio, settings, vads[i], window_start_samples[i])
+                    if speech_span is None:
+                        audios[i] = audio[:0]
+                        continue
+                    hop_length = self._model.feature_extractor.hop_length
+                    features[i] = features[i][..., speech_span[0] // hop_length : speech_span[1] // hop_length]
+                    audios[i] = audio[speech_span[0] : speech_span[1]]
+                    offsets[i] = speech_span[0] / SAMPLE_RATE
+            elif settings["vad_filter"]:
+                speech_chunks[i] = self._speech_chunks(audio, settings, vads[i], window_start_samples[i])
+                if len(speech_chunks[i]) == 0:
+                    audios[i] = audio[:0]
+                    continue
+                audios[i] = np.concatenate(collect_chunks(audio, speech_chunks[i])[0])
+
+        results: List[List[Segment]] = [[] for _ in audios]
+        # Windows without (detected) speech are not decoded at all
+        order = sorted((i for i, audio in enumerate(audios) if len(audio) > 0), key=lambda i: len(audios[i]))
+        if len(order) == 0:
+            return results
+
+        # Without a language the batch runs in multilingual mode, which detects the language of every window from
+        # its encoder output, so no extra encoder pass is needed.
+        multilingual = settings["language"] is None and self._model.model.is_multilingual
+        tokenizer, options = self._decoding_setup(settings, settings["language"] or "en", batched=True, multilingual=multilingual)
+        pipeline = BatchedInferencePipeline(model=self._model)
+        for batch_start in range(0, len(order), batch_size):
+            indices = order[batch_start : batch_start + batch_size]
+            batch_features = [
+                features[i] if features[i] is not None else self._model.feature_extractor(audios[i])[..., :-1]
+                for i in indices
+            ]
+            # The windows are sorted by length, the last one decides the encoder input length of the batch
+            input_frames = self._encoder_input_frames(batch_features[-1].shape[-1])
+            with self._stats_lock:
+                self.encoder_calls[input_frames] += 1
+            batch_features = np.stack([pad_or_trim(f, input_frames) for f in batch_features])
+            chunks_metadata = [
+                {"start_time": offsets[i], "end_time": offsets[i] + len(audios[i]) / SAMPLE_RATE} for i in indices
+            ]
+            outputs = pipeline.forward(batch_features, tokenizer, chunks_metadata, options)
+            for i, output in zip(indices, outputs):
+                segments = [self._segment_from_output(j, segment, options) for j, segment in enumerate(output)]
+                if speech_chunks[i]:
+                    segments = list(restore_speech_timestamps(segments, speech_chunks[i], SAMPLE_RATE))
+                results[i] = self._keyed_segments(segments)
+                self._count_tokens(sum(len(segment.tokens) for segment in segments))
+        return results
+
+    def _speech_chunks(
+        self, audio: np.ndarray, settings: dict, vad: IncrementalVad = None, window_start_sample: int = 0
+    ) -> List[dict]:
+        if vad is not None:
+            return vad.speech_timestamps(audio, window_start_sample, self._vad_options(settings))
+        return get_speech_timestamps(audio, self._vad_options(settings))
+
+    @staticmethod
+    def _vad_options(settings: dict, **overrides) -> VadOptions:
+        vad_parameters = settings["vad_parameters"]
+        if isinstance(vad_parameters, VadOptions):
+            vad_parameters = vars(vad_parameters)
+        return VadOptions(**{**(vad_parameters or {}), **overrides})
+
+    def _decoding_setup(
+        self,
+        settings: dict,
+        language: str,
+        batched: bool = False,
+        multilingual: bool = False,
+        clip_timestamps="0",
+    ) -> Tuple[Tokenizer, TranscriptionOptions]:
+        """
+        Creates tokenizer and decoding options for a model call on precomputed features, with the same defaults as
+        faster-whisper's `transcribe` (or its batched pipeline if `batched`).
+        """
+        if not self._model.model.is_multilingual:
+            language = "en"
+        tokenizer = Tokenizer(
+            self._model.hf_tokenizer,
+            self._model.model.is_multilingual,
+            task=settings["task"],
+            language=language,
+        )
+        temperature = settings["temperature"]
+        temperatures = list(temperature) if isinstance(temperature, (list, tuple)) else [temperature]
+        options = TranscriptionOptions(
+            beam_size=settings["beam_size"],
+            best_of=settings["best_of"],
+            patience=settings["patience"],
+            length_penalty=settings["length_penalty"],
+            repetition_penalty=settings["repetition_penalty"],
+            no_repeat_ngram_size=settings["no_repeat_ngram_size"],
+            log_prob_threshold=settings["log_prob_threshold"],
+            no_speech_threshold=settings["no_speech_threshold"],
+            compression_ratio_threshold=settings["compression_ratio_threshold"],
+            condition_on_previous_text=False if batched else settings["condition_on_previous_text"],
+            prompt_reset_on_temperature=settings["prompt_reset_on_temperature"],
+            temperatures=temperatures[:1] if batched else temperatures,
+            initial_prompt=settings["initial_prompt"],
+            prefix=settings["prefix"],
+            suppress_blank=settings["suppress_blank"],
+            suppress_tokens=(
+                get_suppressed_tokens(tokenizer, settings["suppress_tokens"])
+                if settings["suppress_tokens"]
+                else settings["suppress_tokens"]
+            ),
+            without_timestamps=settings["without_timestamps"],
+            max_initial_timestamp=0.0 if batched else settings["max_initial_timestamp"],
+            word_timestamps=settings["word_timestamps"],
+            prepend_punctuations=settings["prepend_punctuations"],
+            append_punctuations=settings["append_punctuations"],
+            multilingual=multilingual,
+            max_new_tokens=settings["max_new_tokens"],
+            clip_timestamps=clip_timestamps,
+            hallucination_silence_threshold=None,
+            hotwords=None,
+        )
+        return tokenizer, options
+
+    @staticmethod
+    def _segment_from_output(index: int, segment: dict, options: TranscriptionOptions) -> Segment:
+        return Segment(
+            id=index,
+            seek=segment["seek"],
+            start=round(segment["start"], 3),
+            end=round(segment["end"], 3),
+            text=segment["text"],
+            tokens=segment["tokens"],
+            avg_logprob=segment["avg_logprob"],
+            compression_ratio=segment["compression_ratio"],
+            no_speech_prob=segment["no_speech_prob"],
+            words=[Word(**word) for word in segment["words"]] if options.word_timestamps else None,
+            temperature=options.temperatures[0],
+        )
@@ -1,14 +1,13 @@
 """Module to handle the transcription process"""
 
-import io
 from typing import Iterable, Tuple
-import wave
 
 from faster_whisper import WhisperModel, BatchedInferencePipeline
 from faster_whisper.utils import logging
 from faster_whisper.transcribe import TranscriptionInfo, Segment
 
 from src.helper.model_handler import ModelHandler
+from src.helper.pcm import pcm_to_float32
 from src.helper.transcription_settings import TranscriptionSettings
 
 LOGGER = logging.getLogger(__name__)
@@ -83,22 +82,18 @@ class Transcriber:
 
     def transcribe(
         self,
-        audio_chunk: bytes,
+        audio_chunk,
         prompt: str = "",
     ) -> Tuple[Iterable[Segment], TranscriptionInfo]:
-        """Function to run the transcription process"""
-        sample_rate = 16000
-        num_channels = 1
-        sampwidth = 2
+        """
+        Function to run the transcription process
 
-        with io.BytesIO() as wav_io:
-            with wave.open(wav_io, "wb") as wav_file:
-                wav_file.setnchannels(num_channels)
-                wav_file.setsampwidth(sampwidth)
-                wav_file.setframerate(sample_rate)
-                wav_file.writeframes(audio_chunk)
-            wav_io.seek(0)
-            settings = TranscriptionSettings().get_and_update_settings(
-                {"initial_prompt": prompt}
-            )
-            return self._batched_model.transcribe(wav_io, batch_size=16, **settings)
+        Args:
+            audio_chunk: 16 kHz mono audio as raw 16 bit PCM bytes, int16 array or float32 array. Arrays are passed to the model without an intermediate WAV file.
+            prompt: Initial prompt for the decoder
+        """
+        audio = pcm_to_float32(audio_chunk)
+        settings = TranscriptionSettings().get_and_update_settings(
+            {"initial_prompt": prompt}
+        )
+        return self._batched_model.transcribe(audio, batch_size=16, **settings)
@@ -0,0 +1,197 @@
+"""Policies that decide when a melvin stream retranscribes its sliding window"""
+
+import asyncio
+import logging
+
+import numpy as np
+
+from src.helper import virtual_clock
+from src.helper.incremental_vad import VAD_CHUNK_SAMPLES, IncrementalVad
+from src.helper.pcm import BYTES_PER_SAMPLE, INT16_SCALE
+
+LOGGER = logging.getLogger(__name__)
+
+BYTES_PER_SECOND = 32000
+
+# Frames of 20 ms for the energy detector
+ENERGY_FRAME_SAMPLES = 320
+
+
+class TriggerPolicy:
+    """
+    Decides on every received chunk whether the stream starts a retranscription. The default policy retriggers
+    after a fixed amount of audio or time, like the stream always did.
+    """
+
+    async def prepare(self, stream) -> None:
+        """Called before `should_transcribe` for blocking work on the new audio, which runs off the event loop"""
+        pass
+
+    def should_transcribe(self, stream, chunk: bytes) -> bool:
+        """
+        Called after `chunk` was appended to the sliding window of `stream`.
+        Args:
+            stream: The melvin stream that received the chunk.
+            chunk: The received 16 bit PCM audio.
+        Returns:
+            bool: True if a retranscription should be started.
+        """
+        raise NotImplementedError("This method should be implemented in the actual TriggerPolicy class.")
+
+    def transcription_started(self, stream) -> None:
+        """Called when a retranscription was actually started after `should_transcribe` returned True"""
+        pass
+
+    @classmethod
+    def create(cls, type: str = "interval", **options) -> "TriggerPolicy":
+        """
+        Creates a trigger policy by name.
+        Args:
+            type: "interval", "energy" or "vad".
+            options: Keyword arguments of the policy.
+        """
+        if type == "interval":
+            return IntervalTriggerPolicy(**options)
+        elif type == "energy":
+            return EnergyTriggerPolicy(**options)
+        elif type == "vad":
+            return VadTriggerPolicy(**options)
+        else:
+            raise ValueError(f"Unknown trigger policy: {type}")
+
+
+class IntervalTriggerPolicy(TriggerPolicy):
+    def should_transcribe(self, stream, chunk: bytes) -> bool:
+        """Triggers after `partial_transcription_byte_threshold` bytes or the same amount of wall time"""
+        return stream.bytes_received_since_last_transcription >= stream.partial_transcription_byte_threshold or (
+            virtual_clock.now() - stream.last_transcription_timestamp
+            >= (stream.partial_transcription_byte_threshold / BYTES_PER_SECOND)
+        )
+
+
+class SpeechTriggerPolicy(TriggerPolicy):
+    def __init__(self, pause_ms: float = 300.0, min_window_ms: float = 500.0, max_silent_transcriptions: int = 2):
+        """
+        Base class of the policies that look at speech activity of the new audio:
+
+        - no retranscription while no new speech arrived, unless the agreement has unconfirmed words left (at most
+          `max_silent_transcriptions` times in a row),
+        - an immediate retranscription when the speaker pauses for `pause_ms` after speech,
+        - no retranscription of windows shorter than `min_window_ms`,
+        - otherwise the interval of `IntervalTriggerPolicy`.
+
+        Args:
+            pause_ms: Silence after speech that triggers a retranscription.
+            min_window_ms: Minimum window length for a retranscription.
+            max_silent_transcriptions: Retranscriptions without new speech to confirm the remaining words.
+        """
+        self.pause_ms = pause_ms
+        self.min_window_bytes = int(min_window_ms / 1000 * BYTES_PER_SECOND)
+        self.interval = IntervalTriggerPolicy()
+        self.speech_since_transcription = False
+        self.silence_ms = 0.0
+        self.pause_triggered = False
+        self.max_silent_transcriptions = max_silent_transcriptions
+        self.silent_transcriptions = 0
+        self.suppressed = 0
+
+    def speech_frames(self, stream, chunk: bytes) -> tuple:
+        """
+        Returns the speech decision for the frames of the new audio.
+        Returns:
+            tuple: Boolean array with one entry per frame and the frame duration in ms.
+        """
+        raise NotImplementedError("This method should be implemented in the actual SpeechTriggerPolicy class.")
+
+    def should_transcribe(self, stream, chunk: bytes) -> bool:
+        speech, frame_ms = self.speech_frames(stream, chunk)
+        if len(speech) > 0:
+            if speech.any():
+                self.speech_since_transcription = True
+                self.pause_triggered = False
+                # Silence after the last speech frame of the chunk
+                self.silence_ms = (len(speech) - 1 - np.flatnonzero(speech)[-1]) * frame_ms
+            else:
+                self.silence_ms += len(speech) * frame_ms
+
+        if len(stream.sliding_window) < self.min_window_bytes:
+            return False
+
+        if self.speech_since_transcription and not self.pause_triggered and self.silence_ms >= self.pause_ms:
+            LOGGER.debug(f"Pause of {self.silence_ms:.0f} ms detected, triggering transcription")
+            return True
+
+        if not self.interval.should_transcribe(stream, chunk):
+            return False
+        if not self.speech_since_transcription and (
+            len(stream.agreement.unconfirmed) == 0 or self.silent_transcriptions >= self.max_silent_transcriptions
+        ):
+            # Nothing new to transcribe and nothing left to confirm
+            self.suppressed += 1
+            return False
+        return True
+
+    def transcription_started(self, stream) -> None:
+        self.silent_transcriptions = 0 if self.speech_since_transcription else self.silent_transcriptions + 1
+        self.speech_since_transcription = False
+        # The pause is covered by this transcription, the next one needs new speech
+        self.pause_triggered = self.silence_ms >= self.pause_ms
+
+
+class EnergyTriggerPolicy(SpeechTriggerPolicy):
+    def __init__(self, threshold_db: float = -45.0, **options):
+        """
+        Detects speech by the RMS energy of 20 ms frames.
+        Args:
+            threshold_db: Frames louder than this (in dB relative to full scale) count as speech.
+            options: See `SpeechTriggerPolicy`.
+        """
+        super().__init__(**options)
+        self.threshold_db = threshold_db
+
+    def speech_frames(self, stream, chunk: bytes) -> tuple:
+        samples = np.frombuffer(chunk, dtype=np.int16, count=len(chunk) // BYTES_PER_SAMPLE)
+        frame_samples = min(ENERGY_FRAME_SAMPLES, len(samples))
+        if frame_samples == 0:
+            return np.zeros(0, dtype=bool), 0.0
+        frames = samples[: len(samples) - len(samples) % frame_samples].reshape(-1, frame_samples) / INT16_SCALE
+        energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+        return energy_db > self.threshold_db, frame_samples / BYTES_PER_SECOND * BYTES_PER_SAMPLE * 1000
+
+
+class VadTriggerPolicy(SpeechTriggerPolicy):
+    def __init__(self, threshold: float = 0.5, **options):
+        """
+        Detects speech with the incremental Silero VAD of the stream, which scores the new audio on arrival. The
+        scoring runs on the default executor of the event loop, so it does not hold up the audio of other streams.
+        The stream needs `incremental_vad` enabled.
+        Args:
+            threshold: Chunks with a higher speech probability count as speech.
+            options: See `SpeechTriggerPolicy`.
+        """
+        super().__init__(**options)
+        self.threshold = threshold
+        self._scored_until = 0
+
+    async def prepare(self, stream) -> None:
+        vad = self._vad(stream)
+        start_sample = stream.previous_byte_count // BYTES_PER_SAMPLE
+        window = stream.sliding_window.float32()
+        if start_sample + len(window) - vad.scored_until < VAD_CHUNK_SAMPLES:
+            # No complete chunk to score yet
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, IncrementalVad.score_batch, [vad], [window], [start_sample]
+        )
+
+    def speech_frames(self, stream, chunk: bytes) -> tuple:
+        vad = self._vad(stream)
+        probs = vad.probabilities_since(self._scored_until)
+        self._scored_until = vad.scored_until
+        return probs >= self.threshold, VAD_CHUNK_SAMPLES / BYTES_PER_SECOND * BYTES_PER_SAMPLE * 1000
+
+    @staticmethod
+    def _vad(stream) -> IncrementalVad:
+        if stream.vad is None:
+            raise ValueError("The vad trigger policy needs a stream with incremental_vad enabled")
+        return stream.vad
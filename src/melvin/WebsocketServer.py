@@ -0,0 +1,237 @@
+"""Websocket server that transcribes many concurrent audio streams with one shared transcriber"""
+
+import asyncio
+from collections import deque
+import itertools
+import json
+import logging
+import time
+import traceback
+from typing import Deque, Dict, Tuple
+
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from src.melvin.OverloadController import OverloadController
+from src.melvin.stream import BYTES_PER_SECOND, Stream
+from src.melvin.Transcriber import Transcriber
+from src.run.OutputHandler import OutputHandler
+
+LOGGER = logging.getLogger(__name__)
+
+# Close code of the websocket protocol for "try again later"
+CLOSE_TRY_AGAIN_LATER = 1013
+
+# Control message of the client that ends its stream
+EOF_MESSAGE = "eof"
+
+
+class WebsocketOutputHandler(OutputHandler):
+    def __init__(self, max_queued_messages: int = 32):
+        """
+        Sends the partials and finals of one session to its websocket. Messages wait in a bounded queue until the
+        client reads them. A queued partial is replaced by the next one, as it only shows the latest hypothesis,
+        finals are never dropped. While the queue is full, the session stops reading audio from the client.
+
+        Args:
+            max_queued_messages: Messages the client may fall behind before the session applies backpressure.
+        """
+        super().__init__()
+        self.max_queued_messages = max(1, max_queued_messages)
+        # Pairs of (is partial, message)
+        self.messages: Deque[Tuple[bool, str]] = deque()
+        self.has_messages = asyncio.Event()
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+        self.closed = False
+        self.sent_messages = 0
+        self.dropped_partials = 0
+
+    def send_partial(self, words, window_time_start=None, window_time_end=None, **metadata):
+        self._put(json.dumps({"partial": words["text"]}), partial=True)
+
+    def send_final(self, words, reason: str = None, **metadata):
+        text = " ".join(word["word"] for word in words)
+        message = {"result": words, "text": text, "reason": reason}
+        message.update({key: value for key, value in metadata.items() if value is not None})
+        self._put(json.dumps(message), partial=False)
+
+    def send_event(self, kind: str, **data):
+        super().send_event(kind, **data)
+        self._put(json.dumps({"event": kind, **data}), partial=False)
+
+    def send_error(self, message: str):
+        self._put(json.dumps({"error": message}), partial=False)
+
+    def _put(self, message: str, partial: bool) -> None:
+        if self.closed:
+            return
+        if partial and len(self.messages) > 0 and self.messages[-1][0]:
+            # The client has not read the previous partial yet, it is outdated now
+            self.messages[-1] = (True, message)
+            self.dropped_partials += 1
+        else:
+            self.messages.append((partial, message))
+        self.has_messages.set()
+        if len(self.messages) >= self.max_queued_messages:
+            self.has_space.clear()
+
+    async def forward(self, websocket: ServerConnection) -> None:
+        """Sends the queued messages until the handler is closed and the queue is empty"""
+        try:
+            while True:
+                if len(self.messages) == 0:
+                    if self.closed:
+                        return
+                    self.has_messages.clear()
+                    await self.has_messages.wait()
+                    continue
+                _, message = self.messages.popleft()
+                if len(self.messages) < self.max_queued_messages:
+                    self.has_space.set()
+                await websocket.send(message)
+                self.sent_messages += 1
+        except ConnectionClosed:
+            LOGGER.debug("Connection closed while sending results")
+        finally:
+            self.closed = True
+            self.messages.clear()
+            # Do not keep the receiving side waiting for a client that is gone
+            self.has_space.set()
+
+    def close(self) -> None:
+        """No further messages are queued, `forward` returns when the queued ones are sent"""
+        self.closed = True
+        self.has_messages.set()
+
+
+class WebsocketServer:
+    def __init__(
+        self,
+        transcriber: Transcriber,
+        host: str = "0.0.0.0",
+        port: int = 8765,
+        max_sessions: int = 64,
+        max_queued_messages: int = 32,
+        stream_options: dict = None,
+        stats_interval_seconds: float = 30.0,
+        overload_controller: OverloadController = None,
+    ):
+        """
+        Accepts websocket sessions that stream 16 kHz 16 bit mono PCM as binary messages and end with the text
+        message "eof". Each session is a melvin `Stream`, all sessions share the transcriber, which is usually a
+        `BatchScheduler` whose bounded queue limits the windows waiting for the model.
+
+        Partials are sent as `{"partial": text}`, finals as `{"result": words, "text": text, "reason": reason}`,
+        which is what `WebsocketTranscriberAdapter` expects. Events of the stream, e.g. a change of the overload
+        degradation, are sent as `{"event": kind, ...}`.
+
+        Args:
+            transcriber: Transcriber (or batch scheduler) shared by all sessions.
+            host: Interface to listen on.
+            port: Port to listen on.
+            max_sessions: Sessions beyond this are closed with code 1013 (try again later).
+            max_queued_messages: Per session limit of results the client has not read yet, see
+                `WebsocketOutputHandler`.
+            stream_options: Keyword arguments of the melvin `Stream` of each session.
+            stats_interval_seconds: Interval of the stats log line, 0 to disable it.
+            overload_controller: Optional controller that degrades the sessions while they fall behind. On its last
+                level new sessions are closed with code 1013. It is passed to the streams of the sessions.
+        """
+        self.transcriber = transcriber
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.max_queued_messages = max_queued_messages
+        self.stream_options = dict(stream_options or {})
+        self.overload_controller = overload_controller
+        if overload_controller is not None:
+            self.stream_options["overload_controller"] = overload_controller
+        self.stats_interval_seconds = stats_interval_seconds
+        self.sessions: Dict[int, WebsocketOutputHandler] = {}
+        self._session_ids = itertools.count()
+        self.completed_sessions = 0
+        self.rejected_sessions = 0
+        self.received_bytes = 0
+
+    async def serve_forever(self) -> None:
+        async with serve(self.handle, self.host, self.port) as server:
+            LOGGER.info(f"Listening on ws://{self.host}:{self.port}")
+            stats_task = asyncio.create_task(self._log_stats()) if self.stats_interval_seconds > 0 else None
+            try:
+                await server.serve_forever()
+            finally:
+                if stats_task is not None:
+                    stats_task.cancel()
+
+    async def handle(self, websocket: ServerConnection) -> None:
+        """Runs one session from the first audio message until "eof" or until the client disconnects"""
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected_sessions += 1
+            LOGGER.warning(f"Rejecting session, {len(self.sessions)} sessions are running")
+            await websocket.close(CLOSE_TRY_AGAIN_LATER, "Too many sessions")
+            return
+        if self.overload_controller is not None and not self.overload_controller.accepting_sessions():
+            self.rejected_sessions += 1
+            LOGGER.warning(f"Rejecting session, overload level {self.overload_controller.level_name}")
+            await websocket.close(CLOSE_TRY_AGAIN_LATER, "Overloaded")
+            return
+
+        session_id = next(self._session_ids)
+        output_handler = WebsocketOutputHandler(self.max_queued_messages)
+        output_handler.init_timer()
+        stream = Stream(self.transcriber, session_id, output_handler, **self.stream_options)
+        self.sessions[session_id] = output_handler
+        sender = asyncio.create_task(output_handler.forward(websocket), name=f"websocket_sender_{session_id}")
+        LOGGER.info(f"Session {session_id} started by {websocket.remote_address}")
+
+        stream.start_stream()
+        start_time = time.perf_counter()
+        session_bytes = 0
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    session_bytes += len(message)
+                    self.received_bytes += len(message)
+                    await stream.receive_bytes(message)
+                    # Backpressure: stop reading audio while the client does not read the results
+                    await output_handler.has_space.wait()
+                elif message.strip() == EOF_MESSAGE:
+                    break
+                else:
+                    output_handler.send_error("control message unknown")
+        except ConnectionClosed:
+            LOGGER.debug(f"Session {session_id} disconnected")
+        except Exception:
+            LOGGER.error(f"Error in session {session_id}: {traceback.format_exc()}")
+        finally:
+            await stream.drain()
+            stream.end_stream()
+            await stream.drain()
+            output_handler.close()
+            await sender
+            await websocket.close()
+            del self.sessions[session_id]
+            self.completed_sessions += 1
+            audio_seconds = session_bytes / BYTES_PER_SECOND
+            LOGGER.info(
+                f"Session {session_id} ended after {time.perf_counter() - start_time:.1f} s with {audio_seconds:.1f} s "
+                f"of audio, {output_handler.sent_messages} messages sent, "
+                f"{output_handler.dropped_partials} partials dropped"
+            )
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self.sessions),
+            "completed_sessions": self.completed_sessions,
+            "rejected_sessions": self.rejected_sessions,
+            "received_audio_seconds": self.received_bytes / BYTES_PER_SECOND,
+            "queued_messages": sum(len(handler.messages) for handler in self.sessions.values()),
+            "queue_depth": self.transcriber.queue_depth() if hasattr(self.transcriber, "queue_depth") else None,
+            "overload": self.overload_controller.stats() if self.overload_controller is not None else None,
+        }
+
+    async def _log_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval_seconds)
+            LOGGER.info(f"Server stats: {self.stats()}")
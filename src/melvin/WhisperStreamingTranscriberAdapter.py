@@ -58,7 +58,6 @@ class WhisperStreamingTranscriberAdapter(BaseTranscriberAdapter):
     def _start_stream(self) -> bool:
         self.logger.debug("Starting stream")
         self.sliding_window = b""
-        self.total_bytes = b""
         self.window_start_timestamp = 0
         self.agreement = LocalAgreement()
         self.bytes_received_since_last_transcription = 0
@@ -76,7 +75,6 @@ class WhisperStreamingTranscriberAdapter(BaseTranscriberAdapter):
     async def transcribe_bytes(self, audio_bytes: bytes) -> str | None:
         self.bytes_received_since_last_transcription += len(audio_bytes)
         self.sliding_window += audio_bytes
-        self.total_bytes += audio_bytes
 
         if self.bytes_received_since_last_transcription >= self.transcription_trigger_threshold_byte:
             self.bytes_received_since_last_transcription = 0
@@ -1,6 +1,6 @@
+from collections import deque
 import json
-import time
-from typing import Dict, List
+from typing import Deque, Dict, List, Literal, Tuple
 import uuid
 import traceback
 import asyncio
@@ -8,9 +8,32 @@ import asyncio
 from faster_whisper.transcribe import Word
 from pydub import AudioSegment
 
-from src.helper import logger
-from src.helper.local_agreement import LocalAgreement
+from src.helper import logger, virtual_clock
+from src.helper.config import CONFIG
+from src.helper.local_agreement import (
+    SENTENCE_TERMINATION_CHARACTERS,
+    LocalAgreement,
+    known_prefix_length,
+    normalize_word,
+    word_key,
+)
+from src.helper.feature_cache import FeatureCache
+from src.helper.incremental_vad import IncrementalVad
+from src.helper.pcm import BYTES_PER_SAMPLE, pcm_to_float32
+from src.helper.ring_buffer import AudioRingBuffer
+from src.helper.transcription_settings import TranscriptionSettings
+from src.helper.word_sequence import approximate_words
+from src.melvin.OverloadController import (
+    CHEAP_DECODING,
+    LEVEL_NAMES,
+    NORMAL,
+    SHRINK_WINDOW,
+    SKIP_PARTIALS,
+    OverloadController,
+)
+from src.melvin.RetranscriptionScheduler import RetranscriptionScheduler
 from src.melvin.Transcriber import Transcriber
+from src.melvin.TriggerPolicy import TriggerPolicy
 from src.run.OutputHandler import OutputHandler
 
 # To Calculate the seconds of audio in a chunk of 16000 Hz, 2 bytes per sample and 1 channel (as typically used in Whisper):
@@ -23,38 +46,211 @@ FINAL_TRANSCRIPTION_THRESHOLD = 6
 # Max size of window defined in bytes
 MAX_WINDOW_SIZE_BYTES = BYTES_PER_SECOND * 15
 
+# Capacity of the preallocated window buffer. The window is only shortened when a final is published,
+# so it may grow past MAX_WINDOW_SIZE_BYTES in between. Audio beyond Whisper's 30 s input is discarded.
+WINDOW_BUFFER_CAPACITY_BYTES = BYTES_PER_SECOND * 30
+
 # Bytes after which a retranscription of the window is triggered
 PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD = BYTES_PER_SECOND * 1
 
+# Window cuts are aligned to the hop length of the feature extractor (160 samples), so the feature cache stays usable
+WINDOW_CUT_ALIGNMENT_BYTES = 320
+
+# A partial word equal to the last final word that starts less than this after the final is the final word decoded
+# again, a later one is a repetition by the speaker
+DUPLICATE_WORD_MAX_GAP_SECONDS = 0.1
+
+# Number of flushed final words passed as initial prompt when decoding with a prefix
+PROMPT_WORD_COUNT = 50
+
+# Window length from which the language of a stream is detected and pinned
+LANGUAGE_DETECTION_BYTES = BYTES_PER_SECOND * 2
+
 # If no final has been published for this long just publish all as final
 # This is mostly for cases where no audio data is sent
 FINAL_PUBLISH_SECOND_THRESHOLD_FACTOR = 5
 
 
 class Stream:
-    def __init__(self, transcriber: Transcriber, id: int, output_handler: OutputHandler):
+    def __init__(
+        self,
+        transcriber: Transcriber,
+        id: int,
+        output_handler: OutputHandler,
+        feature_cache: str = None,
+        incremental_vad: bool = False,
+        scheduler: RetranscriptionScheduler = None,
+        priority: float = 1.0,
+        prefix_decoding: bool = False,
+        evict_at_finals: bool = False,
+        eviction_margin_ms: float = 100.0,
+        eviction_context_ms: float = 0.0,
+        trigger: dict = None,
+        partial_profile: str = None,
+        final_profile: str = None,
+        agreement_n: int = 2,
+        final_transcriber: Transcriber = None,
+        final_context_ms: float = 200.0,
+        final_check_interval_ms: float = 250.0,
+        early_commit_probability: float = None,
+        early_commit_margin_ms: float = 2000.0,
+        language: str = None,
+        language_detection_ms: float = None,
+        language_redetection_ms: float = 0.0,
+        lazy_word_timestamps: bool = False,
+        overload_controller: OverloadController = None,
+    ):
+        """
+        Args:
+            transcriber: Transcriber (or batch scheduler) that runs the model.
+            id: Id of the stream, used for logging.
+            output_handler: Receives partials and finals.
+            feature_cache: Optional log-Mel feature cache backend. "incremental" computes features only for newly
+                received audio, "precomputed" computes the features of the whole audio once in `preload_audio`.
+            incremental_vad: Keep the speech probabilities of the stream and only run VAD over newly received audio.
+            scheduler: Optional scheduler shared by all streams. If given, it decides when the stream is
+                retranscribed, otherwise the stream retriggers itself after `partial_transcription_byte_threshold`.
+            priority: Priority of the stream in the scheduler.
+            prefix_decoding: Force the text that is already fixed at the start of the window (flushed finals and
+                confirmed words) as decoder prefix and pass earlier finals as prompt, so only the unstable tail is
+                generated.
+            evict_at_finals: Cut the window after every final up to the end of its last word, instead of only
+                keeping the window below `MAX_WINDOW_SIZE_BYTES`.
+            eviction_margin_ms: Audio kept before the end of the last final word, so the start of the next word is
+                not cut off when its timestamps are imprecise.
+            eviction_context_ms: Additional audio of the final kept as acoustic context for the next transcriptions.
+            trigger: Options of the trigger policy that decides when the window is retranscribed, e.g.
+                `{"type": "energy", "pause_ms": 300}`, see `TriggerPolicy.create`. Not used with a scheduler.
+            partial_profile: Transcription profile of the retranscriptions, see `TranscriptionSettings`.
+            final_profile: Transcription profile used instead when the result is about to be published as final.
+            agreement_n: Number of consecutive transcriptions that have to agree on a word before it is confirmed.
+            final_transcriber: Optional second (usually larger) model. The retranscriptions run on `transcriber`, only
+                the audio span of each final is transcribed again with this model before the final is published.
+            final_context_ms: Audio around the span of a final that is passed to `final_transcriber` as context.
+            final_check_interval_ms: Interval of the timer that checks for finals, so the timeout flush also happens
+                while no transcription finishes, e.g. during silence. 0 to only check after transcriptions.
+            early_commit_probability: Confirm words from a single transcription if their probability is at least
+                this and they end `early_commit_margin_ms` before the window end, see `LocalAgreement`. Finals
+                report the number of early committed words they contain.
+            early_commit_margin_ms: Minimum distance of early committed words to the end of the window.
+            language: Optional language code of the stream. It is checked against the supported languages and used
+                for all transcriptions, no language is detected then.
+            language_detection_ms: Without a language, it is detected once on the first window of at least this
+                length and pinned for the rest of the stream. Shorter windows before are transcribed with detection.
+            language_redetection_ms: Detect the language again after this much audio, e.g. for streams that switch
+                languages. 0 keeps the detected language for the whole stream.
+            lazy_word_timestamps: Decode the retranscriptions without word timestamps, which skips the alignment pass
+                of every partial. Partials get approximate timing from their segments and are agreed on by their
+                text. The words of each final are aligned once before it is published (unless `final_transcriber`
+                transcribes them again).
+            overload_controller: Optional controller shared by all streams that degrades the transcription while the
+                streams fall behind, see `OverloadController`. Skipping partials only applies without a scheduler.
+        """
         self.logger = logger.get_logger_with_id(__name__, f"{id}")
         self.transcriber = transcriber
         self.output_handler = output_handler
         self.id = id
 
-        self.sliding_window = b""
-        self.total_bytes = b""
-        self.window_start_timestamp = 0
-        self.agreement = LocalAgreement()
+        self.sliding_window = AudioRingBuffer(WINDOW_BUFFER_CAPACITY_BYTES)
+        self.agreement = LocalAgreement(
+            agreement_n,
+            early_commit_probability,
+            early_commit_margin_ms / 1000,
+            match_confirmed_by_text=lazy_word_timestamps,
+        )
+        # Transcriber of the last hypothesis merged into the agreement
+        self.agreement_transcriber = transcriber
         self.bytes_received_since_last_transcription = 0
-        self.final_transcriptions = []
-        self.previous_byte_count = 0
+        # Recent finals, the older ones are only kept by the output handler, see `trim_final_transcriptions`
+        self.final_transcriptions: Deque[Dict] = deque()
+        # Last published final word, new hypotheses that repeat it at their start are trimmed
+        self.last_final_word: Word = None
 
         self.partial_transcription_byte_threshold = PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD
-        self.final_publish_second_threshold = (
-            self.partial_transcription_byte_threshold * FINAL_PUBLISH_SECOND_THRESHOLD_FACTOR
-        )
-        self.last_transcription_timestamp = time.time()
-        self.last_final_published = time.time()
-        self.is_in_transcription = False
+        self.final_publish_second_threshold = self.final_publish_seconds()
+        self.last_transcription_timestamp = virtual_clock.now()
+        self.last_final_published = virtual_clock.now()
 
+        # "idle", "decoding", "pending" (decoding and the trigger fired again) or "closed"
+        self.state: Literal["idle", "decoding", "pending", "closed"] = "idle"
         self.transcription_tasks = set()
+        # Each decode gets a generation, results of older generations than the last merged one are dropped
+        self.decode_generation = 0
+        self.merged_generation = 0
+        self.coalesced_triggers = 0
+        self.stale_results = 0
+
+        self.final_check_interval = final_check_interval_ms / 1000
+        self.finalization_timer: asyncio.Task = None
+
+        self.feature_cache_backend = feature_cache
+        self.feature_cache = None
+        if feature_cache is not None:
+            if feature_cache not in ["incremental", "precomputed"]:
+                raise ValueError(f"Unknown feature cache backend: {feature_cache}")
+            self.feature_cache = FeatureCache(
+                transcriber.feature_extractor, WINDOW_BUFFER_CAPACITY_BYTES // BYTES_PER_SAMPLE
+            )
+        self.vad = IncrementalVad(WINDOW_BUFFER_CAPACITY_BYTES // BYTES_PER_SAMPLE) if incremental_vad else None
+
+        self.scheduler = scheduler
+        self.priority = priority
+        self.prefix_decoding = prefix_decoding
+
+        self.evict_at_finals = evict_at_finals
+        self.eviction_keep_bytes = int((eviction_margin_ms + eviction_context_ms) / 1000 * BYTES_PER_SECOND)
+
+        self.trigger_policy = TriggerPolicy.create(**(trigger or {}))
+
+        self.partial_profile = partial_profile
+        self.final_profile = final_profile
+        # Number of transcriptions and inference seconds per profile
+        self.profile_stats: Dict[str, Dict[str, float]] = {}
+
+        self.final_transcriber = final_transcriber
+        self.final_context_bytes = int(final_context_ms / 1000 * BYTES_PER_SECOND)
+        self.finalization_tasks = set()
+        # Finals are published in order, even if the final model takes longer for an earlier one
+        self.finalization_lock = asyncio.Lock()
+
+        if language is not None and language not in CONFIG["supported_language_codes"]:
+            raise ValueError(f"Unsupported language: {language}")
+        # A language set in the config applies to every transcription already, there is nothing to detect
+        self.language_detection_enabled = language is None and TranscriptionSettings().default_settings["language"] is None
+        self.language = language
+        self.language_probability: float = None
+        self.language_detection_bytes = (
+            int(language_detection_ms / 1000 * BYTES_PER_SECOND)
+            if language_detection_ms is not None
+            else LANGUAGE_DETECTION_BYTES
+        )
+        self.language_redetection_bytes = int(language_redetection_ms / 1000 * BYTES_PER_SECOND)
+        # Stream position of the audio at the last detection
+        self.language_detected_at_byte: int = None
+        self.language_detections = 0
+
+        self.lazy_word_timestamps = lazy_word_timestamps
+
+        self.overload_controller = overload_controller
+        self.degradation_level = NORMAL
+        self.max_window_bytes = MAX_WINDOW_SIZE_BYTES
+        self.degraded_triggers = 0
+        self.skipped_partials = 0
+        self.aligned_finals = 0
+        self.unaligned_finals = 0
+
+        # Length of the transcribed windows, to compare eviction policies
+        self.transcribed_window_bytes = 0
+        self.transcription_count = 0
+
+    @property
+    def previous_byte_count(self) -> int:
+        """Number of bytes that have been cut off the front of the sliding window"""
+        return self.sliding_window.discarded_bytes
+
+    @property
+    def window_start_timestamp(self) -> float:
+        return self.previous_byte_count / BYTES_PER_SECOND
 
     def check_for_final(self, task=None) -> None:
         self.logger.debug("check_for_finals")
@@ -63,39 +259,153 @@ class Stream:
             self.flush_final(reason="threshold reached")
         elif self.agreement.contains_has_sentence_end():
             self.flush_final(reason="sentence end")
-        elif (time.time() - self.last_final_published) >= self.final_publish_second_threshold:
+        elif (virtual_clock.now() - self.last_final_published) >= self.final_publish_second_threshold:
             self.flush_final(reason="timeout")
 
     async def receive_bytes(self, bytes: bytes) -> None:
         """Function to receive bytes for transcription"""
         self.bytes_received_since_last_transcription += len(bytes)
-        self.sliding_window += bytes
-        self.total_bytes += bytes
+        self.sliding_window.append(bytes)
 
-        if self.bytes_received_since_last_transcription >= self.partial_transcription_byte_threshold or (
-            time.time() - self.last_transcription_timestamp
-            >= (self.partial_transcription_byte_threshold / BYTES_PER_SECOND)
-        ):
+        if self.scheduler is not None:
+            self.scheduler.notify_audio(self, len(bytes))
+            return
+
+        await self.trigger_policy.prepare(self)
+        if not self.trigger_policy.should_transcribe(self, bytes):
+            return
+        if self.state == "idle":
+            if self.skip_partial():
+                return
+            self.trigger_transcription()
+        elif self.state in ["decoding", "pending"]:
+            # Coalesce all triggers during a decode into one decode that starts when it finishes. The trigger counts
+            # as served, so the following chunks do not fire it again
+            self.state = "pending"
+            self.coalesced_triggers += 1
             self.bytes_received_since_last_transcription = 0
-            self.last_transcription_timestamp = time.time()
-
-            # Ensure that no duplicate transcription jobs are running
-            # This additonal check is needed as we are in nested async
-            if len(self.transcription_tasks) < 1:
-                self.logger.debug(f"Starting transcription task for window of length: {len(self.sliding_window)}")
-                task = asyncio.create_task(
-                    self.transcribe_sliding_window(self.sliding_window), name=f"transcription_task_stream_{self.id}"
-                )
-                self.transcription_tasks.add(task)
-                task.add_done_callback(self.check_for_final)
-                task.add_done_callback(self.transcription_tasks.discard)
+            self.last_transcription_timestamp = virtual_clock.now()
+            self.trigger_policy.transcription_started(self)
+
+    def trigger_transcription(self) -> None:
+        self.last_transcription_timestamp = virtual_clock.now()
+        if self.start_transcription() is not None:
+            self.trigger_policy.transcription_started(self)
+
+    def start_transcription(self) -> asyncio.Task | None:
+        """Starts a retranscription of the sliding window, returns None if one is already running"""
+        if self.state != "idle":
+            return None
+        self.logger.debug(f"Starting transcription task for window of length: {len(self.sliding_window)}")
+        self.state = "decoding"
+        self.decode_generation += 1
+        task = asyncio.create_task(
+            self.transcribe_sliding_window(self.sliding_window.float32(), generation=self.decode_generation),
+            name=f"transcription_task_stream_{self.id}",
+        )
+        self.transcription_tasks.add(task)
+        task.add_done_callback(self.transcription_tasks.discard)
+        task.add_done_callback(self.transcription_done)
+        return task
+
+    def transcription_done(self, task=None) -> None:
+        self.check_for_final()
+        if self.state == "closed":
+            return
+        pending = self.state == "pending"
+        self.state = "idle"
+        # Audio arrived during the decode and triggered, decode the whole window again right away
+        if pending and self.scheduler is None and not self.skip_partial():
+            self.last_transcription_timestamp = virtual_clock.now()
+            self.start_transcription()
+
+    def set_degradation_level(self, level: int, reason: str) -> None:
+        """Applies a degradation level of the overload controller and records it in the output"""
+        self.degradation_level = level
+        if level >= SHRINK_WINDOW:
+            window_bytes = int(self.overload_controller.degraded_window_ms / 1000 * BYTES_PER_SECOND)
+            self.max_window_bytes = min(window_bytes - window_bytes % WINDOW_CUT_ALIGNMENT_BYTES, MAX_WINDOW_SIZE_BYTES)
+        else:
+            self.max_window_bytes = MAX_WINDOW_SIZE_BYTES
+        self.logger.info(f"Degradation level {LEVEL_NAMES[level]} ({reason})")
+        self.output_handler.send_event("degradation", level=LEVEL_NAMES[level], reason=reason)
+
+    def degradation_name(self) -> str | None:
+        """Name of the current degradation level for the metadata of partials and finals, None if not degraded"""
+        return LEVEL_NAMES[self.degradation_level] if self.degradation_level > NORMAL else None
+
+    def skip_partial(self) -> bool:
+        """On the overload level skip_partials, only every n-th triggered retranscription runs"""
+        if self.degradation_level < SKIP_PARTIALS:
+            return False
+        self.degraded_triggers += 1
+        if self.degraded_triggers % self.overload_controller.partial_skip_factor == 0:
+            return False
+        self.skipped_partials += 1
+        # The skipped retranscription counts for the interval of the trigger
+        self.bytes_received_since_last_transcription = 0
+        self.last_transcription_timestamp = virtual_clock.now()
+        return True
 
     def start_stream(self) -> None:
-        pass
+        if self.scheduler is not None:
+            self.scheduler.register(self, self.priority)
+        if self.overload_controller is not None:
+            self.overload_controller.register(self)
+        if self.final_check_interval > 0:
+            self.finalization_timer = asyncio.create_task(
+                self.check_for_final_periodically(), name=f"finalization_timer_stream_{self.id}"
+            )
+
+    async def check_for_final_periodically(self) -> None:
+        while self.state != "closed":
+            await asyncio.sleep(self.final_check_interval)
+            if self.state != "closed":
+                self.check_for_final()
+
+    def preload_audio(self, audio_bytes: bytes) -> None:
+        """Computes the features of the whole audio upfront, if the stream uses the precomputed feature cache"""
+        if self.feature_cache_backend == "precomputed":
+            self.feature_cache.preload(pcm_to_float32(audio_bytes))
+
+    async def drain(self) -> None:
+        """Waits for running transcriptions, so that no partial is merged after the stream ended"""
+        # A scheduler may start the next transcription when the previous one finishes
+        while len(self.transcription_tasks) > 0 or len(self.finalization_tasks) > 0:
+            await asyncio.gather(*self.transcription_tasks, *self.finalization_tasks, return_exceptions=True)
 
     def end_stream(self) -> None:
         """Function to end the stream and send the final transcription"""
+        if self.scheduler is not None:
+            self.scheduler.unregister(self)
+        if self.overload_controller is not None:
+            self.overload_controller.unregister(self)
+        self.state = "closed"
+        if self.finalization_timer is not None:
+            self.finalization_timer.cancel()
         self.flush_final(reason="end stream")
+        audio_hours = (self.previous_byte_count + len(self.sliding_window)) / BYTES_PER_SECOND / 3600
+        self.logger.info(
+            f"Transcribed {self.transcription_count} windows with a mean length of {self.mean_window_seconds():.2f} s"
+            f" ({self.transcription_count / max(audio_hours, 1e-9):.0f} per audio hour), "
+            f"{self.coalesced_triggers} triggers coalesced, {self.stale_results} stale results dropped"
+        )
+        if self.overload_controller is not None:
+            self.logger.info(f"Skipped {self.skipped_partials} retranscriptions while overloaded")
+        if self.lazy_word_timestamps:
+            self.logger.info(f"Aligned {self.aligned_finals} finals, kept the approximate timing of {self.unaligned_finals}")
+        if self.language_detection_enabled:
+            self.logger.info(f"Detected the language {self.language_detections} times, last: {self.language}")
+        if self.agreement.early_commit_probability is not None:
+            self.logger.info(
+                f"Committed {self.agreement.early_commit_count} words early, "
+                f"{self.agreement.early_commit_corrections} of them were transcribed differently afterwards"
+            )
+        for profile, stats in self.profile_stats.items():
+            self.logger.info(
+                f"Profile {profile}: {stats['transcriptions']} transcriptions, "
+                f"{stats['inference_seconds'] / stats['transcriptions']:.3f} s on average"
+            )
 
     def finalize_transcript(self) -> Dict:
         current_transcript = self.agreement.unconfirmed
@@ -118,23 +428,184 @@ class Stream:
             if len(result["result"]) == 0:
                 return
             self.final_transcriptions.append(result)
+            self.last_final_word = agreed_results[-1]
+            metadata = {
+                "early_commits": (
+                    self.agreement.flushed_early_commits
+                    if self.agreement.early_commit_probability is not None
+                    else None
+                ),
+                "degradation": self.degradation_name(),
+            }
+
+            # The audio of the final is needed by the final model or the alignment, take it before the window is cut
+            span = self.final_span_audio(result) if self.final_transcriber is not None else None
+            alignment_span = (
+                self.alignment_span_audio(result) if self.lazy_word_timestamps and span is None else None
+            )
+
+            # Drop the audio of the final from the window
+            if self.evict_at_finals:
+                last_word_end = int(result["result"][-1]["end"] * BYTES_PER_SECOND)
+                eviction_target = last_word_end - self.eviction_keep_bytes
+                eviction_target -= eviction_target % WINDOW_CUT_ALIGNMENT_BYTES
+                if eviction_target > self.previous_byte_count:
+                    self.logger.debug(f"Evicting {eviction_target - self.previous_byte_count} bytes of finalized audio")
+                    self.cut_window(eviction_target - self.previous_byte_count)
 
             # Shorten window if needed
-            if len(self.sliding_window) > MAX_WINDOW_SIZE_BYTES:
-                bytes_to_cut_off = len(self.sliding_window) - MAX_WINDOW_SIZE_BYTES
+            if len(self.sliding_window) > self.max_window_bytes:
+                bytes_to_cut_off = len(self.sliding_window) - self.max_window_bytes
+                bytes_to_cut_off += -bytes_to_cut_off % WINDOW_CUT_ALIGNMENT_BYTES
                 self.logger.debug(f"Reducing sliding window size by {bytes_to_cut_off} bytes")
-                self.previous_byte_count += bytes_to_cut_off
-                self.window_start_timestamp += bytes_to_cut_off / BYTES_PER_SECOND
-                self.sliding_window = self.sliding_window[bytes_to_cut_off:]
+                self.cut_window(bytes_to_cut_off)
 
-            self.output_handler.send_final(result["result"], reason=reason)
+            if span is not None:
+                self.start_finalization(self.publish_refined_final(result, reason, metadata, *span))
+            elif alignment_span is not None:
+                self.start_finalization(self.publish_aligned_final(result, reason, metadata, *alignment_span))
+            else:
+                self.output_handler.send_final(result["result"], reason=reason, **metadata)
 
+            self.trim_final_transcriptions()
             self.logger.debug(f"Published final of {len(agreed_results)}.")
-            self.last_final_published = time.time()
+            self.last_final_published = virtual_clock.now()
 
         except Exception:
             self.logger.error(f"Error while transcribing audio: {traceback.format_exc()}")
 
+    def trim_final_transcriptions(self) -> None:
+        """
+        Drops the oldest finals that are no longer needed: finals before the window, as long as the remaining
+        ones still provide the prompt words. The last two finals are always kept for the trimming of new
+        hypotheses and the alignment of finals, so memory stays bounded in long sessions.
+        """
+        prompt_words = sum(len(final["result"]) for final in self.final_transcriptions)
+        while len(self.final_transcriptions) > 2:
+            oldest = self.final_transcriptions[0]
+            if oldest["result"][-1]["end"] >= self.window_start_timestamp:
+                break
+            if prompt_words - len(oldest["result"]) < PROMPT_WORD_COUNT:
+                break
+            prompt_words -= len(oldest["result"])
+            self.final_transcriptions.popleft()
+
+    def final_span_audio(self, result: Dict) -> Tuple[object, float] | None:
+        """Returns the window audio of the words of a final, with `final_context_bytes` around it, and its start time"""
+        start_byte = int(result["result"][0]["start"] * BYTES_PER_SECOND) - self.final_context_bytes
+        end_byte = int(result["result"][-1]["end"] * BYTES_PER_SECOND) + self.final_context_bytes
+        start_byte = max(start_byte - start_byte % BYTES_PER_SAMPLE, self.previous_byte_count)
+        end_byte = min(end_byte, self.previous_byte_count + len(self.sliding_window))
+        if end_byte <= start_byte:
+            return None
+        audio = self.sliding_window.float32()[
+            (start_byte - self.previous_byte_count) // BYTES_PER_SAMPLE : (end_byte - self.previous_byte_count)
+            // BYTES_PER_SAMPLE
+        ]
+        return audio, start_byte / BYTES_PER_SECOND
+
+    def start_finalization(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine, name=f"finalization_task_stream_{self.id}")
+        self.finalization_tasks.add(task)
+        task.add_done_callback(self.finalization_tasks.discard)
+
+    def alignment_span_audio(self, result: Dict) -> Tuple[object, float, List[str]] | None:
+        """
+        Returns the audio from the end of the previous final to the end of the window, its start time and the words
+        spoken in it: the words of the final followed by the words that are not flushed yet. Aligning all of them
+        keeps the words of the final from being stretched over the speech after it.
+        """
+        previous_end = self.final_transcriptions[-2]["result"][-1]["end"] if len(self.final_transcriptions) > 1 else 0.0
+        start_byte = int(previous_end * BYTES_PER_SECOND) - self.final_context_bytes
+        start_byte = max(start_byte - start_byte % BYTES_PER_SAMPLE, self.previous_byte_count)
+        if start_byte >= self.previous_byte_count + len(self.sliding_window):
+            return None
+        audio = self.sliding_window.float32()[(start_byte - self.previous_byte_count) // BYTES_PER_SAMPLE :]
+        words = [word["word"] for word in result["result"]]
+        words += [word.word for word in self.agreement.confirmed] + [word.word for word in self.agreement.unconfirmed]
+        return audio, start_byte / BYTES_PER_SECOND, words
+
+    async def publish_aligned_final(
+        self, result: Dict, reason: str, metadata: Dict, audio, span_start: float, words: List[str]
+    ) -> None:
+        """
+        Replaces the approximate timestamps of the words of a final by aligned ones and publishes it. The approximate
+        timestamps are kept if the aligned words do not match the words of the final.
+        """
+        async with self.finalization_lock:
+            try:
+                aligned = await self.transcriber.align_words_async(audio, words, self.language)
+                final_words = result["result"]
+                if len(aligned) >= len(final_words) and all(
+                    normalize_word(word.word) == normalize_word(final_word["word"])
+                    for word, final_word in zip(aligned, final_words)
+                ):
+                    # The final is shared with the prompts and the deduplication of the next partials
+                    for word, final_word in zip(aligned, final_words):
+                        final_word["start"] = float(f"{word.start + span_start:.6f}")
+                        final_word["end"] = float(f"{word.end + span_start:.6f}")
+                    self.aligned_finals += 1
+                else:
+                    self.logger.debug(f"Aligned words do not match the final '{result['text']}', keeping its timing")
+                    self.unaligned_finals += 1
+            except Exception:
+                self.logger.error(f"Error while aligning final: {traceback.format_exc()}")
+            self.output_handler.send_final(result["result"], reason=reason, **metadata)
+
+    async def publish_refined_final(
+        self, result: Dict, reason: str, metadata: Dict, audio, span_start: float
+    ) -> None:
+        """
+        Transcribes the audio of a final again with the final model and publishes its words instead. The words of the
+        retranscription model are kept if the final model finds none in the span.
+        """
+        async with self.finalization_lock:
+            try:
+                start_time = virtual_clock.now()
+                segments = await self.final_transcriber.transcribe_async(
+                    audio, self.final_prompt(span_start), profile=self.final_profile, language=self.language
+                )
+                # Only keep the words of the final, not the ones in the context around it
+                first_start = result["result"][0]["start"]
+                last_end = result["result"][-1]["end"]
+                words = []
+                for segment in segments:
+                    for word in segment.words or []:
+                        center = span_start + (word.start + word.end) / 2
+                        if word.word and first_start <= center <= last_end:
+                            word.start += span_start
+                            word.end += span_start
+                            words.append(word)
+
+                refined = self.build_result_from_words(words)
+                if len(refined["result"]) > 0:
+                    self.logger.debug(
+                        f"Final model replaced '{result['text']}' with '{refined['text']}' "
+                        f"in {virtual_clock.now() - start_time:.2f} s"
+                    )
+                    # The final is shared with the prompts and the deduplication of the next partials
+                    result["result"] = refined["result"]
+                    result["text"] = refined["text"]
+                    if result is self.final_transcriptions[-1]:
+                        self.last_final_word = words[-1]
+            except Exception:
+                self.logger.error(f"Error while transcribing final: {traceback.format_exc()}")
+            self.output_handler.send_final(result["result"], reason=reason, **metadata)
+
+    def cut_window(self, num_bytes: int) -> None:
+        """Removes audio from the front of the sliding window, together with its cached features and VAD scores"""
+        self.sliding_window.cut_off(num_bytes)
+        if self.feature_cache is not None:
+            self.feature_cache.drop_before(self.previous_byte_count // BYTES_PER_SAMPLE)
+        if self.vad is not None:
+            self.vad.drop_before(self.previous_byte_count // BYTES_PER_SAMPLE)
+
+    def mean_window_seconds(self) -> float:
+        """Mean length of the transcribed windows"""
+        if self.transcription_count == 0:
+            return 0.0
+        return self.transcribed_window_bytes / self.transcription_count / BYTES_PER_SECOND
+
     def build_result_from_words(self, words: List[Word], save=True, window_start_time=0, last_final_time=0) -> Dict:
         result = {"result": [], "text": ""}
         for word in words:
@@ -155,74 +626,239 @@ class Stream:
         result["text"] = " ".join([x["word"] for x in result["result"]])
         return result
 
-    async def transcribe_sliding_window(self, window_content, skip_send=False) -> None:
+    def result_is_stale(self, generation: int | None, cutoff_timestamp: float) -> bool:
+        """Whether the result of a decode is outdated when it arrives"""
+        if self.state == "closed":
+            return True
+        if generation is not None and generation < self.merged_generation:
+            # A decode of a newer window was merged already
+            return True
+        # All audio of the window has been published as final meanwhile
+        return len(self.final_transcriptions) > 0 and self.final_transcriptions[-1]["result"][-1]["end"] >= cutoff_timestamp
+
+    async def transcribe_sliding_window(self, window_content, skip_send=False, generation: int = None) -> None:
         if len(window_content) == 0:
             self.logger.warning("Received empty chunk, skipping transcription.")
             return  # Skip transcription for empty chunk
 
         try:
-            start_time = time.time()
+            start_time = virtual_clock.now()
             self.bytes_received_since_last_transcription = 0
 
             window_start_timestamp = self.previous_byte_count / BYTES_PER_SECOND
-            cutoff_timestamp = (len(window_content) + self.previous_byte_count) / BYTES_PER_SECOND
-
-            # Pass the chunk to the transcriber
-            segments = self.transcriber.transcribe(
+            self.transcribed_window_bytes += len(window_content) * BYTES_PER_SAMPLE
+            self.transcription_count += 1
+            cutoff_timestamp = (len(window_content) * BYTES_PER_SAMPLE + self.previous_byte_count) / BYTES_PER_SECOND
+
+            profile = self.final_profile if self.final_profile is not None and self.final_is_due() else self.partial_profile
+            prompt, prefix, prefix_words = "", None, []
+            if self.prefix_decoding:
+                prompt = self.final_prompt(window_start_timestamp)
+                prefix, prefix_words = self.window_prefix(window_start_timestamp)
+
+            if self.language_detection_due(len(window_content) * BYTES_PER_SAMPLE):
+                await self.pin_language(window_content)
+
+            transcriber, feature_cache = self.transcriber, self.feature_cache
+            if self.degradation_level >= CHEAP_DECODING and profile == self.partial_profile:
+                if self.overload_controller.degraded_profile is not None:
+                    profile = self.overload_controller.degraded_profile
+                if self.overload_controller.degraded_transcriber is not None:
+                    # The cached features belong to the feature extractor of the stream's transcriber
+                    transcriber, feature_cache = self.overload_controller.degraded_transcriber, None
+
+            # Pass the chunk to the transcriber, inference runs off the event loop
+            segments = await transcriber.transcribe_async(
                 window_content,
+                prompt,
+                feature_cache=feature_cache,
+                window_start_sample=self.previous_byte_count // BYTES_PER_SAMPLE,
+                vad=self.vad,
+                prefix=prefix,
+                profile=profile,
+                language=self.language,
+                word_timestamps=False if self.lazy_word_timestamps else None,
             )
+            inference_time = virtual_clock.now() - start_time
+            stats = self.profile_stats.setdefault(profile or "default", {"transcriptions": 0, "inference_seconds": 0.0})
+            stats["transcriptions"] += 1
+            stats["inference_seconds"] += inference_time
+
+            if self.result_is_stale(generation, cutoff_timestamp):
+                self.stale_results += 1
+                self.logger.debug(f"Dropping stale result of decode {generation}")
+                return
+            if generation is not None:
+                self.merged_generation = generation
 
             new_words = []
-
-            for segment in list(segments):
-                if segment.words is None:
+            # With a prefix, the generated words start after the finals and confirmed words of the prefix
+            prefix_end = None
+            if prefix is not None:
+                prefix_ends = [word.end for word in prefix_words]
+                if len(self.final_transcriptions) > 0:
+                    prefix_ends.append(self.final_transcriptions[-1]["result"][-1]["end"])
+                prefix_end = max(prefix_ends) - window_start_timestamp
+
+            for segment in segments:
+                words = segment.words
+                if words is None and self.lazy_word_timestamps:
+                    words = approximate_words(segment, prefix_end)
+                if words is None:
                     continue
-                for word in segment.words:
+                for word in words:
                     if word.word:
                         word.start += window_start_timestamp
                         word.end += window_start_timestamp
                         new_words.append(word)
 
-            if len(new_words) > 0 and len(self.final_transcriptions) > 0:
-                while (new_words[0].start < self.final_transcriptions[-1]["result"][-1]["end"]) or (
-                    new_words[0].word == self.final_transcriptions[-1]["result"][-1]["word"]
-                    # and new_words[0].start < self.final_transcriptions[-1]["result"][-1]["end"]
+            # With a prefix, the transcriber only returned the words after it
+            new_words = prefix_words + new_words
+
+            deduplicated = False
+            if self.lazy_word_timestamps and prefix is None and len(new_words) > 0:
+                # The approximate timestamps are not precise enough, remove the final words of the window by text
+                final_keys = [normalize_word(word) for word in self.window_final_words(window_start_timestamp)]
+                known = known_prefix_length([normalize_word(word.word) for word in new_words], final_keys)
+                if known is not None:
+                    new_words = new_words[known:]
+                    deduplicated = True
+
+            if not deduplicated and len(new_words) > 0 and len(self.final_transcriptions) > 0:
+                last_final_end = self.final_transcriptions[-1]["result"][-1]["end"]
+                skipped = 0
+                while skipped < len(new_words) and new_words[skipped].start < last_final_end:
+                    skipped += 1
+                # The last final word decoded again with its timestamps shifted just past the final, a word repeated
+                # by the speaker ("very very") is kept
+                if (
+                    skipped < len(new_words)
+                    and word_key(new_words[skipped]) == word_key(self.last_final_word)
+                    and new_words[skipped].start - last_final_end < DUPLICATE_WORD_MAX_GAP_SECONDS
                 ):
-                    new_words.pop(0)
+                    skipped += 1
+                new_words = new_words[skipped:]
 
             if not skip_send:
                 self.output_handler.send_partial(
-                    self.build_result_from_words(new_words, save=False), window_start_timestamp, cutoff_timestamp
+                    self.build_result_from_words(new_words, save=False),
+                    window_start_timestamp,
+                    cutoff_timestamp,
+                    profile=profile,
+                    inference_time=inference_time,
+                    degradation=self.degradation_name(),
                 )
 
-            self.agreement.merge(new_words)
-
-            end_time = time.time()
+            # Confirmed words of the prefix are already part of the agreement
+            prefix_ids = {id(word) for word in prefix_words}
+            if transcriber is not self.agreement_transcriber:
+                # Only consecutive hypotheses of the same model confirm words, e.g. when the partials switch to the
+                # degraded transcriber while the final-due windows stay on the stream's transcriber
+                self.agreement.forget_hypotheses()
+                self.agreement_transcriber = transcriber
+            self.agreement.merge([word for word in new_words if id(word) not in prefix_ids], cutoff_timestamp)
+
+            if self.overload_controller is not None:
+                # Audio that arrived while the transcription was waiting and running
+                received_timestamp = (self.previous_byte_count + len(self.sliding_window)) / BYTES_PER_SECOND
+                self.overload_controller.report(self, received_timestamp - cutoff_timestamp)
+
+            end_time = virtual_clock.now()
             self.logger.debug("Partial transcription took {:.2f} s".format(end_time - start_time))
 
-            # adjust time between transcriptions
-            self.update_partial_threshold(end_time - start_time)
+            # adjust time between transcriptions, with a scheduler the timing is decided globally
+            if self.scheduler is None:
+                self.update_partial_threshold(end_time - start_time)
 
         except Exception:
             self.logger.error("Error while transcribing audio: {}".format(traceback.format_exc()))
 
+    def language_detection_due(self, window_bytes: int) -> bool:
+        """Whether the language should be detected on a window of this length before it is transcribed"""
+        if not self.language_detection_enabled or window_bytes < self.language_detection_bytes:
+            return False
+        if self.language_detected_at_byte is None:
+            return True
+        stream_bytes = self.previous_byte_count + window_bytes
+        return (
+            self.language_redetection_bytes > 0
+            and stream_bytes - self.language_detected_at_byte >= self.language_redetection_bytes
+        )
+
+    async def pin_language(self, window_content) -> None:
+        """Detects the language of the window and uses it for all following transcriptions of the stream"""
+        window_bytes = len(window_content) * BYTES_PER_SAMPLE
+        # Claim the detection before awaiting it, so overlapping transcriptions do not detect again
+        self.language_detected_at_byte = self.previous_byte_count + window_bytes
+        try:
+            language, probability = await self.transcriber.detect_language_async(window_content)
+        except Exception:
+            self.logger.error(f"Error while detecting the language: {traceback.format_exc()}")
+            return
+        self.language_detections += 1
+        if language != self.language:
+            self.logger.info(f"Pinned language {language} (probability {probability:.2f})")
+        self.language = language
+        self.language_probability = probability
+
+    def final_is_due(self) -> bool:
+        """Whether the words of the next transcription will probably be published as final when they are confirmed"""
+        if len(self.agreement.confirmed) + len(self.agreement.unconfirmed) > FINAL_TRANSCRIPTION_THRESHOLD:
+            return True
+        return any(
+            symbol in word.word for word in self.agreement.unconfirmed for symbol in SENTENCE_TERMINATION_CHARACTERS
+        )
+
+    def window_prefix(self, window_start_timestamp: float) -> Tuple[str | None, List[Word]]:
+        """
+        Returns the fixed text at the start of the window as decoder prefix: the flushed final words and confirmed
+        words that lie inside the window. Also returns the confirmed words, they are not part of the decoder output.
+        """
+        final_words = self.window_final_words(window_start_timestamp)
+        confirmed = [word for word in self.agreement.confirmed if word.start >= window_start_timestamp]
+        text = " ".join(final_words + [word.word.strip() for word in confirmed])
+        return (text or None), confirmed
+
+    def window_final_words(self, window_start_timestamp: float) -> List[str]:
+        """Returns the flushed final words that lie inside the window"""
+        return [
+            word["word"]
+            for final in self.final_transcriptions
+            for word in final["result"]
+            if word["start"] >= window_start_timestamp
+        ]
+
+    def final_prompt(self, window_start_timestamp: float) -> str:
+        """Returns the last flushed final words before the window as initial prompt"""
+        words = []
+        for final in reversed(self.final_transcriptions):
+            for word in reversed(final["result"]):
+                if word["start"] < window_start_timestamp:
+                    words.append(word["word"])
+            if len(words) >= PROMPT_WORD_COUNT:
+                break
+        return " ".join(reversed(words[:PROMPT_WORD_COUNT]))
+
+    def final_publish_seconds(self) -> float:
+        """Time without a final after which the confirmed words are published, a multiple of the partial interval"""
+        interval = max(self.partial_transcription_byte_threshold, PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD) / BYTES_PER_SECOND
+        return interval * FINAL_PUBLISH_SECOND_THRESHOLD_FACTOR
+
     def update_partial_threshold(self, last_run_duration: float):
         # dont adjust any timings with a small window
         # these adjustments would be overwritten anyway
         if (
-            len(self.sliding_window) < MAX_WINDOW_SIZE_BYTES * 0.75
+            len(self.sliding_window) < self.max_window_bytes * 0.75
             and last_run_duration < self.partial_transcription_byte_threshold / BYTES_PER_SECOND
         ):
             self.logger.debug(
-                f"Current window too small for adjustment ({len(self.sliding_window)}/{MAX_WINDOW_SIZE_BYTES * 0.75})"
+                f"Current window too small for adjustment ({len(self.sliding_window)}/{self.max_window_bytes * 0.75})"
             )
             return
         new_threshold = (last_run_duration * BYTES_PER_SECOND) + 0.5
         self.logger.debug(f"Adjusted threshold duration to : {new_threshold / BYTES_PER_SECOND}")
         self.partial_transcription_byte_threshold = new_threshold
-        self.final_publish_second_threshold = (
-            self.partial_transcription_byte_threshold * FINAL_PUBLISH_SECOND_THRESHOLD_FACTOR
-        )
+        self.final_publish_second_threshold = self.final_publish_seconds()
 
     def concatenate_audio_with_crossfade(
         self, audio_chunk1: bytes, audio_chunk2: bytes, crossfade_duration=20
@@ -29,7 +29,10 @@ class Dataset:
         return len(self.entries)
     
     def __next__(self) -> Tuple[str, bytes, str]:
-        element_id = next(self.entries_iter)
+        return self.load(next(self.entries_iter))
+
+    def load(self, element_id: str) -> Tuple[str, bytes, str]:
+        """Loads one element by its ID, independent of the iteration"""
         element_path = path.join(self.dataset_path, element_id)
 
         logger.debug(f"Loading dataset element with ID {element_id}")
@@ -43,6 +46,20 @@ class Dataset:
             transcript = f.read()
             return element_id, audio_bytes, transcript
 
+    def audio_duration(self, element_id: str) -> float:
+        """Duration of the audio of an element in seconds, read from the file header without decoding it"""
+        audio_file = path.join(self.dataset_path, element_id, f"{element_id}.mp3")
+        output = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", audio_file],
+            capture_output=True,
+            text=True,
+        ).stdout
+        try:
+            return float(output)
+        except ValueError:
+            logger.warning(f"Could not read the duration of {audio_file}")
+            return 0.0
+
     @staticmethod
     def mp3_to_waveform(mp3_file, sample_rate=16000) -> bytes:
         # FFmpeg-command to read mp3 as bytes
@@ -1,5 +1,8 @@
-import time
+from collections import deque
+from typing import Iterator
 from pydub.utils import re
+from src.helper import virtual_clock
+from src.helper.session_log import SessionLog
 from src.helper.word_sequence import word_dict_sequence_to_string
 import logging
 logger = logging.getLogger(__name__)
@@ -12,59 +15,121 @@ def norm_word(word) -> str:
 
 
 class OutputHandler:
-    def __init__(self):
-        self.partial_predictions = []
-        self.final_messages = []
-        self.final_words = []
+    def __init__(self, session_log: SessionLog = None, max_messages_in_memory: int = 1000):
+        """
+        Collects the partials and finals of a stream.
+
+        Args:
+            session_log: Optional log for long sessions. Every partial and final is appended to it, and only the
+                last `max_messages_in_memory` partials, finals and final words are kept in memory. Use
+                `iter_final_words`, `iter_final_messages` and `iter_partial_predictions` to read all of them.
+            max_messages_in_memory: Length of the in-memory tails when a session log is used.
+        """
+        self.session_log = session_log
+        if session_log is not None:
+            self.partial_predictions = deque(maxlen=max_messages_in_memory)
+            self.final_messages = deque(maxlen=max_messages_in_memory)
+            self.final_words = deque(maxlen=max_messages_in_memory)
+            self.events = deque(maxlen=max_messages_in_memory)
+        else:
+            self.partial_predictions = []
+            self.final_messages = []
+            self.final_words = []
+            self.events = []
+        self.event_count = 0
 
     def init_timer(self, offset: float = 0):
         """
         Initialize the timer for the output handler.
         """
-        self.start_time = time.perf_counter() + offset
+        self.start_time = virtual_clock.now() + offset
         logger.info("OutputHandler timer initialized at %f with offset %f", self.start_time, offset)
 
-    def send_partial(self, words, window_time_start=None, window_time_end=None):
+    def send_partial(self, words, window_time_start=None, window_time_end=None, **metadata):
         """
         Send partial text to the output.
+        Additional metadata, e.g. the transcription profile and inference time, is stored with the partial.
         """
         if window_time_start is None:
             window_time_start = 0.0
         if window_time_end is None:
-            window_time_end = time.perf_counter() - self.start_time
+            window_time_end = virtual_clock.now() - self.start_time
         prediction = {
             "result": words,
             "window": [window_time_start, window_time_end],
-            "observation_time": time.perf_counter() - self.start_time
+            "observation_time": virtual_clock.now() - self.start_time
         }
+        prediction.update({key: value for key, value in metadata.items() if value is not None})
         self.partial_predictions.append(prediction)
+        if self.session_log is not None:
+            self.session_log.append("partial", prediction)
 
-    def send_final(self, words, reason: str = None):
+    def send_final(self, words, reason: str = None, **metadata):
+        """
+        Send final words to the output.
+        Additional metadata, e.g. the number of early committed words, is stored with the final message.
+        """
         final_message = {
             "result": words,
             "reason": reason,
-            "observation_time": time.perf_counter() - self.start_time
+            "observation_time": virtual_clock.now() - self.start_time
         }
+        final_message.update({key: value for key, value in metadata.items() if value is not None})
         self.final_messages.append(final_message)
-        i = len(self.final_words)
-        self.final_words += words
-        while i < len(self.final_words):
+        kept_words = []
+        for word in words:
+            previous = self.final_words[-1] if len(self.final_words) > 0 else None
+            # Only overlapping words can be duplicates, compare their text only then
             if (
-                norm_word(self.final_words[i]["word"]) == norm_word(self.final_words[i-1]["word"])
-                and self.final_words[i]["start"] < self.final_words[i-1]["end"]
+                previous is not None
+                and word["start"] < previous["end"]
+                and norm_word(word["word"]) == norm_word(previous["word"])
             ):
-                self.final_words.pop(i)
-            else:
-                i += 1
+                continue
+            self.final_words.append(word)
+            kept_words.append(word)
+        if self.session_log is not None:
+            self.session_log.append("final", {"message": final_message, "words": kept_words})
+
+    def send_event(self, kind: str, **data):
+        """
+        Record an event of the stream that is neither partial nor final, e.g. a change of the overload degradation.
+        """
+        event = {"event": kind, "observation_time": virtual_clock.now() - self.start_time}
+        event.update(data)
+        self.events.append(event)
+        self.event_count += 1
+        if self.session_log is not None:
+            self.session_log.append("event", event)
+
+    def iter_partial_predictions(self) -> Iterator[dict]:
+        if self.session_log is None:
+            return iter(self.partial_predictions)
+        return self.session_log.read("partial")
+
+    def iter_final_messages(self) -> Iterator[dict]:
+        if self.session_log is None:
+            return iter(self.final_messages)
+        return (final["message"] for final in self.session_log.read("final"))
+
+    def iter_final_words(self) -> Iterator[dict]:
+        if self.session_log is None:
+            return iter(self.final_words)
+        return (word for final in self.session_log.read("final") for word in final["words"])
+
+    def iter_events(self) -> Iterator[dict]:
+        if self.session_log is None:
+            return iter(self.events)
+        return self.session_log.read("event")
 
 class DebugOutputHandler(OutputHandler):
-    def send_partial(self, words, window_time_start=None, window_time_end=None):
-        super().send_partial(words, window_time_start, window_time_end)
+    def send_partial(self, words, window_time_start=None, window_time_end=None, **metadata):
+        super().send_partial(words, window_time_start, window_time_end, **metadata)
         partial = self.partial_predictions[-1]
         print(f"{partial['observation_time']:6.2f}: Partial - {words['result'][0]['start']} {words['text']}")
 
-    def send_final(self, words, reason: str = None):
-        super().send_final(words, reason)
+    def send_final(self, words, reason: str = None, **metadata):
+        super().send_final(words, reason, **metadata)
         final = self.final_messages[-1]
         print(f"\n{final['observation_time']:6.2f}: {reason} - {word_dict_sequence_to_string(words)}")
         last_final_word = final["result"][-1]
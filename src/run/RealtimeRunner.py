@@ -1,11 +1,12 @@
 from src.run.TimedStreamingTranscriber import TimedStreamingTranscriber
 from src.run.Dataset import Dataset
 from src.run.OutputHandler import OutputHandler
+from src.helper.session_log import SessionLog
 from src.run.Stream import Stream
 from src.melvin.StreamTranscriber import StreamTranscriber
 
 from tqdm import tqdm
-from typing import Literal
+from typing import Iterable, Literal
 import os
 import json
 import logging
@@ -20,8 +21,18 @@ class RealtimeRunner:
         method: Literal["melvin", "assemblyai"] = "melvin",
         out_dir: str = None,
         stream_transcriber: StreamTranscriber = None,
+        stream_options: dict = None,
+        long_session: dict = None,
     ):
+        """
+        Args:
+            long_session: Optional long session mode, e.g. `{"max_messages_in_memory": 1000}`. The messages of each
+                sample are appended to `<id>_session.jsonl` in the run directory and only a bounded tail is kept in
+                memory, see `OutputHandler`. The result files are written from the log.
+        """
+        self.long_session = long_session
         self.stream_transcriber = stream_transcriber
+        self.stream_options = stream_options or {}
         self.dataset = dataset
         self.out_dir = out_dir
         self.method = method
@@ -29,19 +40,40 @@ class RealtimeRunner:
     async def run(self):
         os.makedirs(self.out_dir, exist_ok=True)
         for id, audio_bytes, transcription in tqdm(self.dataset):
+            await self.run_sample(id, audio_bytes)
+
+    async def run_sample(self, id: str, audio_bytes: bytes) -> TimedStreamingTranscriber:
+        """Replays one sample and writes its result files to the run directory, returns the replaying transcriber"""
+        session_log = None
+        if self.long_session is not None:
+            session_log = SessionLog(os.path.join(self.out_dir, f"{id}_session.jsonl"))
+            out = OutputHandler(session_log, **self.long_session)
+        else:
             out = OutputHandler()
-            stream = Stream.create(
-                type=self.method,
-                output_handler=out,
-                whisper_transcriber=self.stream_transcriber,
-            )
-            transcriber = TimedStreamingTranscriber(stream, out, chunk_length_ms=50)
-            await transcriber.transcribe(audio_bytes)
-            with open(os.path.join(self.out_dir, f"{id}_final.json"), "w") as f:
-                json.dump(out.final_words, f)
-            with open(
-                os.path.join(self.out_dir, f"{id}_final_messages.json"), "w"
-            ) as f:
-                json.dump(out.final_messages, f)
-            with open(os.path.join(self.out_dir, f"{id}_partial.json"), "w") as f:
-                json.dump(out.partial_predictions, f)
+        stream = Stream.create(
+            type=self.method,
+            output_handler=out,
+            whisper_transcriber=self.stream_transcriber,
+            **self.stream_options,
+        )
+        transcriber = TimedStreamingTranscriber(stream, out, chunk_length_ms=50)
+        await transcriber.transcribe(audio_bytes)
+        write_json_array(os.path.join(self.out_dir, f"{id}_final.json"), out.iter_final_words())
+        write_json_array(os.path.join(self.out_dir, f"{id}_final_messages.json"), out.iter_final_messages())
+        write_json_array(os.path.join(self.out_dir, f"{id}_partial.json"), out.iter_partial_predictions())
+        if out.event_count > 0:
+            write_json_array(os.path.join(self.out_dir, f"{id}_events.json"), out.iter_events())
+        if session_log is not None:
+            session_log.close()
+        return transcriber
+
+
+def write_json_array(path: str, items: Iterable) -> None:
+    """Writes the items as JSON array one by one, so they do not have to be in memory at once"""
+    with open(path, "w") as f:
+        f.write("[")
+        for i, item in enumerate(items):
+            if i > 0:
+                f.write(", ")
+            json.dump(item, f)
+        f.write("]")
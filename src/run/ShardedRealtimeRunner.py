@@ -0,0 +1,203 @@
+"""Module to replay the samples of a dataset in parallel worker processes"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import logging
+import multiprocessing
+import os
+import time
+from typing import Dict, List, Tuple
+
+from tqdm import tqdm
+
+from src.helper.virtual_clock import run_virtual
+from src.melvin.StreamTranscriber import StreamTranscriber
+from src.run.Dataset import Dataset
+from src.run.RealtimeRunner import RealtimeRunner
+
+logger = logging.getLogger(__name__)
+
+# Chunks sent later than this behind their due time delay the stream itself, its latencies are not comparable
+MAX_CHUNK_DELAY_SECONDS = 0.1
+# Share of the time the threads of a worker were ready to run but waited for a core, above it inference is slowed down
+MAX_RUN_QUEUE_WAIT_SHARE = 0.1
+
+# State of a worker process, see `_init_worker`
+_worker: Dict = {}
+
+
+class ShardedRealtimeRunner:
+    def __init__(
+        self,
+        dataset: Dataset,
+        out_dir: str,
+        model_name: str,
+        workers: int = None,
+        cpu_threads: int = None,
+        device: str = "cpu",
+        transcriber_options: dict = None,
+        final_model: str = None,
+        stream_options: dict = None,
+        long_session: dict = None,
+        virtual_clock: dict = None,
+    ):
+        """
+        Replays the samples of a dataset like `RealtimeRunner`, but shards them over worker processes. Each worker
+        loads its own `StreamTranscriber` with a budget of `cpu_threads` and replays one sample at a time. Samples are
+        started longest first, so no long sample is left running alone at the end. The result files are written to
+        `out_dir` like by `RealtimeRunner`.
+
+        Workers compete for the CPU, which slows their inference and with it the measured latencies. A warning is
+        logged when the workers need more threads than there are cores, and for each sample whose replay fell behind
+        its audio or whose worker threads waited for a core for more than `MAX_RUN_QUEUE_WAIT_SHARE` of the time they
+        were ready to run (from the Linux scheduler statistics).
+
+        The workers are forked before any model is loaded, so the calling script is not run again in them.
+
+        Args:
+            dataset: The samples to replay.
+            out_dir: Run directory for the result files.
+            model_name: Model of the transcriber of each worker.
+            workers: Number of worker processes. Defaults to the number of cores divided by `cpu_threads`.
+            cpu_threads: Inference threads per worker. Defaults to the number of cores divided by `workers`.
+            device: cpu or cuda. On cuda, all workers share the first GPU.
+            transcriber_options: Further keyword arguments of the transcriber, e.g. `encoder_buckets`.
+            final_model: Optional model of each worker that transcribes the finals again, see `Stream`.
+            stream_options: Keyword arguments of the melvin streams, only plain values as they are sent to the workers.
+            long_session: See `RealtimeRunner`.
+            virtual_clock: Optional, e.g. `{"compute_scale": 1.0}`, replays each sample on a virtual clock, see
+                `src.helper.virtual_clock`.
+        """
+        self.dataset = dataset
+        self.out_dir = out_dir
+        cores = len(os.sched_getaffinity(0))
+        if workers is None:
+            workers = max(1, cores // (cpu_threads or 4))
+        if cpu_threads is None:
+            cpu_threads = max(1, cores // workers)
+        self.workers = workers
+        self.cpu_threads = cpu_threads
+        self.cores = cores
+        self.worker_config = {
+            "model_name": model_name,
+            "cpu_threads": cpu_threads,
+            "device": device,
+            "transcriber_options": transcriber_options or {},
+            "final_model": final_model,
+            "stream_options": stream_options or {},
+            "long_session": long_session,
+            "out_dir": out_dir,
+            "dataset": dataset,
+            "compute_scale": virtual_clock.get("compute_scale", 1.0) if virtual_clock is not None else None,
+        }
+        self.sample_stats: List[Dict] = []
+
+    def run(self) -> None:
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.workers * self.cpu_threads > self.cores:
+            logger.warning(
+                f"{self.workers} workers with {self.cpu_threads} threads each oversubscribe {self.cores} cores, "
+                "inference slows down and the measured latencies are distorted"
+            )
+
+        durations = {sample_id: self.dataset.audio_duration(sample_id) for sample_id in self.dataset.entries}
+        sample_ids = sorted(durations, key=durations.get, reverse=True)
+        logger.info(
+            f"Replaying {len(sample_ids)} samples ({sum(durations.values()) / 3600:.1f} h) on {self.workers} workers "
+            f"with {self.cpu_threads} threads each"
+        )
+
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.worker_config,),
+        )
+        start_time = time.perf_counter()
+        with executor:
+            futures = [executor.submit(_run_sample, sample_id) for sample_id in sample_ids]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                stats = future.result()
+                self.sample_stats.append(stats)
+                if self.is_contended(stats):
+                    logger.warning(
+                        f"Sample {stats['id']} ran under contention (chunks up to {stats['max_chunk_delay']:.2f} s "
+                        f"late, threads waited for a core {stats['run_queue_wait_share']:.0%} of the time)"
+                    )
+
+        contended = [stats["id"] for stats in self.sample_stats if self.is_contended(stats)]
+        audio_seconds = sum(stats["audio_seconds"] for stats in self.sample_stats)
+        logger.info(
+            f"Replayed {audio_seconds / 3600:.1f} h of audio in {(time.perf_counter() - start_time) / 3600:.2f} h, "
+            f"{len(contended)} of {len(self.sample_stats)} samples under contention"
+        )
+        if contended:
+            logger.warning(f"Latencies of these samples are distorted by contention: {contended}")
+
+    def is_contended(self, stats: Dict) -> bool:
+        return (
+            stats["max_chunk_delay"] > MAX_CHUNK_DELAY_SECONDS
+            or stats["run_queue_wait_share"] > MAX_RUN_QUEUE_WAIT_SHARE
+        )
+
+
+def _scheduler_seconds() -> Tuple[float, float]:
+    """Seconds the threads of this process ran and waited in the run queue, zero without scheduler statistics"""
+    run, wait = 0, 0
+    for path in glob.glob("/proc/self/task/*/schedstat"):
+        try:
+            with open(path) as f:
+                fields = f.read().split()
+        except OSError:
+            # The thread ended in the meantime
+            continue
+        run += int(fields[0])
+        wait += int(fields[1])
+    return run / 1e9, wait / 1e9
+
+
+def _create_transcriber(model_name: str, config: Dict, **kwargs) -> StreamTranscriber:
+    if config["device"] == "cpu":
+        return StreamTranscriber.for_cpu(model_name, config["cpu_threads"], 1, **kwargs)
+    return StreamTranscriber.for_gpu(model_name, [0], **kwargs)
+
+
+def _init_worker(config: Dict) -> None:
+    """Loads the transcribers of a worker process once, before its first sample"""
+    stream_options = dict(config["stream_options"])
+    if config["final_model"] is not None:
+        stream_options["final_transcriber"] = _create_transcriber(config["final_model"], config)
+    _worker["compute_scale"] = config["compute_scale"]
+    _worker["dataset"] = config["dataset"]
+    _worker["runner"] = RealtimeRunner(
+        config["dataset"],
+        out_dir=config["out_dir"],
+        stream_transcriber=_create_transcriber(config["model_name"], config, **config["transcriber_options"]),
+        stream_options=stream_options,
+        long_session=config["long_session"],
+    )
+
+
+def _run_sample(sample_id: str) -> Dict:
+    """Replays one sample in a worker process and returns the stats of its replay"""
+    _, audio_bytes, _ = _worker["dataset"].load(sample_id)
+    runner: RealtimeRunner = _worker["runner"]
+    start_time = time.perf_counter()
+    start_run, start_wait = _scheduler_seconds()
+    compute_scale = _worker["compute_scale"]
+    if compute_scale is None:
+        transcriber = asyncio.run(runner.run_sample(sample_id, audio_bytes))
+    else:
+        transcriber = run_virtual(
+            runner.run_sample(sample_id, audio_bytes), compute_time=lambda seconds: seconds * compute_scale
+        )
+    run, wait = _scheduler_seconds()
+    run, wait = run - start_run, wait - start_wait
+    return {
+        "id": sample_id,
+        "audio_seconds": len(audio_bytes) / 32000,
+        "wall_seconds": time.perf_counter() - start_time,
+        "max_chunk_delay": transcriber.max_chunk_delay,
+        "run_queue_wait_share": wait / (run + wait) if run + wait > 0 else 0.0,
+    }
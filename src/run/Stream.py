@@ -21,6 +21,21 @@ class Stream:
         # This method should be implemented in the actual Stream class
         raise NotImplementedError("This method should be implemented in the actual Stream class.")
     
+    def preload_audio(self, audio_bytes: bytes):
+        """
+        Receives the whole audio before streaming starts, when it is known upfront (e.g. when replaying a dataset).
+        Streams may use it to precompute work, the audio is still sent chunk by chunk afterwards.
+        Args:
+            audio_bytes (bytes): The complete audio data of the stream.
+        """
+        pass
+
+    async def drain(self):
+        """
+        Waits until background work of the stream, e.g. running transcriptions, has finished.
+        """
+        pass
+
     def end_stream(self):
         """
         Simulates ending the audio stream.
@@ -33,13 +48,16 @@ class Stream:
     def create(cls,
                type: Literal["melvin", "assemblyai"],
                output_handler: OutputHandler,
-               whisper_transcriber: WhisperTranscriber = None):
+               whisper_transcriber: WhisperTranscriber = None,
+               **stream_options):
         """
         Creates a new instance of the Stream class.
+        Args:
+            stream_options: Additional keyword arguments for the melvin stream, e.g. `feature_cache`.
         """
         if type == "melvin":
             from src.melvin.stream import Stream as MelvinStream
-            return MelvinStream(whisper_transcriber, 0, output_handler)
+            return MelvinStream(whisper_transcriber, 0, output_handler, **stream_options)
         elif type == "assemblyai":
             from src.run.AssemblyAIStream import AssemblyAIStream
             return AssemblyAIStream(output_handler)
@@ -1,7 +1,7 @@
 from src.run.Stream import Stream
+from src.helper import virtual_clock
 from src.helper.byte_iterator import iter_chunks
 from src.run.OutputHandler import OutputHandler
-import time
 import asyncio
 
 import logging
@@ -16,6 +16,8 @@ class TimedStreamingTranscriber:
                  frame_bit_size: int = 16):
         """
         Initializes the StreamingTranscriber with the given transcriber adapter.
+        The chunks are sent in real time. Run it on a `VirtualTimeLoop` (see `src.helper.virtual_clock.run_virtual`)
+        to simulate the real time replay on a virtual clock, which is as fast as the inference allows.
         Args:
             stream (Stream): The melvin stream to use for transcribing audio data.
             sample_rate (int): The sample rate of the audio data. Defaults to 16000.
@@ -26,6 +28,8 @@ class TimedStreamingTranscriber:
         self.output_handler = output_handler
         self.chunk_length_ms = chunk_length_ms
         self.chunk_size = sample_rate * chunk_length_ms // 1000 * frame_bit_size // 8
+        # Longest time a chunk was sent after its due time, e.g. because the CPU was busy with other work
+        self.max_chunk_delay = 0.0
 
     async def transcribe(self, audio_bytes: bytes) -> str:
         """
@@ -39,27 +43,34 @@ class TimedStreamingTranscriber:
         logger.debug(f"Bytes per chunk: {self.chunk_size}")
         
         interval = self.chunk_length_ms / 1000
-        tasks = []
+        # Only the running tasks are kept, so long sessions do not accumulate one task per chunk
+        tasks = set()
 
+        self.stream.preload_audio(audio_bytes)
         self.stream.start_stream()
         self.output_handler.init_timer(offset=-interval)
-        start_time = time.perf_counter()
+        start_time = virtual_clock.now()
 
         # for idx, chunk in enumerate(tqdm(iter_chunks(audio_bytes, self.chunk_size), total=len(audio_bytes) // self.chunk_size, desc="Transcribing", unit="chunk")):
         for idx, chunk in enumerate(iter_chunks(audio_bytes, self.chunk_size)):
             task = asyncio.create_task(self.stream.receive_bytes(chunk))
-            tasks.append(task)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
             
             # Berechne geplante nächste Zeit
             next_time = start_time + (idx + 1) * interval
-            sleep_duration = next_time - time.perf_counter()
+            sleep_duration = next_time - virtual_clock.now()
             if sleep_duration > 0:
                 await asyncio.sleep(sleep_duration)
+            self.max_chunk_delay = max(self.max_chunk_delay, virtual_clock.now() - next_time)
 
         logger.debug(f"Sequence ended. Waiting for {len(tasks)} tasks to complete")
 
         await asyncio.gather(*tasks)
+        await self.stream.drain()
         self.stream.end_stream()
+        # Wait for finals that are still being published
+        await self.stream.drain()
         return ""
         
 
@@ -0,0 +1,60 @@
+import logging
+import threading
+
+import numpy as np
+from faster_whisper.feature_extractor import FeatureExtractor
+
+from src.melvin.StreamTranscriber import StreamTranscriber
+
+
+class EncoderModel:
+    """Stands in for the Whisper model, records the encoder input lengths and rejects the ones above `max_frames`"""
+
+    def __init__(self, max_frames: int = 3000):
+        self.feature_extractor = FeatureExtractor(feature_size=80)
+        self.max_frames = max_frames
+        self.encoded_frames = []
+
+    def encode(self, features: np.ndarray):
+        if self.max_frames < features.shape[-1] < self.feature_extractor.nb_max_frames:
+            raise ValueError(f"Invalid input length {features.shape[-1]}")
+        self.encoded_frames.append(features.shape[-1])
+        return features
+
+
+def transcriber(buckets: list, model: EncoderModel) -> StreamTranscriber:
+    """A transcriber around the encoder of `model`, without loading a real model"""
+    transcriber = StreamTranscriber.__new__(StreamTranscriber)
+    transcriber._log = logging.getLogger(__name__)
+    transcriber._model = model
+    transcriber._stats_lock = threading.Lock()
+    transcriber._encoder_frames = transcriber._supported_encoder_frames(buckets)
+    transcriber.encoder_calls = {frames: 0 for frames in transcriber._encoder_frames}
+    return transcriber
+
+
+def test_buckets_are_rounded_to_whole_seconds_and_end_with_the_full_input():
+    model = EncoderModel()
+    assert transcriber([10, 4.5, 5, 30, 45, 0], model)._encoder_frames == [500, 1000, 3000]
+    # Each bucket was tried once
+    assert model.encoded_frames == [500, 1000]
+
+
+def test_buckets_from_the_first_rejected_length_on_are_dropped():
+    model = EncoderModel(max_frames=700)
+    assert transcriber([5, 10, 15], model)._encoder_frames == [500, 3000]
+
+
+def test_windows_are_padded_to_the_smallest_bucket_they_fit_in():
+    model = EncoderModel()
+    stream_transcriber = transcriber([5, 10], model)
+    assert stream_transcriber._encoder_input_frames(1) == 500
+    assert stream_transcriber._encoder_input_frames(500) == 500
+    assert stream_transcriber._encoder_input_frames(501) == 1000
+    assert stream_transcriber._encoder_input_frames(2500) == 3000
+    assert stream_transcriber._encoder_input_frames(4000) == 3000
+
+    encoded = stream_transcriber._encode(np.ones((80, 620), dtype=np.float32), 1000)
+    assert encoded.shape == (80, 1000)
+    np.testing.assert_array_equal(encoded[:, 620:], 0)
+    assert stream_transcriber.encoder_calls == {500: 0, 1000: 1, 3000: 0}
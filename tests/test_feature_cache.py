@@ -0,0 +1,81 @@
+import numpy as np
+from faster_whisper.feature_extractor import FeatureExtractor
+
+from src.helper.feature_cache import FeatureCache
+
+SAMPLE_RATE = 16000
+
+
+def stream_audio(seconds: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    samples = np.arange(SAMPLE_RATE * seconds)
+    return (rng.normal(0, 0.1, len(samples)) * np.sin(samples / 3000)).astype(np.float32)
+
+
+def sliding_windows(length: int, max_window: int):
+    """Windows of a stream that grow by irregular steps and move their start forward when they get too long"""
+    rng = np.random.default_rng(1)
+    start, end = 0, SAMPLE_RATE // 2
+    while end <= length:
+        yield start, end
+        end += 3200 + 160 * int(rng.integers(0, 5))
+        if end - start > max_window:
+            start = end - max_window + SAMPLE_RATE
+            start -= start % 160
+
+
+def assert_matches_feature_extractor(features: np.ndarray, expected: np.ndarray, start_sample: int) -> None:
+    assert features.shape == expected.shape
+    # After the stream start, the first two frames see the audio before the window instead of reflection padding
+    first = 2 if start_sample > 0 else 0
+    np.testing.assert_allclose(features[:, first:], expected[:, first:], atol=1e-5)
+
+
+def test_window_features_match_feature_extractor_over_sliding_windows():
+    feature_extractor = FeatureExtractor(feature_size=80)
+    audio = stream_audio(12)
+    cache = FeatureCache(feature_extractor, capacity_samples=SAMPLE_RATE * 5)
+    for start, end in sliding_windows(len(audio), SAMPLE_RATE * 5):
+        window = audio[start:end]
+        assert_matches_feature_extractor(cache.window_features(window, start), feature_extractor(window), start)
+    # Each frame is computed about once, not once per window
+    assert cache.computed_frames < 2 * len(audio) // feature_extractor.hop_length
+
+
+def test_window_features_after_dropped_frames_and_restart():
+    feature_extractor = FeatureExtractor(feature_size=80)
+    audio = stream_audio(8)
+    cache = FeatureCache(feature_extractor, capacity_samples=SAMPLE_RATE * 2)
+    cache.window_features(audio[: SAMPLE_RATE * 2], 0)
+    cache.drop_before(SAMPLE_RATE)
+    window = audio[SAMPLE_RATE : SAMPLE_RATE * 3]
+    assert_matches_feature_extractor(cache.window_features(window, SAMPLE_RATE), feature_extractor(window), SAMPLE_RATE)
+    # A window before the cached frames restarts the cache
+    window = audio[: SAMPLE_RATE * 2]
+    assert_matches_feature_extractor(cache.window_features(window, 0), feature_extractor(window), 0)
+    # A gap after the fed audio restarts it as well
+    window = audio[SAMPLE_RATE * 5 : SAMPLE_RATE * 7]
+    assert_matches_feature_extractor(
+        cache.window_features(window, SAMPLE_RATE * 5), feature_extractor(window), SAMPLE_RATE * 5
+    )
+
+
+def test_unaligned_window_falls_back_to_feature_extractor():
+    feature_extractor = FeatureExtractor(feature_size=80)
+    audio = stream_audio(2)
+    cache = FeatureCache(feature_extractor, capacity_samples=SAMPLE_RATE * 2)
+    window = audio[100:]
+    np.testing.assert_array_equal(cache.window_features(window, 100), feature_extractor(window))
+
+
+def test_preloaded_features_match_feature_extractor():
+    feature_extractor = FeatureExtractor(feature_size=80)
+    audio = stream_audio(6)
+    cache = FeatureCache(feature_extractor, capacity_samples=SAMPLE_RATE * 2)
+    cache.preload(audio)
+    computed = cache.computed_frames
+    for start, end in sliding_windows(len(audio), SAMPLE_RATE * 2):
+        window = audio[start:end]
+        assert_matches_feature_extractor(cache.window_features(window, start), feature_extractor(window), start)
+    # Only the frames at the window ends, which see padding, are computed per window
+    assert cache.computed_frames - computed < 10 * len(list(sliding_windows(len(audio), SAMPLE_RATE * 2)))
@@ -0,0 +1,84 @@
+import numpy as np
+from faster_whisper.vad import VadOptions, get_speech_timestamps, get_vad_model
+
+from src.helper.incremental_vad import VAD_CHUNK_SAMPLES, IncrementalVad, segments_from_probs
+
+SAMPLE_RATE = 16000
+VAD_OPTIONS = VadOptions(min_silence_duration_ms=300, speech_pad_ms=100)
+
+
+def tone_bursts(seconds: float, period: float = 2.0, on: float = 0.8) -> np.ndarray:
+    """Harmonic tone bursts separated by silence, which Silero VAD scores as speech and non-speech"""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    tone = np.sin(2 * np.pi * 180 * t) * 0.3 + np.sin(2 * np.pi * 360 * t) * 0.2
+    return (tone * ((t % period) < on)).astype(np.float32)
+
+
+def stream_probabilities(audio: np.ndarray) -> np.ndarray:
+    """Speech probabilities of all complete chunks of a stream, scored at once"""
+    chunks = len(audio) // VAD_CHUNK_SAMPLES
+    return get_vad_model()(audio[: chunks * VAD_CHUNK_SAMPLES].reshape(1, -1))[0].reshape(-1)
+
+
+def expected_segments(probs: np.ndarray, window_start: int, window_length: int) -> list:
+    """Segments of a window from the probabilities of the whole stream"""
+    first_chunk = window_start // VAD_CHUNK_SAMPLES
+    last_chunk = (window_start + window_length) // VAD_CHUNK_SAMPLES
+    positions = np.arange(first_chunk, last_chunk) * VAD_CHUNK_SAMPLES - window_start
+    return segments_from_probs(probs[first_chunk:last_chunk], np.maximum(positions, 0), window_length, VAD_OPTIONS)
+
+
+def test_probabilities_match_scoring_the_whole_stream():
+    audio = tone_bursts(6)
+    vad = IncrementalVad(len(audio))
+    rng = np.random.default_rng(0)
+    end = 0
+    while end < len(audio):
+        end = min(end + int(rng.integers(100, 3000)), len(audio))
+        vad.speech_timestamps(audio[:end], 0, VAD_OPTIONS)
+    expected = stream_probabilities(audio)
+    np.testing.assert_allclose(vad.probabilities_since(0), expected, atol=1e-5)
+    assert vad.scored_chunks == len(expected)
+
+
+def test_segments_match_get_speech_timestamps():
+    audio = tone_bursts(6)
+    # Whole chunks, faster-whisper scores a partial chunk at the end as well
+    audio = audio[: len(audio) // VAD_CHUNK_SAMPLES * VAD_CHUNK_SAMPLES]
+    segments = IncrementalVad(len(audio)).speech_timestamps(audio, 0, VAD_OPTIONS)
+    assert len(segments) == 3
+    assert segments == get_speech_timestamps(audio, VAD_OPTIONS)
+
+
+def test_sliding_windows_after_drops_and_compaction():
+    audio = np.concatenate([tone_bursts(3, period=1.0, on=0.5), np.zeros(SAMPLE_RATE * 2, dtype=np.float32)])
+    window_samples = 21 * VAD_CHUNK_SAMPLES
+    # The probabilities of 20 chunks are kept, so the storage is compacted while the window moves on
+    vad = IncrementalVad(20 * VAD_CHUNK_SAMPLES)
+    probs = stream_probabilities(audio)
+    for end in range(VAD_CHUNK_SAMPLES, len(audio) + 1, VAD_CHUNK_SAMPLES):
+        start = max(0, end - window_samples)
+        vad.drop_before(start)
+        window = audio[start:end]
+        assert vad.speech_timestamps(window, start, VAD_OPTIONS) == expected_segments(probs, start, len(window))
+    # The silence at the end has no speech, no probabilities of the earlier speech are read
+    assert vad.speech_timestamps(audio[-window_samples:], len(audio) - window_samples, VAD_OPTIONS) == []
+
+
+def test_window_before_the_timeline_restarts_it():
+    audio = tone_bursts(4)
+    vad = IncrementalVad(SAMPLE_RATE * 2)
+    vad.speech_timestamps(audio[SAMPLE_RATE : SAMPLE_RATE * 3], SAMPLE_RATE, VAD_OPTIONS)
+    window = audio[: SAMPLE_RATE * 2]
+    assert vad.speech_timestamps(window, 0, VAD_OPTIONS) == expected_segments(stream_probabilities(window), 0, len(window))
+
+
+def test_score_batch_matches_scoring_each_stream():
+    audios = [tone_bursts(3), tone_bursts(2, period=1.0, on=0.3), np.zeros(SAMPLE_RATE, dtype=np.float32)]
+    vads = [IncrementalVad(SAMPLE_RATE * 3) for _ in audios]
+    # The streams have a different number of new chunks per batch
+    for step in range(1, 4):
+        ends = [min(len(audio), step * SAMPLE_RATE) for audio in audios]
+        IncrementalVad.score_batch(vads, [audio[:end] for audio, end in zip(audios, ends)], [0] * len(audios))
+    for vad, audio in zip(vads, audios):
+        np.testing.assert_allclose(vad.probabilities_since(0), stream_probabilities(audio), atol=1e-5)
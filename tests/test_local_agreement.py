@@ -0,0 +1,115 @@
+from faster_whisper.transcribe import Word
+
+from src.helper.local_agreement import LocalAgreement, known_prefix_length
+
+WORD_SECONDS = 0.5
+
+
+def words(text: str, first: int = 0, probability: float = 0.9) -> list:
+    """Words of a hypothesis, word i of the stream spans [i * WORD_SECONDS, (i + 1) * WORD_SECONDS)"""
+    return [
+        Word((first + i) * WORD_SECONDS, (first + i + 1) * WORD_SECONDS, " " + word, probability)
+        for i, word in enumerate(text.split())
+    ]
+
+
+def texts(sequence) -> str:
+    return " ".join(word.word.strip() for word in sequence)
+
+
+def test_two_hypotheses_confirm_their_common_prefix():
+    agreement = LocalAgreement()
+    agreement.merge(words("the quick brown"))
+    assert texts(agreement.confirmed) == ""
+    agreement.merge(words("The quick, frown fox"))
+    # The words of the newest hypothesis are kept
+    assert texts(agreement.confirmed) == "The quick,"
+    assert texts(agreement.unconfirmed) == "frown fox"
+    # The confirmed words are dropped from the start of the next hypothesis by their timestamps
+    agreement.merge(words("the quick frown fox jumps"))
+    assert texts(agreement.confirmed) == "The quick, frown fox"
+
+
+def test_la3_needs_three_agreeing_hypotheses():
+    agreement = LocalAgreement(n=3)
+    agreement.merge(words("a b c"))
+    agreement.merge(words("a b d"))
+    assert len(agreement.confirmed) == 0
+    agreement.merge(words("a x d"))
+    assert texts(agreement.confirmed) == "a"
+    agreement.merge(words("a x d e", 0))
+    assert texts(agreement.confirmed) == "a"
+    agreement.merge(words("a x d e", 0))
+    assert texts(agreement.confirmed) == "a x d"
+
+
+def test_flush_at_sentence_end_keeps_the_words_after_it():
+    agreement = LocalAgreement()
+    for _ in range(2):
+        agreement.merge(words("one two. three four. five"))
+    assert agreement.confirmed_contains_sentence_end
+    assert texts(agreement.flush_at_sentence_end()) == "one two. three four."
+    assert not agreement.confirmed_contains_sentence_end
+    assert texts(agreement.confirmed) == "five"
+    # Sentence ends confirmed after a flush are found at their new positions
+    for _ in range(2):
+        agreement.merge(words("five six. seven", 4))
+    assert texts(agreement.flush_at_sentence_end()) == "five six."
+    assert texts(agreement.flush_all()) == "seven"
+    assert len(agreement.confirmed) == 0 and len(agreement.unconfirmed) == 0
+
+
+def test_early_commit_of_confident_words_before_the_margin():
+    agreement = LocalAgreement(early_commit_probability=0.8, early_commit_margin=1.0)
+    hypothesis = words("a b c d") + words("e", 4, probability=0.5) + words("f g", 5)
+    agreement.merge(hypothesis, window_end=4.0)
+    # Words ending before 3.0 s are committed, up to the first uncertain word
+    assert texts(agreement.confirmed) == "a b c d"
+    assert agreement.early_commit_count == 4
+    # The next hypothesis transcribed one of them differently
+    agreement.merge(words("a x c d e f g"), window_end=4.0)
+    assert agreement.early_commit_corrections == 1
+    flushed = agreement.flush_confirmed(2)
+    assert texts(flushed) == "a b"
+    assert agreement.flushed_early_commits == 2
+
+
+def test_early_commits_are_disabled_by_default():
+    agreement = LocalAgreement()
+    agreement.merge(words("a b c d e f g h"), window_end=10.0)
+    assert len(agreement.confirmed) == 0
+
+
+def test_known_prefix_length():
+    assert known_prefix_length(["a", "b", "c"], []) == 0
+    assert known_prefix_length(["a", "b", "c", "d"], ["a", "b"]) == 2
+    # The hypothesis split a known word in two or merged two of them
+    assert known_prefix_length(["a", "bb", "b", "c", "d"], ["a", "b", "c"]) == 4
+    assert known_prefix_length(["ab", "c", "d"], ["a", "b", "c"]) == 2
+    assert known_prefix_length(["x", "y", "z"], ["a", "b"]) is None
+
+
+def test_confirmed_words_matched_by_text_despite_shifted_timestamps():
+    agreement = LocalAgreement(match_confirmed_by_text=True)
+    agreement.merge(words("the quick brown"))
+    agreement.merge(words("the quick brown fox"))
+    assert texts(agreement.confirmed) == "the quick brown"
+    # Approximate timestamps of the next hypothesis are shifted by more than a word
+    shifted = [Word(word.start + 0.7, word.end + 0.7, word.word, word.probability) for word in words("the quick brown fox jumps")]
+    agreement.merge(shifted)
+    assert texts(agreement.confirmed) == "the quick brown fox"
+    assert texts(agreement.unconfirmed) == "jumps"
+
+
+def test_forgotten_hypotheses_do_not_confirm_words():
+    agreement = LocalAgreement()
+    agreement.merge(words("a b"))
+    agreement.merge(words("a b c"))
+    assert texts(agreement.confirmed) == "a b"
+    agreement.forget_hypotheses()
+    agreement.merge(words("a b c d"))
+    # The confirmed words are kept, the new hypothesis has nothing to agree with
+    assert texts(agreement.confirmed) == "a b"
+    assert texts(agreement.unconfirmed) == "c d"
+    agreement.merge(words("a b c d e"))
+    assert texts(agreement.confirmed) == "a b c d"
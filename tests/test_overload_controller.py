@@ -0,0 +1,103 @@
+import asyncio
+
+from src.helper.virtual_clock import run_virtual
+from src.melvin.OverloadController import (
+    CHEAP_DECODING,
+    NORMAL,
+    REJECT_SESSIONS,
+    SKIP_PARTIALS,
+    OverloadController,
+)
+
+
+class DegradedStub:
+    def __init__(self):
+        self.levels = []
+
+    def set_degradation_level(self, level: int, reason: str) -> None:
+        self.levels.append(level)
+
+
+async def report_for(controller: OverloadController, stream, lag_seconds: float, seconds: float) -> None:
+    for _ in range(int(seconds / 0.5)):
+        controller.report(stream, lag_seconds)
+        await asyncio.sleep(0.5)
+
+
+def test_level_steps_up_under_pressure_and_back_down():
+    controller = OverloadController(max_lag_ms=1000, min_level_seconds=2, max_level=CHEAP_DECODING)
+    stream = DegradedStub()
+
+    async def main():
+        controller.register(stream)
+        await report_for(controller, stream, lag_seconds=2.0, seconds=10)
+        assert controller.level == CHEAP_DECODING
+        await report_for(controller, stream, lag_seconds=0.1, seconds=10)
+
+    run_virtual(main())
+    assert controller.level == NORMAL
+    # One level at a time, each held for at least min_level_seconds
+    assert stream.levels == [1, 2, 3, 2, 1, 0]
+    assert controller.level_changes == 6
+
+
+def test_queue_depth_counts_as_pressure():
+    depth = [0]
+    controller = OverloadController(max_queue_depth=4, queue_depth=lambda: depth[0], min_level_seconds=0)
+    stream = DegradedStub()
+
+    async def main():
+        controller.register(stream)
+        depth[0] = 8
+        await report_for(controller, stream, lag_seconds=0.0, seconds=1)
+
+    run_virtual(main())
+    assert controller.level == SKIP_PARTIALS + 1
+
+
+def test_sessions_are_accepted_again_after_the_last_stream_ended():
+    controller = OverloadController(max_lag_ms=1000, min_level_seconds=1)
+    stream = DegradedStub()
+
+    async def main():
+        controller.register(stream)
+        await report_for(controller, stream, lag_seconds=5.0, seconds=6)
+        assert not controller.accepting_sessions()
+        controller.unregister(stream)
+        # Nothing reports anymore, the level recovers while sessions ask to start
+        accepted = []
+        for _ in range(5):
+            await asyncio.sleep(1.5)
+            accepted.append(controller.accepting_sessions())
+        return accepted
+
+    assert run_virtual(main()) == [True] * 5
+    assert controller.level == NORMAL
+    assert controller.rejected_sessions == 1
+
+
+def test_streams_registered_while_degraded_get_the_level():
+    controller = OverloadController(max_lag_ms=1000, min_level_seconds=0, max_level=REJECT_SESSIONS)
+    first, second = DegradedStub(), DegradedStub()
+
+    async def main():
+        controller.register(first)
+        await report_for(controller, first, lag_seconds=2.0, seconds=1)
+        controller.register(second)
+
+    run_virtual(main())
+    assert second.levels == [controller.level]
+
+
+def test_controller_created_before_the_event_loop_follows_its_clock():
+    controller = OverloadController(max_lag_ms=1000, min_level_seconds=2)
+    stream = DegradedStub()
+
+    async def main():
+        controller.register(stream)
+        await report_for(controller, stream, lag_seconds=2.0, seconds=5)
+        return controller.stats()
+
+    stats = run_virtual(main())
+    assert stats["level_changes"] == 2
+    assert sum(stats["seconds_per_level"].values()) < 10
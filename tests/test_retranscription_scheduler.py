@@ -0,0 +1,101 @@
+import asyncio
+
+from src.helper.virtual_clock import run_virtual
+from src.melvin.RetranscriptionScheduler import OnlineCostModel, RetranscriptionScheduler
+
+BYTES_PER_SECOND = 32000
+
+
+class ScheduledStub:
+    """Stream whose retranscriptions take `seconds`, or that cannot start one"""
+
+    def __init__(self, id: int, seconds: float = 0.5, can_start: bool = True):
+        self.id = id
+        self.seconds = seconds
+        self.can_start = can_start
+        self.sliding_window = b""
+        self.transcriptions = 0
+
+    def start_transcription(self):
+        if not self.can_start:
+            return None
+        self.transcriptions += 1
+        return asyncio.ensure_future(asyncio.sleep(self.seconds))
+
+
+async def receive(scheduler: RetranscriptionScheduler, streams: list, seconds: float, chunk_seconds: float = 0.1):
+    for _ in range(round(seconds / chunk_seconds)):
+        for stream in streams:
+            stream.sliding_window += b"\0" * int(chunk_seconds * BYTES_PER_SECOND)
+            scheduler.notify_audio(stream, int(chunk_seconds * BYTES_PER_SECOND))
+        await asyncio.sleep(chunk_seconds)
+    await asyncio.sleep(1.0)
+
+
+def test_cost_model_fits_inference_time_over_window_length():
+    model = OnlineCostModel()
+    for window_seconds in [1, 2, 3, 4, 5] * 4:
+        model.update(window_seconds, 0.1 + 0.05 * window_seconds)
+    intercept, slope = model.coefficients
+    assert abs(intercept - 0.1) < 1e-6 and abs(slope - 0.05) < 1e-6
+    assert abs(model.predict(10) - 0.6) < 1e-6
+
+
+def test_streams_share_the_model_within_max_concurrent():
+    scheduler = RetranscriptionScheduler(max_concurrent=1, min_new_audio_ms=200)
+    streams = [ScheduledStub(i, seconds=0.3) for i in range(3)]
+
+    async def main():
+        for stream in streams:
+            scheduler.register(stream)
+        await receive(scheduler, streams, seconds=5)
+        return scheduler.stats()
+
+    stats = run_virtual(main())
+    assert stats["running"] == 0
+    assert all(stream.transcriptions >= 4 for stream in streams)
+    # One model, busy most of the time
+    assert 0.5 < stats["utilization"] <= 1.0
+
+
+def test_stream_that_cannot_start_does_not_block_the_others():
+    scheduler = RetranscriptionScheduler(max_concurrent=1, min_new_audio_ms=200)
+    blocked, stream = ScheduledStub(0, can_start=False), ScheduledStub(1, seconds=0.2)
+
+    async def main():
+        scheduler.register(blocked, priority=10.0)
+        scheduler.register(stream)
+        await receive(scheduler, [blocked, stream], seconds=3)
+
+    run_virtual(main())
+    assert stream.transcriptions >= 5
+
+
+def test_stats_of_finished_streams_are_kept():
+    scheduler = RetranscriptionScheduler(max_concurrent=1, min_new_audio_ms=200)
+    streams = [ScheduledStub(0, seconds=0.2), ScheduledStub(0, seconds=0.2)]
+
+    async def main():
+        for stream in streams:
+            scheduler.register(stream)
+        await receive(scheduler, streams, seconds=2)
+        scheduler.unregister(streams[0])
+        return scheduler.stats()
+
+    stats = run_virtual(main())
+    assert stats["streams"] == 1 and stats["finished_streams"] == 1
+    # Streams with the same id are told apart by their registration
+    assert sorted(stats["per_stream"]) == ["0:0", "1:0"]
+    assert stats["per_stream"]["0:0"]["partials"] == streams[0].transcriptions
+
+
+def test_scheduler_created_before_the_event_loop_measures_on_its_clock():
+    scheduler = RetranscriptionScheduler(max_concurrent=1, min_new_audio_ms=200)
+    stream = ScheduledStub(0, seconds=0.3)
+
+    async def main():
+        scheduler.register(stream)
+        await receive(scheduler, [stream], seconds=3)
+        return scheduler.stats()
+
+    assert 0.1 < run_virtual(main())["utilization"] <= 1.0
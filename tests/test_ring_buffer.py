@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.helper.pcm import INT16_SCALE
+from src.helper.ring_buffer import AudioRingBuffer
+
+
+def pcm(samples: np.ndarray) -> bytes:
+    return samples.astype(np.int16).tobytes()
+
+
+def test_window_matches_appended_audio_across_wraparound():
+    rng = np.random.default_rng(0)
+    buffer = AudioRingBuffer(capacity_bytes=2000)
+    expected = np.zeros(0, dtype=np.int16)
+    discarded = 0
+    for step in range(300):
+        chunk = rng.integers(-30000, 30000, rng.integers(0, 700)).astype(np.int16)
+        buffer.append(pcm(chunk))
+        expected = np.concatenate([expected, chunk])
+        # The oldest audio beyond the capacity is discarded
+        overflow = max(len(expected) - buffer.capacity, 0)
+        expected, discarded = expected[overflow:], discarded + overflow
+        if step % 7 == 0:
+            cut = int(rng.integers(0, 400))
+            buffer.cut_off(2 * cut)
+            cut = min(cut, len(expected))
+            expected, discarded = expected[cut:], discarded + cut
+
+        assert len(buffer) == 2 * len(expected)
+        assert buffer.discarded_bytes == 2 * discarded
+        np.testing.assert_array_equal(buffer.int16(), expected)
+        np.testing.assert_array_equal(buffer.float32(), expected.astype(np.float32) / INT16_SCALE)
+
+
+def test_chunk_longer_than_capacity_keeps_its_end():
+    buffer = AudioRingBuffer(capacity_bytes=200)
+    buffer.append(pcm(np.arange(10)))
+    buffer.append(pcm(np.arange(1000)))
+    np.testing.assert_array_equal(buffer.int16(), np.arange(900, 1000))
+    assert buffer.discarded_bytes == 2 * 910
+
+
+def test_views_stay_valid_until_capacity_is_appended():
+    buffer = AudioRingBuffer(capacity_bytes=2000)
+    buffer.append(pcm(np.arange(800)))
+    view = buffer.int16()
+    # Less than the capacity is appended after the view was taken, with a compaction in between
+    for start in range(800, 1700, 300):
+        buffer.append(pcm(np.arange(start, start + 300)))
+    np.testing.assert_array_equal(view, np.arange(800))
+    assert not view.flags.writeable
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+
+from faster_whisper.transcribe import Segment, Word
+import numpy as np
+
+from src.helper.incremental_vad import IncrementalVad
+from src.helper.virtual_clock import run_virtual
+from src.melvin.OverloadController import CHEAP_DECODING, NORMAL, SKIP_PARTIALS, OverloadController
+from src.melvin.stream import BYTES_PER_SECOND, PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD, Stream
+from src.run.OutputHandler import OutputHandler
+
+CHUNK_BYTES = BYTES_PER_SECOND // 20
+
+
+class ScriptedTranscriber:
+    """Returns the given words (relative to the window start) for every window and records the calls"""
+
+    def __init__(self, words: list = None):
+        self.words = words or []
+        self.calls = 0
+
+    async def transcribe_async(self, audio, prompt="", **kwargs):
+        self.calls += 1
+        words = [Word(word.start, word.end, word.word, word.probability) for word in self.words]
+        text = "".join(word.word for word in words)
+        end = len(audio) / (BYTES_PER_SECOND / 2)
+        return [Segment(0, 0, 0.0, end, text, [], 0.0, 1.0, 0.0, words, 0.0)]
+
+
+def create_stream(transcriber=None, **options) -> Stream:
+    output_handler = OutputHandler()
+    output_handler.init_timer()
+    return Stream(transcriber or ScriptedTranscriber(), 0, output_handler, language="en", **options)
+
+
+def silence(num_bytes: int) -> bytes:
+    return b"\0" * num_bytes
+
+
+def words(text: str, start: float, seconds: float = 0.4) -> list:
+    return [Word(start + i * seconds, start + (i + 1) * seconds, " " + word, 0.9) for i, word in enumerate(text.split())]
+
+
+def test_triggers_during_a_decode_are_coalesced_into_one():
+    async def main():
+        stream = create_stream()
+        stream.state = "decoding"
+        # Four trigger intervals of audio arrive while a decode is running
+        for _ in range(4 * PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD // CHUNK_BYTES):
+            await stream.receive_bytes(silence(CHUNK_BYTES))
+        return stream
+
+    stream = run_virtual(main())
+    assert stream.state == "pending"
+    assert stream.coalesced_triggers == 4
+    assert stream.bytes_received_since_last_transcription == 0
+
+
+def test_pending_decode_starts_when_the_running_one_is_done():
+    transcriber = ScriptedTranscriber()
+
+    async def main():
+        stream = create_stream(transcriber)
+        stream.state = "decoding"
+        await stream.receive_bytes(silence(PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD))
+        stream.transcription_done()
+        assert stream.state == "decoding"
+        await asyncio.gather(*stream.transcription_tasks)
+        return stream
+
+    stream = run_virtual(main())
+    assert transcriber.calls == 1
+    assert stream.state == "idle"
+
+
+def test_pending_decode_is_skipped_like_triggered_ones_when_degraded():
+    transcriber = ScriptedTranscriber()
+
+    async def main():
+        stream = create_stream(transcriber, overload_controller=OverloadController(partial_skip_factor=2))
+        stream.set_degradation_level(SKIP_PARTIALS, "test")
+        stream.state = "decoding"
+        await stream.receive_bytes(silence(PARTIAL_TRANSCRIPTION_BYTE_THRESHOLD))
+        stream.transcription_done()
+        return stream
+
+    stream = run_virtual(main())
+    assert stream.state == "idle"
+    assert stream.skipped_partials == 1
+    assert transcriber.calls == 0
+
+
+def publish_final(stream: Stream, word: Word) -> None:
+    stream.final_transcriptions.append({"result": [{"word": word.word, "start": word.start, "end": word.end}]})
+    stream.last_final_word = word
+
+
+def last_partial_text(stream: Stream) -> str:
+    return stream.output_handler.partial_predictions[-1]["result"]["text"]
+
+
+def test_last_final_word_decoded_again_is_dropped_from_the_partial():
+    # The final " very" ends at 1.0 s and is decoded again just after it
+    transcriber = ScriptedTranscriber(words("very", 1.03) + words("so", 1.5))
+
+    async def main():
+        stream = create_stream(transcriber)
+        publish_final(stream, words("very", 0.6)[0])
+        await stream.transcribe_sliding_window(np.zeros(BYTES_PER_SECOND, dtype=np.float32))
+        return stream
+
+    stream = run_virtual(main())
+    assert last_partial_text(stream) == "so"
+
+
+def test_word_repeated_after_the_last_final_is_kept():
+    # The speaker says "very" again a moment after the final
+    transcriber = ScriptedTranscriber(words("very", 0.6) + words("very", 1.2) + words("good", 1.6))
+
+    async def main():
+        stream = create_stream(transcriber)
+        publish_final(stream, words("very", 0.6)[0])
+        await stream.transcribe_sliding_window(np.zeros(BYTES_PER_SECOND, dtype=np.float32))
+        return stream
+
+    stream = run_virtual(main())
+    assert last_partial_text(stream) == "very good"
+
+
+def test_hypotheses_of_different_transcribers_do_not_confirm_words():
+    main_transcriber = ScriptedTranscriber(words("a b c", 0.0))
+    degraded_transcriber = ScriptedTranscriber(words("a b c", 0.0))
+
+    async def main():
+        controller = OverloadController(degraded_transcriber=degraded_transcriber)
+        stream = create_stream(main_transcriber, overload_controller=controller)
+        window = np.zeros(2 * BYTES_PER_SECOND, dtype=np.float32)
+        stream.set_degradation_level(CHEAP_DECODING, "test")
+        await stream.transcribe_sliding_window(window)
+        stream.set_degradation_level(NORMAL, "test")
+        await stream.transcribe_sliding_window(window)
+        assert len(stream.agreement.confirmed) == 0
+        await stream.transcribe_sliding_window(window)
+        return stream
+
+    stream = run_virtual(main())
+    assert (degraded_transcriber.calls, main_transcriber.calls) == (1, 2)
+    assert [word.word for word in stream.agreement.confirmed] == [" a", " b", " c"]
+
+
+def test_vad_trigger_scores_off_the_event_loop(monkeypatch):
+    threads = []
+    score_batch = IncrementalVad.score_batch
+
+    def record_thread(*args):
+        threads.append(threading.get_ident())
+        score_batch(*args)
+
+    monkeypatch.setattr(IncrementalVad, "score_batch", staticmethod(record_thread))
+
+    async def main():
+        stream = create_stream(incremental_vad=True, trigger={"type": "vad"})
+        for _ in range(10):
+            await stream.receive_bytes(silence(CHUNK_BYTES))
+        return stream
+
+    # The virtual time loop runs executor work inline, the real loop hands it to a worker thread
+    stream = asyncio.run(main())
+    assert len(threads) > 0 and threading.get_ident() not in threads
+    assert stream.vad.scored_until >= 9 * CHUNK_BYTES // 2
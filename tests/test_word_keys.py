@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+from faster_whisper.transcribe import Word
+
+from src.helper.local_agreement import LocalAgreement
+from src.helper.word_keys import WordKeys
+
+# Punctuation of faster-whisper's default transcription options
+PREPEND_PUNCTUATIONS = "\"'“¿([{-"
+APPEND_PUNCTUATIONS = "\"'.。,，!！?？:：”)]}、"
+
+
+class VocabularyTokenizer:
+    """Tokenizer with a fixed vocabulary and greedy longest match, like the `tokenizers.Tokenizer` of a model"""
+
+    def __init__(self, vocabulary: list):
+        self.vocabulary = vocabulary
+
+    def decode(self, ids: list) -> str:
+        return "".join(self.vocabulary[token] for token in ids)
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> SimpleNamespace:
+        ids, position = [], 0
+        while position < len(text):
+            token = max(
+                (token for token, piece in enumerate(self.vocabulary) if text.startswith(piece, position)),
+                key=lambda token: len(self.vocabulary[token]),
+            )
+            ids.append(token)
+            position += len(self.vocabulary[token])
+        return SimpleNamespace(ids=ids)
+
+
+def word_keys(vocabulary: list) -> WordKeys:
+    # The id after the vocabulary is the end of text token
+    return WordKeys(VocabularyTokenizer(vocabulary), len(vocabulary), PREPEND_PUNCTUATIONS, APPEND_PUNCTUATIONS)
+
+
+VOCABULARY = [" the", " Dog", " dog", ",", ".", " qu", "ick", " very", " \"", "!", "?"]
+EOT = len(VOCABULARY)
+
+
+def tokens(keys: WordKeys, text: str) -> list:
+    return keys._hf_tokenizer.encode(text).ids
+
+
+def test_case_and_punctuation_do_not_change_the_key():
+    keys = word_keys(VOCABULARY)
+    assert keys.keys_for_tokens(tokens(keys, " Dog,")) == keys.keys_for_tokens(tokens(keys, " dog."))
+    assert keys.keys_for_tokens(tokens(keys, " the")) != keys.keys_for_tokens(tokens(keys, " dog"))
+
+
+def test_words_are_split_like_faster_whisper_splits_them():
+    keys = word_keys(VOCABULARY)
+    # Appended and prepended punctuation belongs to the neighbouring word, special tokens are skipped
+    sequence = tokens(keys, " the qu") + [EOT] + tokens(keys, "ick, \" dog! very?") + [EOT + 1]
+    assert keys.keys_for_tokens(sequence) == [
+        keys.key_for_text("the"),
+        keys.key_for_text("quick"),
+        keys.key_for_text("dog"),
+        keys.key_for_text("very"),
+    ]
+
+
+def test_keyed_words_fall_back_to_the_text_when_the_split_differs():
+    keys = word_keys(VOCABULARY)
+    words = [Word(0.0, 0.5, " the", 0.9), Word(0.5, 1.0, " dog", 0.9)]
+    keyed = keys.keyed_words(words, tokens(keys, " the dog"))
+    assert [word.key for word in keyed] == [keys.key_for_text("the"), keys.key_for_text("dog")]
+    # The decoder produced the words from other tokens than the ones passed
+    keyed = keys.keyed_words(words, tokens(keys, " the dog very"))
+    assert [word.key for word in keyed] == [keys.key_for_text("the"), keys.key_for_text("dog")]
+    assert (keyed[0].start, keyed[0].end, keyed[0].word) == (0.0, 0.5, " the")
+
+
+def test_keys_are_shared_between_vocabularies():
+    keys = word_keys(VOCABULARY)
+    # Another model splits the words into other tokens
+    other = word_keys([".", " dog", " the", " ver", "y", " quick", ","])
+    other_keys = other.keys_for_tokens(tokens(other, " dog. very, quick the"))
+    assert other_keys[::-1] == keys.keys_for_tokens(tokens(keys, " the quick very Dog"))
+
+
+def test_agreement_compares_keyed_words_by_key():
+    keys = word_keys(VOCABULARY)
+    agreement = LocalAgreement()
+
+    def hypothesis(text: str, words: list) -> list:
+        return keys.keyed_words(
+            [Word(i * 0.5, (i + 1) * 0.5, word, 0.9) for i, word in enumerate(words)], tokens(keys, text)
+        )
+
+    agreement.merge(hypothesis(" the Dog, very", [" the", " Dog,", " very"]))
+    agreement.merge(hypothesis(" the dog. the", [" the", " dog.", " the"]))
+    assert [word.word for word in agreement.confirmed] == [" the", " dog."]
@@ -0,0 +1,39 @@
+import math
+
+from faster_whisper.transcribe import Segment
+
+from src.helper.word_sequence import approximate_words
+
+
+def segment(text: str, start: float, end: float) -> Segment:
+    return Segment(
+        id=0,
+        seek=0,
+        start=start,
+        end=end,
+        text=text,
+        tokens=[],
+        avg_logprob=math.log(0.8),
+        compression_ratio=1.0,
+        no_speech_prob=0.0,
+        words=None,
+        temperature=0.0,
+    )
+
+
+def test_segment_time_is_spread_over_the_words_by_characters():
+    words = approximate_words(segment(" ab abcd.", 1.0, 2.0))
+    assert [word.word for word in words] == [" ab", " abcd."]
+    assert [(word.start, word.end) for word in words] == [(1.0, 1.33), (1.33, 2.0)]
+    assert all(math.isclose(word.probability, 0.8) for word in words)
+
+
+def test_words_start_after_the_prefix():
+    words = approximate_words(segment(" one two", 0.0, 2.0), start=1.0)
+    assert words[0].start == 1.0 and words[-1].end == 2.0
+    # A start outside of the segment is clamped to it
+    assert approximate_words(segment(" one", 0.0, 2.0), start=5.0)[0].start == 2.0
+
+
+def test_empty_segment_has_no_words():
+    assert approximate_words(segment(" ", 0.0, 1.0)) == []
@@ -0,0 +1,70 @@
+"""
+Benchmark of reduced encoder input lengths on CPU: decodes windows of several lengths cut from dataset recordings with
+the full 30 s encoder input and with `encoder_buckets`, and reports the time per window and the word error rate of the
+reduced input against the 30 s decode.
+
+Run from the repository root: python -m tools.benchmark_encoder_length --models tiny small
+"""
+
+import argparse
+import time
+
+from jiwer import wer
+
+from src.helper.pcm import pcm_to_float32
+from src.helper.transcription_settings import TranscriptionSettings
+from src.melvin.StreamTranscriber import StreamTranscriber
+from src.run.Dataset import Dataset
+
+BYTES_PER_SECOND = 32000
+
+
+def transcribe(transcriber, windows):
+    """Decodes every window as a single window, so the runs only differ in the encoder input length"""
+    settings = TranscriptionSettings().get_and_update_settings({"initial_prompt": None})
+    texts = []
+    start = time.perf_counter()
+    for window in windows:
+        audio = pcm_to_float32(window)
+        features = transcriber.feature_extractor(audio)
+        segments = transcriber._transcribe_single_window(audio, features, settings)
+        texts.append(" ".join(segment.text.strip() for segment in segments))
+    return texts, (time.perf_counter() - start) / len(windows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["tiny", "small"])
+    parser.add_argument("--buckets", type=float, nargs="+", default=[5, 10, 15])
+    parser.add_argument("--window-seconds", type=float, nargs="+", default=[2, 4, 8, 15])
+    parser.add_argument("--recordings", type=int, default=10)
+    parser.add_argument("--dataset", default="librispeech-pc-test-clean")
+    parser.add_argument("--cpu-threads", type=int, default=4)
+    args = parser.parse_args()
+
+    dataset = Dataset(args.dataset)
+    recordings = [audio_bytes for _, (_, audio_bytes, _) in zip(range(args.recordings), dataset)]
+
+    print(f"{'model':>8} {'window s':>9} {'30 s ms':>8} {'bucket ms':>10} {'speedup':>8} {'WER vs 30 s':>12}")
+    for model in args.models:
+        full = StreamTranscriber.for_cpu(model, args.cpu_threads, 1)
+        reduced = StreamTranscriber.for_cpu(model, args.cpu_threads, 1, encoder_buckets=args.buckets)
+        if reduced.encoder_stats().keys() == full.encoder_stats().keys():
+            print(f"{model:>8}: the model only accepts 30 s encoder input")
+            continue
+        for window_seconds in args.window_seconds:
+            window_bytes = int(window_seconds * BYTES_PER_SECOND)
+            windows = [audio[:window_bytes] for audio in recordings if len(audio) >= window_bytes]
+            if len(windows) == 0:
+                continue
+            full_texts, full_seconds = transcribe(full, windows)
+            reduced_texts, reduced_seconds = transcribe(reduced, windows)
+            error_rate = wer(" ".join(full_texts) or "-", " ".join(reduced_texts) or "-")
+            print(
+                f"{model:>8} {window_seconds:>9.1f} {full_seconds * 1000:>8.0f} {reduced_seconds * 1000:>10.0f} "
+                f"{full_seconds / reduced_seconds:>8.2f} {error_rate:>12.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Microbenchmark of LocalAgreement: measures the cost of a merge (and the following final check) after streams of
+increasing length, without flushing, so all words stay confirmed. The time per merge should stay flat.
+Words are compared by token keys like the words of `StreamTranscriber`, or by their normalized text with --text.
+
+Run from the repository root: python -m tools.benchmark_local_agreement
+"""
+
+import argparse
+import random
+import time
+
+from faster_whisper.transcribe import Word
+
+from src.helper.local_agreement import LocalAgreement
+from src.helper.word_keys import TokenWord
+
+VOCABULARY = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog.", "Hello,", "world!", "what?", "it's"]
+WORD_SECONDS = 0.3
+WORDS_PER_STEP = 3
+# Confirmed words at the start of the window, they are dropped by the agreement
+OVERLAP_WORDS = 2
+
+
+def hypothesis(transcript, start, end, noise, rng, text_only=False):
+    """Words of a window over the transcript from word `start` to `end`, the last words are changed randomly"""
+    words = []
+    for i in range(max(0, start - OVERLAP_WORDS), end):
+        text = transcript[i]
+        if i >= end - 5 and rng.random() < noise:
+            text = rng.choice(VOCABULARY)
+        start_time, end_time = i * WORD_SECONDS, i * WORD_SECONDS + WORD_SECONDS * 0.8
+        if text_only:
+            words.append(Word(start_time, end_time, text, 0.9))
+        else:
+            words.append(TokenWord(start_time, end_time, text, 0.9, VOCABULARY.index(text)))
+    return words
+
+
+def run(stream_words, measured_merges, n, noise, text_only=False, seed=0):
+    rng = random.Random(seed)
+    transcript = [rng.choice(VOCABULARY) for _ in range(stream_words + measured_merges * WORDS_PER_STEP + 1)]
+    agreement = LocalAgreement(n)
+
+    # The window starts at the first unconfirmed word, nothing is flushed
+    end = WORDS_PER_STEP
+    while end < stream_words:
+        agreement.merge(hypothesis(transcript, agreement.get_confirmed_length(), end, noise, rng, text_only))
+        end += WORDS_PER_STEP
+
+    elapsed = 0.0
+    for _ in range(measured_merges):
+        words = hypothesis(transcript, agreement.get_confirmed_length(), end, noise, rng, text_only)
+        end += WORDS_PER_STEP
+        start = time.perf_counter()
+        agreement.merge(words)
+        agreement.contains_has_sentence_end()
+        elapsed += time.perf_counter() - start
+    return elapsed / measured_merges, agreement.get_confirmed_length()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--merges", type=int, default=2_000)
+    parser.add_argument("--n", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--noise", type=float, default=0.2)
+    parser.add_argument("--text", action="store_true", help="Compare words by their normalized text")
+    args = parser.parse_args()
+
+    print(f"{'n':>3} {'stream words':>13} {'confirmed':>10} {'us / merge':>11}")
+    for n in args.n:
+        for length in args.lengths:
+            seconds, confirmed = run(length, args.merges, n, args.noise, args.text)
+            print(f"{n:>3} {length:>13} {confirmed:>10} {seconds * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Throughput benchmark of the pipelined transcriber mode on CPU: concurrent streams retranscribe their sliding windows
+as fast as they can, once with the default mode and once with preprocessing (PCM conversion, VAD, log-Mel features)
+pipelined in front of the model. Each stream has one window in flight at a time, like a melvin `Stream`. Reports the
+windows per second, how much faster than real time the streams advance, and the busy time per pipeline stage.
+
+Run from the repository root: python -m tools.benchmark_pipeline --model small --streams 1 4 16
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+from src.melvin.StreamTranscriber import StreamTranscriber
+from src.run.Dataset import Dataset
+
+BYTES_PER_SECOND = 32000
+
+
+async def run_stream(transcriber, audio_bytes, step_seconds, window_seconds, max_windows):
+    """Advances the window by `step_seconds` per transcription, returns the number of windows and audio seconds"""
+    step = int(step_seconds * BYTES_PER_SECOND)
+    window = int(window_seconds * BYTES_PER_SECOND)
+    windows = 0
+    for end in range(step, len(audio_bytes) + 1, step):
+        await transcriber.transcribe_async(audio_bytes[max(0, end - window) : end], "")
+        windows += 1
+        if windows == max_windows:
+            break
+    return windows, windows * step_seconds
+
+
+async def run(transcriber, recordings, streams, args):
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[
+            run_stream(transcriber, audio_bytes, args.step_seconds, args.window_seconds, args.windows_per_stream)
+            for audio_bytes in itertools.islice(itertools.cycle(recordings), streams)
+        ]
+    )
+    seconds = time.perf_counter() - start
+    windows = sum(result[0] for result in results)
+    audio_seconds = sum(result[1] for result in results)
+    return windows / seconds, audio_seconds / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--dataset", default="librispeech-pc-test-clean")
+    parser.add_argument("--cpu-threads", type=int, default=4)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--preprocess-workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--step-seconds", type=float, default=1.0)
+    parser.add_argument("--window-seconds", type=float, default=15.0)
+    parser.add_argument("--windows-per-stream", type=int, default=10)
+    args = parser.parse_args()
+
+    recordings = [audio_bytes for _, audio_bytes, _ in itertools.islice(Dataset(args.dataset), max(args.streams))]
+    default = StreamTranscriber.for_cpu(args.model, args.cpu_threads, args.num_workers)
+    pipelined = StreamTranscriber.for_cpu(
+        args.model,
+        args.cpu_threads,
+        args.num_workers,
+        mode="pipelined",
+        pipeline_queue_size=args.queue_size,
+        preprocess_workers=args.preprocess_workers,
+    )
+
+    print(f"{'streams':>7} {'default win/s':>14} {'pipelined win/s':>16} {'speedup':>8} {'x real time':>12}")
+    for streams in args.streams:
+        default_rate, _ = asyncio.run(run(default, recordings, streams, args))
+        pipelined_rate, realtime_factor = asyncio.run(run(pipelined, recordings, streams, args))
+        print(
+            f"{streams:>7} {default_rate:>14.2f} {pipelined_rate:>16.2f} {pipelined_rate / default_rate:>8.2f} "
+            f"{realtime_factor:>12.2f}"
+        )
+    print(f"Pipeline stages: {pipelined.pipeline_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares two run directories of run.py with the same dataset ids, e.g. a real-time run against a run with
+`virtual_clock`: the WER between their final transcripts, the number of partials and finals, and the latencies of
+both runs (observation time of each final after the end of its last word, and of each partial after the end of its
+window).
+
+Run from the repository root: python -m tools.compare_runs out/<real-time run> out/<virtual clock run>
+"""
+
+import argparse
+import json
+import os
+import statistics
+
+from jiwer import wer
+
+FINAL_SUFFIX = "_final.json"
+
+
+def load(directory, sample_id, suffix):
+    with open(os.path.join(directory, sample_id + suffix)) as f:
+        return json.load(f)
+
+
+def sample_stats(directory, sample_id):
+    final_words = load(directory, sample_id, FINAL_SUFFIX)
+    final_messages = load(directory, sample_id, "_final_messages.json")
+    partials = load(directory, sample_id, "_partial.json")
+    return {
+        "text": " ".join(word["word"].strip() for word in final_words),
+        "finals": len(final_messages),
+        "partials": len(partials),
+        "final_latencies": [
+            message["observation_time"] - message["result"][-1]["end"] for message in final_messages if message["result"]
+        ],
+        "partial_latencies": [partial["observation_time"] - partial["window"][1] for partial in partials],
+    }
+
+
+def median(values):
+    return statistics.median(values) if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("reference", help="Run directory to compare against, e.g. the real-time run")
+    parser.add_argument("candidate", help="Run directory to compare, e.g. the virtual clock run")
+    args = parser.parse_args()
+
+    sample_ids = sorted(
+        name[: -len(FINAL_SUFFIX)]
+        for name in os.listdir(args.reference)
+        if name.endswith(FINAL_SUFFIX) and os.path.exists(os.path.join(args.candidate, name))
+    )
+    if len(sample_ids) == 0:
+        print("The directories have no samples in common")
+        return
+
+    print(
+        f"{'sample':>20} {'WER between':>12} {'finals':>11} {'partials':>11} "
+        f"{'final latency s':>17} {'partial latency s':>19}"
+    )
+    texts = ([], [])
+    latencies = {"final_latencies": ([], []), "partial_latencies": ([], [])}
+    for sample_id in sample_ids:
+        reference = sample_stats(args.reference, sample_id)
+        candidate = sample_stats(args.candidate, sample_id)
+        texts[0].append(reference["text"] or "-")
+        texts[1].append(candidate["text"] or "-")
+        for key, (reference_values, candidate_values) in latencies.items():
+            reference_values.extend(reference[key])
+            candidate_values.extend(candidate[key])
+        print(
+            f"{sample_id:>20} {wer(texts[0][-1], texts[1][-1]):>12.3f} "
+            f"{reference['finals']:>5}/{candidate['finals']:<5} {reference['partials']:>5}/{candidate['partials']:<5} "
+            f"{median(reference['final_latencies']):>8.2f}/{median(candidate['final_latencies']):<8.2f} "
+            f"{median(reference['partial_latencies']):>9.2f}/{median(candidate['partial_latencies']):<9.2f}"
+        )
+
+    print(f"\nWER of the candidate against the reference over {len(sample_ids)} samples: {wer(texts[0], texts[1]):.3f}")
+    for key, (reference_values, candidate_values) in latencies.items():
+        print(
+            f"Median {key.replace('_', ' ')}: {median(reference_values):.2f} s (reference), "
+            f"{median(candidate_values):.2f} s (candidate)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Load test of the websocket server (serve.py): streams dataset recordings in real time over concurrent sessions with
+WebsocketTranscriberAdapter and reports how far the sessions fall behind real time and their WER.
+
+Run from the repository root while the server is running:
+    python -m tools.websocket_load --sessions 4 --url ws://localhost:8765
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import time
+
+from jiwer import wer
+
+from src.run.Dataset import Dataset
+from src.run.StreamingTranscriber import StreamingTranscriber
+from src.run.WebsocketTranscriberAdapter import AUDIO_FILE_LENGTH, WebsocketTranscriberAdapter
+
+
+async def run_session(url, audio_bytes, reference):
+    transcriber = StreamingTranscriber(WebsocketTranscriberAdapter(url), chunk_length_ms=int(AUDIO_FILE_LENGTH * 1000))
+    start_time = time.perf_counter()
+    transcript = await asyncio.to_thread(asyncio.run, transcriber.transcribe(audio_bytes))
+    audio_seconds = len(audio_bytes) / 32000
+    return (time.perf_counter() - start_time) / audio_seconds, wer(reference, transcript) if transcript else 1.0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://localhost:8765")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--dataset", default="librispeech-pc-test-clean")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="CPU cores used by the server")
+    args = parser.parse_args()
+
+    recordings = list(itertools.islice(Dataset(args.dataset), max(args.sessions)))
+    print(f"{'sessions':>8} {'sessions/core':>13} {'max wall/audio':>15} {'mean WER':>9}")
+    for sessions in args.sessions:
+        results = await asyncio.gather(
+            *[
+                run_session(args.url, audio_bytes, reference)
+                for _, audio_bytes, reference in itertools.islice(itertools.cycle(recordings), sessions)
+            ]
+        )
+        slowdown = max(result[0] for result in results)
+        mean_wer = sum(result[1] for result in results) / len(results)
+        print(f"{sessions:>8} {sessions / args.cores:>13.2f} {slowdown:>15.2f} {mean_wer:>9.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())